@@ -0,0 +1,132 @@
+# Batch screening of a pm.py export
+# A PM's whole request list is screened in one pass instead of one Submit
+# per line: the comments are parsed together, requests screening for the
+# same bonds are screened once, and every request goes through the shared mask cache so a
+# clause used by many lines (a state list, a rating range) is built once.
+# Large batches are split over a pool of forked processes that inherit the
+# universe.
+# Usage: python batch.py export.csv [--out results.csv] [--processes N]
+import argparse
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import comments
+import screen
+
+# batches with at least this many distinct requests use the process pool
+POOL_MIN = 2000
+
+# universe the forked workers screen against, set in each worker only
+_universe = None
+
+
+# sets the universe of a pool worker, the workers are forked so the
+# universe is inherited rather than pickled, and the parent's module state is
+# never touched (batches running together each give their own pool theirs)
+def _share(universe):
+    global _universe
+    _universe = universe
+
+
+# screens a share of the requests in a worker process, row ids are sent
+# back as int32 to halve what is pickled
+def _screen_chunk(criteria):
+    return [screen.run(c, _universe).astype(np.int32) for c in criteria]
+
+
+# screens every request of a batch
+# Input: list of comments (lines of a pm.py export), NormalizedUniverse,
+# number of processes (None for one per cpu, 1 to stay in this process)
+# Output: (list of {'row', 'comment', 'count', 'cusips', 'error'} for every
+# non blank line, summary dictionary with the wall time in seconds)
+def screen_batch(lines, universe, processes=None):
+    start = time.perf_counter()
+    frame, errors = comments.parse_batch(lines)
+    failed = {e['row']: e['error'] for e in errors}
+
+    # requests differing only in fields that don't screen (like the manager
+    # comment or settle date) or in bounds selecting the same bonds have the
+    # same plan (see screen.plan_key) and are screened once
+    lines_of = {}
+    for i, values in enumerate(frame.to_dict('records')):
+        if i not in failed and values['size'] is not None:
+            lines_of.setdefault(screen.Criteria(**values), []).append(i)
+    requests = {}
+    for c, rows in lines_of.items():
+        key = screen.plan_key(screen.compile_plan(c, universe), universe)
+        requests.setdefault(key, (c, []))[1].extend(rows)
+    distinct = list(requests)
+
+    processes = processes or multiprocessing.cpu_count()
+    pooled = (processes > 1 and len(distinct) >= POOL_MIN
+              and 'fork' in multiprocessing.get_all_start_methods())
+    if pooled:
+        chunks = [distinct[k::processes * 4] for k in range(processes * 4)]
+        with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('fork'),
+                                 initializer=_share, initargs=(universe,)) as pool:
+            done = list(pool.map(_screen_chunk, [[requests[key][0] for key in chunk] for chunk in chunks]))
+        found = {}
+        for chunk, rows in zip(chunks, done):
+            found.update(zip(chunk, rows))
+    else:
+        found = {key: screen.run(requests[key][0], universe) for key in distinct}
+
+    cusip = universe.frame['CUSIP'].to_numpy()
+    matched = {}
+    for key, (c, rows) in requests.items():
+        for i in rows:
+            matched[i] = found[key]
+    results = []
+    for i, line in enumerate(lines):
+        if i in matched:
+            rows = matched[i]
+            results.append({'row': i, 'comment': line, 'count': len(rows),
+                            'cusips': cusip[rows].tolist(), 'error': None})
+        elif i in failed:
+            results.append({'row': i, 'comment': line, 'count': None,
+                            'cusips': [], 'error': failed[i]})
+
+    summary = {
+        'requests': len(results), 'distinct': len(distinct),
+        'errors': len(failed), 'processes': processes if pooled else 1,
+        'seconds': time.perf_counter() - start,
+    }
+    return results, summary
+
+
+# batch results as a table, one row per request with its CUSIPs joined by spaces
+def as_frame(results):
+    return pd.DataFrame({
+        'Request': [r['row'] + 1 for r in results],
+        'Comment': [r['comment'] for r in results],
+        'Matches': pd.Series([r['count'] for r in results], dtype=object),
+        'CUSIPs': [' '.join(r['cusips']) for r in results],
+        'Error': [r['error'] or '' for r in results],
+    })
+
+
+if __name__ == '__main__':
+    import loader
+    from universe import NormalizedUniverse
+
+    parser = argparse.ArgumentParser(description='Screens every request of a pm.py export')
+    parser.add_argument('export', help='csv exported from pm.py, one comment per line')
+    parser.add_argument('--sheet', default='IMGR1.xlsx', help='offering sheet')
+    parser.add_argument('--out', help='csv of the matching CUSIPs per request')
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args()
+
+    df, _ = loader.load_offerings(args.sheet, loader.SCHEMA)
+    universe = NormalizedUniverse.from_offerings(df)
+    lines = comments.read_export(args.export)
+    results, summary = screen_batch(lines, universe, args.processes)
+    if args.out:
+        as_frame(results).to_csv(args.out, index=False)
+    for r in results:
+        print('%5d  %s' % (r['row'] + 1, r['error'] or '%d matches' % r['count']))
+    print('%(requests)d requests (%(distinct)d distinct, %(errors)d errors) screened in '
+          '%(seconds).3f s with %(processes)d process(es)' % summary)
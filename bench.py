@@ -0,0 +1,193 @@
+# Benchmarks for the trader dashboard
+# Universes of any size are made by resampling the rows of IMGR1.xlsx
+# Usage: python bench.py payload [--sizes 1000 10000 100000]
+#        python bench.py ingest [--sizes 1000 10000 100000]
+#        python bench.py comments [--sizes 1000 10000 100000]
+#        python bench.py delta [--universe 100000] [--sizes 10 100 1000 10000]
+import argparse
+import gzip
+import json
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import plotly.utils
+
+import comments
+import delta
+import ingest
+import loader
+import payload
+from universe import RATING, NormalizedUniverse, rating_codes
+
+
+# universe of n offerings resampled from the sample sheet, with coupons and
+# sizes spread out so screens don't all match the same rows
+def synthetic(n, path='IMGR1.xlsx', seed=0):
+    df, _ = loader.load_offerings(path, loader.SCHEMA)
+    # only rated bonds, the universe drops the rest
+    df = df[df[RATING].astype(str).str.upper().isin(rating_codes)]
+    rng = np.random.default_rng(seed)
+    df = df.iloc[rng.integers(0, len(df), n)].reset_index(drop=True)
+    df['Coupon'] = rng.choice([2, 3, 4, 5, 6, 7, 8], n).astype(float)
+    df['Ask Size'] = rng.integers(5, 200, n) * 10000
+    # every row gets its own CUSIP so offerings stay unique
+    df['CUSIP'] = ['%09d' % i for i in range(n)]
+    return NormalizedUniverse.from_offerings(df)
+
+
+# best time of a few runs, in milliseconds
+def _timed(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        took = (time.perf_counter() - start) * 1000
+        best = took if best is None else min(best, took)
+    return best, out
+
+
+# bytes on wire and encode time of the records payload Dash sends today
+# against the columnar orjson payload, with gzip and brotli sizes
+def bench_payload(sizes):
+    # the dashboard module loads the sample sheet when imported
+    import webapp
+
+    print('%8s  %-22s %10s %10s %10s %10s' % ('rows', 'path', 'encode ms', 'bytes', 'gzip', 'br'))
+    for n in sizes:
+        u = synthetic(n)
+        frame = webapp.format_rows(u.frame.take(np.arange(min(n, u.size))))
+
+        # to_dict('records') then Dash's PlotlyJSONEncoder
+        ms, body = _timed(lambda: json.dumps(
+            frame.to_dict('records'), cls=plotly.utils.PlotlyJSONEncoder).encode('utf-8'))
+        _report(len(frame), 'records + json', ms, body)
+
+        ms, body = _timed(lambda: payload.dumps(payload.columnar(frame)))
+        engine = 'orjson' if payload.orjson is not None else 'json'
+        _report(len(frame), 'columnar + ' + engine, ms, body)
+
+
+def _report(n, name, ms, body):
+    zipped = len(gzip.compress(body, compresslevel=5))
+    br = len(payload.brotli.compress(body, quality=4)) if payload.brotli is not None else 0
+    print('%8d  %-22s %10.1f %10d %10d %10d' % (n, name, ms, len(body), zipped, br))
+
+
+# batch of n random requests in the pm.py api's json format, about one in
+# ten with a crossed coupon range
+def synthetic_requests(n, seed=0):
+    import pm
+
+    rng = np.random.default_rng(seed)
+    ratings = list(pm.wells)
+    low = rng.choice(pm.coupon, n)
+    return [{
+        'increment': int(rng.integers(1, 51)),
+        'size': int(rng.integers(1, 100)) * 10000,
+        'general': 'Yes' if rng.random() < 0.5 else 'No',
+        'stateIncl': ' '.join(rng.choice(pm.usa[:50], rng.integers(0, 3), replace=False)),
+        'couponMin': int(low[i]),
+        'couponMax': int(low[i]) + (-1 if rng.random() < 0.1 else int(rng.integers(0, 3))),
+        'maturityMin': int(rng.choice(pm.years[:10])),
+        'ratingMin': ratings[int(rng.integers(5, 10))],
+        'ratingMax': ratings[int(rng.integers(0, 5))],
+        'manager': 'model %d' % i,
+    } for i in range(n)]
+
+
+# requests per second through the pm.py bulk api: parse, validate and store
+def bench_ingest(sizes):
+    import pm
+    from requeststore import RequestStore
+
+    print('%8s  %10s %10s %10s %12s' % ('requests', 'parse ms', 'check ms', 'store ms', 'requests/s'))
+    for n in sizes:
+        body = json.dumps(synthetic_requests(n)).encode('utf-8')
+        parse, frame = _timed(lambda: ingest.read_batch(body, 'application/json'))
+        check, (rows, errors) = _timed(lambda: pm.validator.validate(frame))
+        with tempfile.TemporaryDirectory() as directory:
+            store = RequestStore(directory)
+            write, _ = _timed(lambda: store.extend('bench', rows), repeat=1)
+        total = parse + check + write
+        print('%8d  %10.1f %10.1f %10.1f %12.0f' % (n, parse, check, write, n / total * 1000))
+
+
+# n comments in the pm.py export format, the export's csv of random requests
+def synthetic_comments(n, seed=0):
+    import pm
+    from requeststore import RequestStore
+
+    rows, _ = pm.validator.validate(ingest.read_batch(synthetic_requests(n, seed)))
+    with tempfile.TemporaryDirectory() as directory:
+        store = RequestStore(directory)
+        store.extend('bench', rows)
+        text = store.frame('bench', pm.col_names + ['Manager Comment']).to_csv(index=False)
+    lines = text.splitlines()[1:]
+    # some random requests are rejected, repeat the rest up to n
+    return (lines * (n // len(lines) + 1))[:n]
+
+
+# comments per second parsed one at a time and as a batch
+def bench_comments(sizes):
+    print('%8s  %12s %12s %12s' % ('comments', 'one ms', 'batch ms', 'batch/s'))
+    for n in sizes:
+        lines = synthetic_comments(n)
+        one, _ = _timed(lambda: [comments.parse(line) for line in lines], repeat=1)
+        batch, (_, errors) = _timed(lambda: comments.parse_batch(lines))
+        print('%8d  %12.1f %12.1f %12.0f' % (len(lines), one, batch, len(lines) / batch * 1000))
+
+
+# price, yield and size changes for n random offerings of a universe
+def synthetic_changes(universe, n, rng):
+    frame = universe.frame
+    rows = rng.choice(universe.size, n, replace=False)
+    changes = {col: frame[col].take(rows).astype(str).to_numpy() for col in delta.KEY}
+    changes['Ask Price'] = rng.uniform(90, 110, n).round(3)
+    changes['Ask Yield To Worst'] = rng.uniform(0.5, 5, n).round(2)
+    changes['Ask Size'] = rng.integers(5, 200, n) * 10000
+    return pd.DataFrame(changes)
+
+
+# changed offerings per second applied as deltas, against building the
+# universe's arrays and indexes again (without reading the sheet)
+def bench_delta(n, sizes, batches=5):
+    universe = synthetic(n).freeze()
+    rebuild, _ = _timed(lambda: NormalizedUniverse(universe.frame))
+    print('universe of %d offerings, indexes built in %.1f ms' % (n, rebuild))
+    print('%8s  %12s %12s' % ('changes', 'batch ms', 'rows/s'))
+    rng = np.random.default_rng(0)
+    ingest_ = delta.DeltaIngest()
+    universe, _, _ = ingest_.apply(universe, synthetic_changes(universe, 1, rng))
+    for size in sizes:
+        frames = [synthetic_changes(universe, size, rng) for _ in range(batches)]
+        start = time.perf_counter()
+        for frame in frames:
+            universe, _, summary = ingest_.apply(universe, frame)
+        ms = (time.perf_counter() - start) * 1000 / batches
+        print('%8d  %12.1f %12.0f' % (size, ms, size / ms * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Trader dashboard benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+    p = commands.add_parser('payload', help='table payload size and encode time')
+    p.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    p = commands.add_parser('ingest', help='pm.py bulk request api throughput')
+    p.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    p = commands.add_parser('comments', help='comment parser throughput')
+    p.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    p = commands.add_parser('delta', help='offering change throughput')
+    p.add_argument('--universe', type=int, default=100000)
+    p.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    args = parser.parse_args()
+
+    if args.command == 'payload':
+        bench_payload(args.sizes)
+    elif args.command == 'ingest':
+        bench_ingest(args.sizes)
+    elif args.command == 'comments':
+        bench_comments(args.sizes)
+    elif args.command == 'delta':
+        bench_delta(args.universe, args.sizes)
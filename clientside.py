@@ -0,0 +1,80 @@
+# Clientside (JavaScript) validators for the min/max dropdowns
+# The option lists are put in the page once (a dcc.Store) and the browser
+# narrows them itself, so changing a dropdown doesn't send a request to the
+# server just to rebuild a static list
+import json
+
+import dash_core_components as dcc
+from dash.dependencies import Input, Output, State
+
+# id of the store holding the option lists
+STORE = 'option-lists'
+
+# JavaScript keeping the options ranked on the right side of the partner's
+# value (ratings by their number, years and coupons by their value)
+# a partner value that isn't in the list leaves the options unchanged
+_ranked = """
+function(value, lists) {
+    var all = lists[%(name)s];
+    var options = function(items) {
+        return items.map(function(item) { return {label: item[0], value: item[0]}; });
+    };
+    if (value === null || value === undefined || value === '') {
+        return options(all);
+    }
+    var rank = null;
+    for (var i = 0; i < all.length; i++) {
+        if (String(all[i][0]) === String(value)) {
+            rank = all[i][1];
+        }
+    }
+    if (rank === null) {
+        return window.dash_clientside.no_update;
+    }
+    return options(all.filter(function(item) { return item[1] %(keep)s rank; }));
+}
+"""
+
+# JavaScript leaving out the values picked in the partner dropdown
+_excluded = """
+function(value, lists) {
+    var all = lists[%(name)s];
+    var picked = (value === null || value === undefined || value === '') ? [] : [].concat(value);
+    return all.filter(function(item) { return picked.indexOf(item[0]) < 0; })
+        .map(function(item) { return {label: item[0], value: item[0]}; });
+}
+"""
+
+
+# store component with the option lists for the page layout
+# Input: dictionary of list name to [[value, rank], ...]
+def option_store(lists):
+    return dcc.Store(id=STORE, data=lists)
+
+
+# option list where each value ranks as itself (years, coupons, states)
+def plain(values):
+    return [[v, v] for v in values]
+
+
+# option list ranked by a dictionary (ratings)
+def ranked(ranks):
+    return [[k, v] for k, v in ranks.items()]
+
+
+# registers a clientside callback narrowing the options of one dropdown
+# from the value of its partner
+# Input: app, id of dropdown to narrow, id of partner dropdown, option list
+# name, keep ('>=' or '<=' to keep options ranked on that side of the
+# partner's value, 'not in' to leave out the partner's values)
+def narrow(app, output, partner, name, keep):
+    if keep == 'not in':
+        function = _excluded % {'name': json.dumps(name)}
+    else:
+        function = _ranked % {'name': json.dumps(name), 'keep': keep}
+    app.clientside_callback(
+        function,
+        Output(output, 'options'),
+        [Input(partner, 'value')],
+        [State(STORE, 'data')]
+    )
@@ -0,0 +1,325 @@
+# Parser for PM comments (the pm.py export format)
+# A comment is one line of the exported request table:
+#
+#   comment := field (',' field)* [',' rest]    13 fields at most, missing ones are blank
+#   field   := list | quoted | plain
+#   list    := '[' state ((',' | ' ') state)* ']'    quotes around states optional
+#   quoted  := '"' text '"'            csv quoting, "" is a quote
+#   plain   := text without , [ ] "
+#   rest    := text to the end of the line    the 14th field, the Manager
+#                                             Comment, unquoted when quoted whole
+#
+# Fields are tokenized once and converted by their position (see FIELDS),
+# so lists and quoted text can appear in any field and a bad value is
+# reported with the field and the column it starts at. Whole exports are
+# parsed in one pass, one column of fields at a time.
+import re
+from datetime import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+from universe import rating
+
+# text of one field: a list, quoted text or plain text, a blank field has
+# no text; plain text starts and ends on a non-space and the spaces before
+# a blank field go to one \s*, so a malformed comment fails in linear time
+_enclosed_text = r'\[[^\]]*\]|"(?:[^"]|"")*"'
+_field_text = _enclosed_text + r'|[^,\[\]"\s](?:[^,\[\]"]*[^,\[\]"\s])?'
+# one field and the separator after it
+_scanner = re.compile(r'\s*(?:(%s)\s*)?(,|$)' % _field_text)
+# fields only, for splitting many comments at once
+_splitter = re.compile(r'\s*(?:(%s)\s*)?(?:,|$)' % _field_text)
+# a comment made only of well formed fields
+_comment = re.compile(r'(?:\s*(?:(?:%s)\s*)?(?:,|$))+' % _field_text)
+# a list or quoted text at the start of a field
+_enclosed = re.compile(_enclosed_text)
+_quoted = re.compile(r'"(?:[^"]|"")*"')
+_special = re.compile(r'[\[\]"]')
+# separators inside a state field
+_state_split = r"[\s,'\"\[\]]+"
+_state = re.compile(r'[A-Za-z]{2}')
+_year = re.compile(r'\d{4}')
+_general = {'YES': 'Yes', 'Y': 'Yes', 'NO': 'No', 'N': 'No'}
+
+
+class CommentError(ValueError):
+
+    # Input: reason, field name (None for the comment as a whole), column in
+    # the comment where the problem is (0 based)
+    def __init__(self, reason, field=None, column=None):
+        message = reason if field is None else '%s: %s' % (field, reason)
+        if column is not None:
+            message = '%s at column %d' % (message, column + 1)
+        super().__init__(message)
+        self.reason = reason
+        self.field = field
+        self.column = column
+
+
+# the last field (Manager Comment) is free text up to the end of the line,
+# unquoted when it is quoted as a whole
+# Output: (text, column where it starts)
+def _rest(comment, pos):
+    text = comment[pos:].strip()
+    column = len(comment) - len(comment[pos:].lstrip())
+    if _quoted.fullmatch(text):
+        text = text[1:-1].replace('""', '"').strip()
+    return text, column
+
+
+# splits a comment into the text of its fields, unquoted and stripped
+# Input: comment string
+# Output: list of (text, column where the field starts)
+def tokenize(comment):
+    tokens = []
+    pos = 0
+    while True:
+        if len(tokens) == len(FIELDS) - 1:
+            tokens.append(_rest(comment, pos))
+            return tokens
+        match = _scanner.match(comment, pos)
+        if match is None:
+            start = len(comment) - len(comment[pos:].lstrip())
+            enclosed = _enclosed.match(comment, start)
+            if enclosed is not None:
+                kind = 'list' if enclosed.group().startswith('[') else 'quoted text'
+                raise CommentError('expected , after the %s' % kind, None, enclosed.end())
+            column = _special.search(comment, start).start()
+            char = comment[column]
+            if column == start and char == '[':
+                raise CommentError('list is not closed with ]', None, column)
+            if column == start and char == '"':
+                raise CommentError('quote is not closed', None, column)
+            raise CommentError('unexpected %s' % char, None, column)
+        text = match.group(1)
+        if text is None:
+            tokens.append(('', match.start(2)))
+        else:
+            if text.startswith('"'):
+                text = text[1:-1].replace('""', '"').strip()
+            tokens.append((text, match.start(1)))
+        # the last field ends the comment, a comma always has one after it
+        if match.group(2) != ',':
+            return tokens
+        pos = match.end()
+
+
+# Converters from field text to the Criteria value, raising ValueError with
+# the reason the text was rejected
+
+def _number(text):
+    try:
+        return float(text)
+    except ValueError:
+        raise ValueError('expected a number')
+
+
+def _whole(text):
+    value = _number(text)
+    if value != int(value) or value < 1:
+        raise ValueError('expected a whole number')
+    return int(value)
+
+
+def _yes_no(text):
+    value = _general.get(text.upper())
+    if value is None:
+        raise ValueError('expected Yes or No')
+    return value
+
+
+def _states(text):
+    items = [s for s in re.split(_state_split, text) if s != '']
+    for s in items:
+        if not _state.fullmatch(s):
+            raise ValueError('%r is not a state abbreviation' % s)
+    return tuple(s.upper() for s in items)
+
+
+def _year_start(text):
+    if not _year.fullmatch(text):
+        raise ValueError('expected a year')
+    return dt(int(text), 1, 1)
+
+
+def _year_end(text):
+    return _year_start(text).replace(month=12, day=31)
+
+
+def _rating(text):
+    code = rating.get(text.upper())
+    if code is None:
+        raise ValueError('unknown rating %r' % text)
+    return code
+
+
+# a blank required field is an error
+REQUIRED = object()
+
+# fields in comment order: (name, Criteria field, converter, value when
+# blank), text fields have no converter
+FIELDS = [
+    ('Increment', 'increment', _whole, None),
+    ('Size ($)', 'size', _number, REQUIRED),
+    ('General Market (Y/N)', 'general', _yes_no, ''),
+    ('State (include)', 'include', _states, ()),
+    ('State (exclude)', 'exclude', _states, ()),
+    ('Coupon Min (%)', 'coupon_min', _number, None),
+    ('Coupon Max (%)', 'coupon_max', _number, None),
+    ('Maturity Min', 'maturity_min', _year_start, None),
+    ('Maturity Max', 'maturity_max', _year_end, None),
+    ('Call', 'call_min', _year_start, None),
+    ('Rating Min', 'rating_min', _rating, None),
+    ('Rating Max', 'rating_max', _rating, None),
+    ('Settle Date After', 'settle', None, ''),
+    ('Manager Comment', 'manager', None, ''),
+]
+
+
+# text of each field, missing trailing fields are blank
+# Input: comment string
+# Output: list of 14 (text, column) pairs
+def fields(comment):
+    tokens = tokenize(comment)
+    return tokens + [('', len(comment))] * (len(FIELDS) - len(tokens))
+
+
+# parses a PM comment into the values of a Criteria record
+# Input: comment string
+# Output: dictionary of Criteria field to value, None for a blank comment
+def parse(comment):
+    if comment is None or comment.strip() == '':
+        return None
+    values = {}
+    for (name, key, convert, blank), (text, column) in zip(FIELDS, fields(comment)):
+        if text == '':
+            if blank is REQUIRED:
+                raise CommentError('required', name, column)
+            values[key] = blank
+            continue
+        if convert is None:
+            values[key] = text
+            continue
+        try:
+            values[key] = convert(text)
+        except ValueError as e:
+            raise CommentError(str(e), name, column)
+    return values
+
+
+# converts a column of field text, each distinct text once
+# Output: (values, mask of texts the converter rejected)
+def _convert_column(convert, text):
+    codes, uniques = pd.factorize(text)
+    values = np.empty(len(uniques), dtype=object)
+    wrong = np.zeros(len(uniques), dtype=bool)
+    for k, unique in enumerate(uniques):
+        try:
+            values[k] = convert(unique)
+        except ValueError:
+            wrong[k] = True
+    return values[codes], wrong[codes]
+
+
+# parses many comments in one pass
+# comments are split into a grid of field text, and each field is converted
+# a column at a time, converting each distinct value once (a request list
+# repeats the same states, years and ratings); the few comments with an
+# error go through parse() for the exact message
+# Input: iterable of comment strings
+# Output: (data frame with one column per Criteria field and one row per
+# comment, list of {'row', 'field', 'error'}); size is missing for rows with
+# an error or a blank comment
+def parse_batch(comments):
+    comments = ['' if c is None else str(c) for c in comments]
+    n = len(comments)
+    width = len(FIELDS)
+
+    blank = np.zeros(n, dtype=bool)
+    bad = np.zeros(n, dtype=bool)
+    quoted = []
+    grid = []
+    for i, comment in enumerate(comments):
+        tokens = []
+        if comment.strip() == '':
+            blank[i] = True
+        elif _comment.fullmatch(comment) is not None:
+            tokens = _splitter.findall(comment)
+            # findall also matches the empty text at the end of the
+            # comment, which is a field only after a trailing comma
+            if not comment.rstrip().endswith(','):
+                tokens.pop()
+            if '"' in comment:
+                quoted.append(i)
+        if len(tokens) > width or (not tokens and not blank[i]):
+            # a Manager Comment with , [ ] or " in it, or a bad comment
+            try:
+                tokens = [text for text, column in tokenize(comment)]
+            except CommentError:
+                tokens = []
+                bad[i] = True
+            if quoted and quoted[-1] == i:
+                quoted.pop()
+        grid.append(tokens + [''] * (width - len(tokens)))
+    grid = np.array(grid, dtype=object).reshape(n, width)
+    for i in quoted:
+        for j in range(width):
+            if grid[i, j].startswith('"'):
+                grid[i, j] = grid[i, j][1:-1].replace('""', '"').strip()
+
+    out = {}
+    for j, (name, key, convert, blank_value) in enumerate(FIELDS):
+        text = grid[:, j]
+        given = text != ''
+        if convert is None:
+            values = text
+        else:
+            values, wrong = _convert_column(convert, text)
+            bad |= given & wrong
+        if blank_value is REQUIRED:
+            bad |= ~given & ~blank
+            blank_value = None
+        column = np.empty(n, dtype=object)
+        column.fill(blank_value)
+        column[given] = values[given]
+        out[key] = pd.Series(column, dtype=object)
+
+    errors = []
+    for i in np.flatnonzero(bad):
+        try:
+            parse(comments[i])
+            # kept out even if the single parser would take it
+            errors.append({'row': int(i), 'field': None, 'error': 'not a valid comment'})
+        except CommentError as e:
+            errors.append({'row': int(i), 'field': e.field, 'error': str(e)})
+
+    frame = pd.DataFrame(out)
+    frame.loc[bad | blank, 'size'] = None
+    return frame, errors
+
+
+# comments of a pm.py export (or any file of one comment per line)
+# Input: path or file object
+# Output: list of comment strings, without the header line
+def read_export(source):
+    if hasattr(source, 'read'):
+        text = source.read()
+    else:
+        with open(source, encoding='utf-8') as f:
+            text = f.read()
+    if isinstance(text, bytes):
+        text = text.decode('utf-8')
+    lines = text.splitlines()
+    # the export starts with the table headers
+    if lines and lines[0].split(',')[0].strip() == FIELDS[0][0]:
+        lines = lines[1:]
+    return lines
+
+
+# reads and parses a pm.py export
+# Output: (list of comments, data frame, errors) as parse_batch
+def parse_export(source):
+    lines = read_export(source)
+    frame, errors = parse_batch(lines)
+    return lines, frame, errors
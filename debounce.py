@@ -0,0 +1,95 @@
+# Coalescing of rapid input changes
+# Each change of the explanatory table fires the screen callback, picking
+# three dropdowns in a row would run three screens. The browser holds the
+# changes until no field changed for a short delay and only then hands the
+# settled fields to the screen callback, so only the settled criteria get
+# screened and no server thread waits out the delay. A click on the trigger
+# (Refilter) hands the fields over at once.
+import threading
+
+import dash_core_components as dcc
+from dash.dependencies import Input, Output
+
+# id of the interval checking whether the fields settled
+TICK = 'debounce-tick'
+
+# JavaScript keeping the newest fields until they settle, the tick runs only
+# while changes are waiting
+_settle = """
+function() {
+    var state = window.imgrDebounce = window.imgrDebounce || {pending: null, due: 0};
+    var none = window.dash_clientside.no_update;
+    var triggered = window.dash_clientside.callback_context.triggered.map(function(t) {
+        return t.prop_id;
+    });
+    var values = Array.prototype.slice.call(arguments, 0, %(count)d);
+    if (triggered.indexOf('%(trigger)s.n_clicks') >= 0) {
+        state.pending = null;
+        return [values, true];
+    }
+    var changed = triggered.some(function(id) {
+        return id !== '%(tick)s.n_intervals' && id !== '.';
+    });
+    if (changed) {
+        state.pending = values;
+        state.due = Date.now() + %(delay)d;
+    }
+    if (state.pending === null) {
+        return [none, none];
+    }
+    if (Date.now() < state.due) {
+        return [none, false];
+    }
+    var settled = state.pending;
+    state.pending = null;
+    return [settled, true];
+}
+"""
+
+
+# Counts of the settled fields the screen callback received against the
+# screens it ran, a click with incomplete fields is received but not screened
+class Inputs:
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.received = 0
+        self.executed = 0
+        self._lock = threading.Lock()
+
+    def receive(self):
+        with self._lock:
+            self.received += 1
+
+    def execute(self):
+        with self._lock:
+            self.executed += 1
+
+    def stats(self):
+        with self._lock:
+            return {'delay': self.delay, 'received': self.received, 'executed': self.executed}
+
+
+# components the debouncing needs in the page layout
+# Input: id of the store the settled fields are put in
+def components(output):
+    return [
+        dcc.Store(id=output),
+        dcc.Interval(id=TICK, interval=100, disabled=True),
+    ]
+
+
+# registers the clientside callback putting [trigger clicks, field values...]
+# in the output store once the fields settled, or at once on a click
+# Input: app, id of the output store, id of the trigger button, list of
+# (component id, property) of the fields, delay in seconds (0 hands every
+# change over at once)
+def register(app, output, trigger, fields, delay):
+    function = _settle % {'count': len(fields) + 1, 'trigger': trigger, 'tick': TICK,
+                          'delay': int(delay * 1000)}
+    app.clientside_callback(
+        function,
+        [Output(output, 'data'),
+        Output(TICK, 'disabled')],
+        [Input(trigger, 'n_clicks')] + [Input(c, p) for c, p in fields] + [Input(TICK, 'n_intervals')]
+    )
@@ -0,0 +1,397 @@
+# Incremental updates of the offering universe
+# Dealers re-send offerings through the day with new prices, yields and
+# sizes. A delta names each offering by (CUSIP, Ask Dealer, Ask Source) and
+# inserts, updates or withdraws it. The changes go into a new version of the
+# universe that shares every column and index the delta doesn't touch (see
+# NormalizedUniverse.changed), instead of reading the whole workbook again.
+import fcntl
+import glob
+import io
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from universe import OFFERING, RATING, NOT_CALLABLE, col_names, rating_codes
+
+# columns naming an offering
+KEY = OFFERING
+
+# columns a change can set, CUSIP6 comes from the CUSIP
+VALUES = [col for col in col_names if col not in KEY and col != 'CUSIP6']
+
+# actions of a change, blank inserts a new offering or updates a known one
+ACTIONS = ('insert', 'update', 'withdraw', '')
+
+_numbers = ['Coupon', 'Ask Price', 'Ask Yield To Worst', 'Ask Size']
+
+
+# reads a batch of changes
+# Input: request body, content type ('text/csv' or json)
+# Output: data frame with one row per change
+def read_delta(body, content_type=''):
+    if 'csv' in content_type:
+        return pd.read_csv(io.BytesIO(body), dtype=str, keep_default_na=False)
+    records = json.loads(body) if isinstance(body, (bytes, str)) else body
+    # a list of changes or {'changes': [...]}
+    if isinstance(records, dict):
+        records = records.get('changes', [])
+    if not isinstance(records, list):
+        raise ValueError('expected a list of changes')
+    if not all(isinstance(r, dict) for r in records):
+        raise ValueError('expected every change to be an object')
+    return pd.DataFrame.from_records(records)
+
+
+# True where a cell was left blank (missing, None, NaN or empty text)
+def _blank(column):
+    return column.isnull().to_numpy() | (column.astype(str).str.strip() == '').to_numpy()
+
+
+# converts a column of changes from the sheet format to the universe types
+# Input: column name, column of values as sent
+# Output: dictionary of universe column to values, mask of values that
+# can't be read
+def _convert(col, column):
+    if col in _numbers:
+        values = pd.to_numeric(column, errors='coerce')
+        return {col: values}, values.isnull().to_numpy()
+    if col == RATING:
+        values = column.astype(str).str.strip().str.upper().map(rating_codes)
+        return {col: values}, values.isnull().to_numpy()
+    if col == 'Maturity':
+        values = pd.to_datetime(column, errors='coerce')
+        return {col: values}, values.isnull().to_numpy()
+    if col == 'Call Date':
+        callable_ = (column.astype(str).str.strip() != NOT_CALLABLE)
+        values = pd.to_datetime(column.where(callable_), errors='coerce')
+        return {col: values, 'callable': callable_}, (callable_ & values.isnull()).to_numpy()
+    return {col: column.astype(str).str.strip()}, np.zeros(len(column), dtype=bool)
+
+
+# applies batches of changes to the universe
+# keeps the row of every offering key of the universe it last changed, so a
+# batch costs in the size of the batch (one key lookup per change) rather
+# than the size of the universe
+class DeltaIngest:
+
+    def __init__(self):
+        self.batches = 0
+        self.changes = 0
+        self.seconds = 0.0
+        self._version = None
+        self._rows = {}
+        self._lock = threading.Lock()
+
+    # key lookups for a universe, built again when the universe came from
+    # somewhere else (a reloaded sheet)
+    def _index(self, universe):
+        if self._version == universe.version:
+            return
+        frame = universe.frame
+        cusip = frame['CUSIP'].astype(str).tolist()
+        dealer = frame['Ask Dealer'].astype(str).tolist()
+        source = frame['Ask Source'].astype(str).tolist()
+        self._rows = dict(zip(zip(cusip, dealer, source), range(universe.size)))
+        self._version = universe.version
+
+    # applies a batch of changes
+    # the last change of an offering in a batch wins, a change with a bad
+    # value is rejected as a whole
+    # Input: NormalizedUniverse, data frame from read_delta
+    # Output: (new NormalizedUniverse, or the same one when nothing changed,
+    # row ids of the offerings added or offered again, summary with the
+    # list of {'row', 'field', 'error'} of the rejected changes)
+    def apply(self, universe, changes):
+        start = time.perf_counter()
+        changes = changes.reset_index(drop=True)
+        n = len(changes)
+        errors = []
+        bad = np.zeros(n, dtype=bool)
+
+        def fail(mask, field, message):
+            for i in np.flatnonzero(mask & ~bad):
+                errors.append({'row': int(i), 'field': field, 'error': message})
+            bad[mask] = True
+
+        for col in KEY:
+            if col not in changes.columns:
+                changes[col] = ''
+            fail(_blank(changes[col]), col, 'required')
+        action = (changes['action'].fillna('').astype(str).str.strip().str.lower()
+                  if 'action' in changes.columns else pd.Series('', index=changes.index))
+        fail(~action.isin(ACTIONS).to_numpy(), 'action', 'one of insert, update, withdraw')
+
+        # values as sent and in universe types, blank values are left as they are
+        given = {}
+        converted = {}
+        for col in VALUES:
+            if col not in changes.columns:
+                continue
+            given[col] = ~_blank(changes[col])
+            converted[col], wrong = _convert(col, changes[col])
+            fail(given[col] & wrong, col, 'not a valid value')
+
+        with self._lock:
+            self._index(universe)
+            keys = list(zip(*(changes[col].astype(str).str.strip().tolist() for col in KEY)))
+            live = universe.live
+            rows = np.array([self._rows.get(k, -1) for k in keys], dtype=np.int64)
+            known = rows >= 0
+            offered = known.copy()
+            if live is not None:
+                offered[known] = live[rows[known]]
+            # earlier changes of an offering are replaced by its last one
+            last = ~pd.Series(keys, dtype=object).duplicated(keep='last').to_numpy()
+
+            is_withdraw = (action == 'withdraw').to_numpy()
+            is_insert = (action == 'insert').to_numpy()
+            is_update = (action == 'update').to_numpy()
+            fail(last & is_withdraw & ~offered, 'action', 'not offered')
+            fail(last & is_update & ~offered, 'action', 'not offered')
+            fail(last & is_insert & offered, 'action', 'already offered')
+            ok = last & ~bad
+            withdraw = ok & is_withdraw
+            add = ok & ~is_withdraw & ~known
+            revive = ok & ~is_withdraw & known & ~offered
+            update = ok & ~is_withdraw & offered
+            # new offerings need every value
+            for col in VALUES:
+                fail(add & ~given.get(col, np.zeros(n, dtype=bool)), col, 'required for a new offering')
+            add &= ~bad
+
+            # per column, the known rows whose value changes
+            updates = {}
+            change = update | revive
+            for col in given:
+                for target, values in converted[col].items():
+                    pick = change & given[col]
+                    at = rows[pick]
+                    new = values.to_numpy()[pick]
+                    current = universe.frame[target].take(at).to_numpy()
+                    if target in ('Maturity', 'Call Date'):
+                        new = new.astype('datetime64[ns]')
+                        current = current.astype('datetime64[ns]')
+                    same = (current == new) | (pd.isnull(current) & pd.isnull(new))
+                    if target in updates:
+                        # callable and Call Date come from the same column
+                        at, new = np.concatenate([updates[target][0], at[~same]]), np.concatenate([updates[target][1], new[~same]])
+                    else:
+                        at, new = at[~same], new[~same]
+                    if len(at):
+                        updates[target] = (at, new)
+            touched = set()
+            for at, _ in updates.values():
+                touched.update(at.tolist())
+            updated = len(touched & set(rows[update].tolist()))
+            unchanged = int(np.count_nonzero(update)) - updated
+
+            inserts = None
+            offering = None
+            added = np.flatnonzero(add)
+            if len(added):
+                inserts = pd.DataFrame({col: changes[col].astype(str).str.strip().to_numpy()[added] for col in KEY})
+                inserts['CUSIP6'] = inserts['CUSIP'].str[:6]
+                for col in VALUES:
+                    for target, values in converted[col].items():
+                        inserts[target] = values.to_numpy()[added]
+                inserts[RATING] = inserts[RATING].astype(np.int8)
+                inserts['callable'] = inserts['callable'].astype(bool)
+                inserts['Maturity'] = pd.to_datetime(inserts['Maturity'])
+                inserts['Call Date'] = pd.to_datetime(inserts['Call Date'])
+                # an added key is not in the universe, so it is a new offering
+                next_code = int(universe.offering.max(initial=-1)) + 1
+                offering = np.arange(next_code, next_code + len(added), dtype=universe.offering.dtype)
+
+            withdrawn = rows[withdraw]
+            revived = rows[revive]
+            if updates or inserts is not None or len(withdrawn) or len(revived):
+                new_universe = universe.changed(updates, inserts, offering, withdrawn, revived).freeze()
+                for j, i in enumerate(added):
+                    self._rows[keys[i]] = universe.size + j
+                self._version = new_universe.version
+            else:
+                new_universe = universe
+
+        seconds = time.perf_counter() - start
+        self.batches += 1
+        self.changes += n
+        self.seconds += seconds
+        errors.sort(key=lambda e: e['row'])
+        summary = {
+            'changes': n, 'inserted': len(added), 'updated': updated,
+            'unchanged': unchanged, 'withdrawn': len(withdrawn),
+            'revived': len(revived), 'errors': errors,
+            'version': new_universe.version, 'seconds': seconds,
+            'rows_per_second': n / seconds if seconds else None,
+        }
+        new_rows = np.concatenate([np.arange(universe.size, universe.size + len(added)), revived])
+        return new_universe, new_rows, summary
+
+    def stats(self):
+        return {'batches': self.batches, 'changes': self.changes, 'seconds': self.seconds,
+                'rows_per_second': self.changes / self.seconds if self.seconds else None}
+
+
+# Shared journal of the batches POSTed to /offerings
+# Under gunicorn every worker holds its own universe, so a batch is appended
+# to one journal file and every worker applies the journal's batches in file
+# order: the worker that received the batch right away (for the summary it
+# answers with), the others when they next read the journal. A worker forked
+# later reads the journal from the start and catches up.
+# A batch applies to the sheet it was made against, so each sheet has its
+# own file named after it and every line names its sheet. A worker reads the
+# file of the sheet it has loaded and, once it reloads, drops the file of the
+# old sheet and reads the new one from its start; batches made against an
+# older sheet are never applied to a newer one.
+# Input: path the journal files start with, function applying a data frame
+# of changes and returning its summary, function giving the name of the
+# loaded sheet, seconds between reads
+class Journal:
+
+    def __init__(self, path, apply, sheet, interval=1.0, keep=100):
+        self.path = path
+        self.apply = apply
+        self.sheet = sheet
+        self.interval = interval
+        self.keep = keep
+        self.batches = 0
+        self.skipped = 0
+        self.failures = 0
+        self.last_error = None
+        # line offset -> summary of the batches applied last
+        self._summaries = OrderedDict()
+        self._sheet = None
+        self._offset = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    # file of a sheet's batches
+    def file(self, sheet):
+        return '%s-%s.jsonl' % (self.path, sheet)
+
+    # removes the files of every sheet, for an app starting on a freshly
+    # loaded sheet
+    def reset(self):
+        with self._lock:
+            for path in glob.glob(glob.escape(self.path) + '-*.jsonl'):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self._sheet = None
+            self._offset = 0
+            self._summaries.clear()
+
+    # appends a batch of changes (a data frame from read_delta) to the file
+    # of the loaded sheet
+    # Output: (sheet, offset of the batch's line) to find its summary
+    def append(self, changes):
+        sheet = self.sheet()
+        line = '{"sheet": %s, "changes": %s}\n' % (json.dumps(sheet), changes.to_json(orient='records'))
+        with open(self.file(sheet), 'a', encoding='utf-8') as f:
+            # a line is written whole before another worker appends
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0, os.SEEK_END)
+                offset = f.tell()
+                f.write(line)
+            finally:
+                f.flush()
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return sheet, offset
+
+    # moves to the file of the loaded sheet once it was reloaded, the file of
+    # the old sheet is removed; must be called with the lock held
+    def _follow(self):
+        sheet = self.sheet()
+        if sheet == self._sheet:
+            return
+        if self._sheet is not None:
+            try:
+                os.remove(self.file(self._sheet))
+            except FileNotFoundError:
+                pass
+        self._sheet = sheet
+        self._offset = 0
+        self._summaries.clear()
+
+    # applies the batches appended to the loaded sheet's file since the last
+    # read, in file order
+    def catch_up(self):
+        with self._lock:
+            self._follow()
+            try:
+                f = open(self.file(self._sheet), 'rb')
+            except FileNotFoundError:
+                return
+            with f:
+                if os.fstat(f.fileno()).st_size < self._offset:
+                    # emptied by a restart
+                    self._offset = 0
+                f.seek(self._offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    if self.sheet() != self._sheet:
+                        # reloaded meanwhile, the next read moves on
+                        break
+                    offset = self._offset
+                    self._offset += len(line)
+                    try:
+                        batch = json.loads(line)
+                        if batch.get('sheet') != self._sheet:
+                            self.skipped += 1
+                            continue
+                        summary = self.apply(read_delta(batch))
+                    except Exception as e:
+                        self.failures += 1
+                        self.last_error = '%s: %s' % (type(e).__name__, e)
+                        summary = {'error': self.last_error}
+                    self.batches += 1
+                    self._summaries[offset] = summary
+                    while len(self._summaries) > self.keep:
+                        self._summaries.popitem(last=False)
+
+    # summary of a batch once this worker applied it, None when it hasn't
+    # yet (or was applied too long ago, or the sheet was reloaded since)
+    # Input: (sheet, offset) from append
+    def summary(self, position):
+        sheet, offset = position
+        with self._lock:
+            if sheet != self._sheet:
+                return None
+            return self._summaries.get(offset)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.catch_up()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='offering-journal', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    # threads don't survive a fork, a forked child that serves requests
+    # calls start() itself (see gunicorn.conf.py)
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def stats(self):
+        return {'path': self.path, 'sheet': self._sheet, 'batches': self.batches,
+                'offset': self._offset, 'skipped': self.skipped,
+                'failures': self.failures, 'last_error': self.last_error}
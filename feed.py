@@ -0,0 +1,241 @@
+# Streaming quote feed
+# Offering changes arrive as json lines, one change per line in the format
+# of the /offerings api ({"CUSIP": ..., "Ask Dealer": ..., "Ask Source": ...,
+# "Ask Price": ..., "action": ...}). A feed thread reads them from a local
+# stand-in for the dealer feed and hands them on in small batches, so a burst
+# of quotes costs one universe version instead of one per quote.
+# Sources: tail:<file> follows a file as it grows, tcp:<host>:<port> and
+# unix:<path> read a socket (see replay.py to drive one from a recording)
+import fcntl
+import json
+import os
+import select
+import socket
+import threading
+import time
+
+import pandas as pd
+
+
+# Follows a file as lines are appended to it
+# a file that is replaced or truncated is read again from its start
+class FileTail:
+
+    def __init__(self, path, from_start=False):
+        self.path = path
+        self._file = None
+        self._inode = None
+        self._start = from_start
+        self._rest = ''
+
+    def _open(self):
+        try:
+            self._file = open(self.path, encoding='utf-8')
+        except OSError:
+            return False
+        self._inode = os.fstat(self._file.fileno()).st_ino
+        if not self._start:
+            self._file.seek(0, os.SEEK_END)
+        # later files are read from their start
+        self._start = True
+        return True
+
+    # complete lines appended since the last read, waits up to timeout
+    # seconds when there are none
+    # Output: list of lines
+    def read(self, timeout):
+        if self._file is None and not self._open():
+            time.sleep(timeout)
+            return []
+        text = self._file.read()
+        if not text:
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                stat = None
+            if stat is None or stat.st_ino != self._inode or stat.st_size < self._file.tell():
+                self.close()
+                return []
+            time.sleep(timeout)
+            return []
+        lines = (self._rest + text).split('\n')
+        self._rest = lines.pop()
+        return lines
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._rest = ''
+
+
+# Reads lines from a stream socket, connecting again when it is closed
+# Input: address family (socket.AF_INET or AF_UNIX), address
+class SocketSource:
+
+    def __init__(self, family, address):
+        self.family = family
+        self.address = address
+        self._socket = None
+        self._rest = b''
+
+    # complete lines received, waits up to timeout seconds for some
+    # Output: list of lines
+    def read(self, timeout):
+        if self._socket is None:
+            try:
+                self._socket = socket.socket(self.family, socket.SOCK_STREAM)
+                self._socket.connect(self.address)
+            except OSError:
+                self.close()
+                time.sleep(timeout)
+                return []
+        ready, _, _ = select.select([self._socket], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = self._socket.recv(1 << 16)
+        except OSError:
+            data = b''
+        if not data:
+            self.close()
+            return []
+        lines = (self._rest + data).split(b'\n')
+        self._rest = lines.pop()
+        return [line.decode('utf-8', 'replace') for line in lines]
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+        self._socket = None
+        self._rest = b''
+
+
+# source for a feed address
+# Input: 'tail:<file>', 'tcp:<host>:<port>' or 'unix:<path>'
+def open_source(address):
+    kind, _, where = address.partition(':')
+    if kind == 'tail':
+        return FileTail(where)
+    if kind == 'tcp':
+        host, _, port = where.rpartition(':')
+        return SocketSource(socket.AF_INET, (host or '127.0.0.1', int(port)))
+    if kind == 'unix':
+        return SocketSource(socket.AF_UNIX, where)
+    raise ValueError('unknown feed %r, expected tail:, tcp: or unix:' % address)
+
+
+# Reads a source in a daemon thread and passes the changes on in batches
+# a batch is handed on every interval seconds, or sooner when it reaches
+# max_batch changes
+# with a lock file only the process holding the lock reads the source, the
+# others wait to take over when it exits, so workers sharing a journal (see
+# delta.Journal) journal every quote once
+# Input: source, function taking a data frame of changes, seconds per batch,
+# changes per batch, path of the lock file or None
+class QuoteFeed:
+
+    def __init__(self, source, handle, interval=0.2, max_batch=5000, lock=None):
+        self.source = source
+        self.handle = handle
+        self.interval = interval
+        self.max_batch = max_batch
+        self.lock = lock
+        self.leading = lock is None
+        self._lock_file = None
+        self.lines = 0
+        self.bad = 0
+        self.batches = 0
+        self.failures = 0
+        self.last_error = None
+        self.seconds = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _flush(self, changes):
+        start = time.perf_counter()
+        try:
+            self.handle(pd.DataFrame.from_records(changes))
+        except Exception as e:
+            # the feed keeps going, the batch is counted as failed
+            self.failures += 1
+            self.last_error = '%s: %s' % (type(e).__name__, e)
+        self.batches += 1
+        self.seconds += time.perf_counter() - start
+
+    # takes the lock file if no other process holds it
+    # Output: True once this process reads the source
+    def _lead(self):
+        if self._lock_file is None:
+            self._lock_file = open(self.lock, 'a')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        self.leading = True
+        return True
+
+    def _release(self):
+        if self._lock_file is not None:
+            self._lock_file.close()
+        self._lock_file = None
+        self.leading = self.lock is None
+
+    def _run(self):
+        while not self.leading and not self._lead():
+            if self._stop.wait(self.interval):
+                return
+        changes = []
+        deadline = time.monotonic() + self.interval
+        while not self._stop.is_set():
+            for line in self.source.read(max(0.0, min(self.interval, deadline - time.monotonic()))):
+                if not line.strip():
+                    continue
+                self.lines += 1
+                try:
+                    change = json.loads(line)
+                except ValueError:
+                    change = None
+                if isinstance(change, dict):
+                    changes.append(change)
+                else:
+                    self.bad += 1
+            if changes and (len(changes) >= self.max_batch or time.monotonic() >= deadline):
+                self._flush(changes)
+                changes = []
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.interval
+        self.source.close()
+        self._release()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='quote-feed', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    # threads don't survive a fork, a forked child that serves requests
+    # calls start() itself (see gunicorn.conf.py), other children (batch pool
+    # workers) don't read the feed or keep the parent's lock
+    def _after_fork(self):
+        self._stop = threading.Event()
+        if self._thread is not None:
+            self._thread = None
+            self.source.close()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        self.leading = self.lock is None
+
+    def stats(self):
+        return {
+            'leading': self.leading, 'lines': self.lines, 'bad': self.bad, 'batches': self.batches,
+            'failures': self.failures, 'last_error': self.last_error,
+            'seconds': self.seconds,
+        }
@@ -0,0 +1,29 @@
+# gunicorn settings for wsgi.py
+# Usage: gunicorn -c gunicorn.conf.py
+import multiprocessing
+import os
+
+wsgi_app = 'wsgi:server'
+bind = os.environ.get('IMGR_BIND', '0.0.0.0:8051')
+workers = int(os.environ.get('IMGR_WORKERS', multiprocessing.cpu_count()))
+# load the universe in the master before forking the workers
+preload_app = True
+# threads so a slow screen or an open result stream doesn't hold a whole worker
+worker_class = 'gthread'
+threads = int(os.environ.get('IMGR_THREADS', '4'))
+timeout = 60
+
+
+# offering changes journaled by an earlier run were made against an older
+# sheet, the journal starts empty
+def on_starting(server):
+    import webapp
+    webapp.journal.reset()
+
+
+# the sheet checks, the journal reads and the dealer feed are threads, which
+# a fork leaves behind, so each worker starts its own instead of the
+# preloaded master
+def post_fork(server, worker):
+    import webapp
+    webapp.start_background()
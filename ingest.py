@@ -0,0 +1,168 @@
+# Bulk validation of PM requests
+# Requests generated by models come in as a batch (json or csv) instead of
+# one row at a time through the pm.py template. The whole batch is checked
+# column by column with the same rules as the template's dropdowns: ratings,
+# maturities and coupons in their lists with min on the right side of max,
+# and included/excluded states that don't overlap.
+import io
+import json
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+# template field ids and the request table headers they are stored under
+FIELDS = {
+    'increment': 'Increment',
+    'size': 'Size ($)',
+    'general': 'General Market (Y/N)',
+    'stateIncl': 'State (include)',
+    'stateExcl': 'State (exclude)',
+    'couponMin': 'Coupon Min (%)',
+    'couponMax': 'Coupon Max (%)',
+    'maturityMin': 'Maturity Min',
+    'maturityMax': 'Maturity Max',
+    'call': 'Call',
+    'ratingMin': 'Rating Min',
+    'ratingMax': 'Rating Max',
+    'settledate': 'Settle Date After',
+    'manager': 'Manager Comment',
+}
+COLUMNS = list(FIELDS.values())
+
+
+# reads a batch of requests
+# Input: request body, content type ('text/csv' or json)
+# Output: data frame with one row per request
+def read_batch(body, content_type=''):
+    if 'csv' in content_type:
+        frame = pd.read_csv(io.BytesIO(body), dtype=str, keep_default_na=False)
+    else:
+        records = json.loads(body) if isinstance(body, (bytes, str)) else body
+        # a list of requests or {'requests': [...]}
+        if isinstance(records, dict):
+            records = records.get('requests', [])
+        if not isinstance(records, list):
+            raise ValueError('expected a list of requests')
+        if not all(isinstance(r, dict) for r in records):
+            raise ValueError('expected every request to be an object')
+        frame = pd.DataFrame.from_records(records)
+    # field ids are accepted as headers too
+    return frame.rename(columns=FIELDS)
+
+
+class Validator:
+
+    # Input: rating to rank dictionary, list of years, list of coupons,
+    # dictionary of long state name to abbreviation
+    def __init__(self, ratings, years, coupons, states):
+        self.ratings = ratings
+        self.years = set(years)
+        self.coupons = set(coupons)
+        # long names and abbreviations both map to the abbreviation
+        self.states = {}
+        for name, short in states.items():
+            if short:
+                self.states[name.upper()] = short
+                self.states[short.upper()] = short
+
+    # checks a batch and converts the good rows to request table rows
+    # Input: data frame from read_batch
+    # Output: (list of rows, list of {'row', 'field', 'error'})
+    def validate(self, frame, now=None):
+        now = now or datetime.now()
+        frame = frame.reset_index(drop=True)
+        n = len(frame)
+        text = {col: self._text(frame, col) for col in COLUMNS}
+        out = pd.DataFrame(index=frame.index)
+        errors = []
+
+        def fail(mask, col, message):
+            for i in np.flatnonzero(mask):
+                errors.append({'row': int(i), 'field': col, 'error': message})
+
+        # required fields
+        increment = pd.to_numeric(text['Increment'], errors='coerce')
+        fail(~(increment.between(1, 50) & (increment % 1 == 0)), 'Increment',
+             'whole number from 1 to 50 required')
+        size = pd.to_numeric(text['Size ($)'], errors='coerce')
+        fail(~size.between(10000, 1000000000), 'Size ($)', 'from 10,000 to 1,000,000,000 required')
+        general = text['General Market (Y/N)'].str.upper().map({'YES': 'Yes', 'Y': 'Yes', 'NO': 'No', 'N': 'No'})
+        fail(general.isnull(), 'General Market (Y/N)', 'Yes or No required')
+        out['Increment'] = increment
+        out['Size ($)'] = size
+        out['General Market (Y/N)'] = general
+
+        # min/max pairs must be in their lists, with min on its side of max
+        for low, high, allowed, rank in (
+                ('Coupon Min (%)', 'Coupon Max (%)', self.coupons, None),
+                ('Maturity Min', 'Maturity Max', self.years, None),
+                ('Rating Min', 'Rating Max', self.ratings, self.ratings)):
+            values = {}
+            for col in (low, high):
+                if rank is None:
+                    value = pd.to_numeric(text[col], errors='coerce')
+                    bad = (text[col] != '') & ~value.isin(allowed)
+                else:
+                    value = text[col].str.upper()
+                    bad = (value != '') & ~value.isin(list(allowed))
+                fail(bad, col, 'not one of the template values')
+                out[col] = value.where(text[col] != '', '')
+                values[col] = value.where(~bad & (text[col] != ''))
+            if rank is None:
+                crossed = values[low] > values[high]
+            else:
+                # a lower rating has a higher rank
+                crossed = values[low].map(rank) < values[high].map(rank)
+            fail(crossed, low, 'must not be above %s' % high)
+
+        call = pd.to_numeric(text['Call'], errors='coerce')
+        fail((text['Call'] != '') & ~call.isin(self.years), 'Call', 'not one of the template values')
+        out['Call'] = call.where(text['Call'] != '', '')
+
+        # states as abbreviations or long names, separated by commas (or
+        # spaces between abbreviations), stored like the template does
+        picked = {}
+        for col in ('State (include)', 'State (exclude)'):
+            pieces = text[col].str.upper().str.split(r"[,;\[\]'\"]").explode().str.strip()
+            pieces = pieces[pieces.notnull() & (pieces != '')]
+            short = pieces.map(self.states)
+            # pieces that aren't a state name are split into abbreviations
+            words = pieces[short.isnull()].str.split().explode()
+            short = pd.concat([short.dropna(), words.map(self.states)])
+            fail(np.isin(np.arange(n), short.index[short.isnull()]), col, 'unknown state')
+            short = short.dropna().sort_index(kind='stable')
+            bounds = np.searchsorted(short.index.to_numpy(), np.arange(n + 1))
+            values = short.tolist()
+            picked[col] = [values[bounds[i]:bounds[i + 1]] for i in range(n)]
+            out[col] = [' '.join(v) if len(v) > 1 else v for v in picked[col]]
+        overlap = [bool(set(a) & set(b)) for a, b in zip(picked['State (include)'], picked['State (exclude)'])]
+        fail(np.array(overlap, dtype=bool), 'State (exclude)', 'state both included and excluded')
+
+        # settle date defaults to today, within the template's 50 years
+        settle = pd.to_datetime(text['Settle Date After'].where(text['Settle Date After'] != '', now.strftime('%Y-%m-%d')),
+                                errors='coerce')
+        today = pd.Timestamp(now.date())
+        fail(~settle.between(today, today + relativedelta(years=50)), 'Settle Date After',
+             'date from today to 50 years out required')
+        out['Settle Date After'] = settle.dt.strftime('%m/%d/%Y')
+        out['Manager Comment'] = text['Manager Comment']
+
+        bad = np.zeros(n, dtype=bool)
+        bad[[e['row'] for e in errors]] = True
+        errors.sort(key=lambda e: e['row'])
+        good = out.loc[~bad, COLUMNS]
+        # whole numbers go back as ints, like the template's widgets send them
+        for col in ('Increment', 'Size ($)', 'Coupon Min (%)', 'Coupon Max (%)',
+                    'Maturity Min', 'Maturity Max', 'Call'):
+            good[col] = good[col].map(lambda v: int(v) if v != '' and v == int(v) else v)
+        values = zip(*[good[col].tolist() for col in COLUMNS])
+        return [dict(zip(COLUMNS, row)) for row in values], errors
+
+    # column as stripped text, '' for missing values and missing columns
+    @staticmethod
+    def _text(frame, col):
+        if col not in frame.columns:
+            return pd.Series('', index=frame.index)
+        return frame[col].fillna('').astype(str).str.strip().replace({'nan': '', 'None': ''})
@@ -0,0 +1,153 @@
+# Loading layer for the IMGR offering sheet
+# Parsing the workbook with openpyxl is slow, so the first load converts it
+# into a columnar Feather (Arrow IPC) file and every later start memory-maps
+# that file instead of re-reading the excel sheet
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+# pyarrow is optional, without it every start falls back to the excel parse
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
+# folder that holds the columnar copies of offering sheets
+CACHE_DIR = '.imgr_cache'
+
+# columns the trader dashboard uses and how to store them
+# 'category' for low cardinality text (when values repeat), 'int' for the smallest integer type
+# that holds the values, 'float' for float32 when no value changes, None to
+# keep the type as read (dates are converted by the universe)
+SCHEMA = {
+    'CUSIP': None,
+    'CUSIP6': 'category',
+    'State': 'category',
+    'Coupon': 'float',
+    'Maturity': None,
+    'Ask Price': 'float',
+    'Ask Yield To Worst': 'float',
+    'Ask Size': 'int',
+    'Underlying Moody\'s Rating': 'category',
+    'Call Date': None,
+    'Issue Type': 'category',
+    'Ask Dealer': 'category',
+    'Ask Source': 'category',
+}
+
+
+# builds the cache key for a sheet from its path, modified time and contents
+# Input: path to excel file
+# Output: hex string that changes whenever the file changes
+def cache_key(path):
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    digest = hashlib.sha256()
+    digest.update(path.encode('utf-8'))
+    digest.update(str(stat.st_mtime_ns).encode('utf-8'))
+    # hash the contents too so a copied file with a reset mtime is still caught
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# location of the columnar copy for a given sheet and key
+def cache_path(path, key, cache_dir=CACHE_DIR):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_dir, '%s-%s.feather' % (stem, key[:16]))
+
+
+# parses the excel sheet and adds the derived columns
+# Input: path to excel file
+# Output: offering data frame
+def read_sheet(path):
+    df = pd.read_excel(path)
+    # Adds base CUSIP to data frame
+    df['CUSIP6'] = df['CUSIP'].str[0:6]
+    return df
+
+
+# keeps the schema columns of a data frame, stored in their compact types
+# Input: data frame, schema dictionary (see SCHEMA)
+# Output: new data frame
+def compact(df, schema=SCHEMA):
+    df = df[[col for col in schema if col in df.columns]].copy()
+    for col, kind in schema.items():
+        if col not in df.columns:
+            continue
+        if kind == 'category':
+            # categories only pay off when values repeat
+            if df[col].nunique() * 2 < len(df):
+                df[col] = df[col].astype('category')
+        elif kind == 'int' and df[col].dtype.kind in 'iu':
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+        elif kind == 'float' and df[col].dtype.kind == 'f':
+            # float32 only when every value survives the round trip, prices
+            # like 107.568 stay float64 so they display unchanged
+            small = df[col].astype(np.float32)
+            if ((small.astype(np.float64) == df[col]) | df[col].isnull()).all():
+                df[col] = small
+    return df
+
+
+# memory used by each column, text counted in full
+# Input: data frame
+# Output: dictionary of column to bytes
+def memory_usage(df):
+    return {col: int(size) for col, size in df.memory_usage(index=False, deep=True).items()}
+
+
+# removes columnar copies of older versions of the same sheet
+def _prune(path, keep, cache_dir):
+    stem = os.path.splitext(os.path.basename(path))[0] + '-'
+    for name in os.listdir(cache_dir):
+        full = os.path.join(cache_dir, name)
+        if name.startswith(stem) and name.endswith('.feather') and full != keep:
+            try:
+                os.remove(full)
+            except OSError:
+                pass
+
+
+# writes the columnar copy, going through a temp file so that a crash or a
+# second worker never sees a half written cache
+def write_cache(df, target):
+    os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+    tmp = '%s.%d.tmp' % (target, os.getpid())
+    # uncompressed so the file can be memory-mapped without copying
+    feather.write_feather(df, tmp, compression='uncompressed')
+    os.replace(tmp, target)
+
+
+# reads the offering sheet, using the columnar cache when it is up to date
+# the cache keeps every column of the sheet, schema picks the columns that
+# are read back and their types
+# Input: path to excel file, schema dictionary (None for every column as read)
+# Output: offering data frame (with CUSIP6) and whether the cache was used
+def load_offerings(path, schema=None, cache_dir=CACHE_DIR):
+    if feather is None:
+        df = read_sheet(path)
+        return (compact(df, schema) if schema else df), False
+
+    target = cache_path(path, cache_key(path), cache_dir)
+    if os.path.exists(target):
+        try:
+            columns = list(schema) if schema else None
+            table = feather.read_table(target, columns=columns, memory_map=True)
+            df = table.to_pandas()
+            return (compact(df, schema) if schema else df), True
+        except Exception:
+            # unreadable cache is treated as stale
+            pass
+
+    df = read_sheet(path)
+    try:
+        write_cache(df, target)
+        _prune(path, target, cache_dir)
+    except Exception:
+        # caching is best effort, the parsed sheet is still good
+        pass
+    return (compact(df, schema) if schema else df), False
@@ -0,0 +1,76 @@
+# Serialization of result payloads
+# Results are sent as columns (one list per column) instead of a list of
+# row dictionaries, so column names are written once, and numeric columns go
+# straight from their NumPy arrays to JSON through orjson
+import gzip
+import json
+
+import numpy as np
+
+# orjson and brotli are optional, without them the stdlib json encoder and
+# gzip are used
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# payloads smaller than this are sent uncompressed
+MIN_COMPRESS = 1024
+
+
+# columnar payload of a formatted data frame
+# Input: data frame (already in display format)
+# Output: {'columns': [...], 'rows': n, 'data': {column: values}}
+def columnar(dataframe):
+    data = {}
+    for col in dataframe.columns:
+        values = dataframe[col].to_numpy()
+        if values.dtype.kind in 'biuf':
+            data[col] = np.ascontiguousarray(values)
+        else:
+            data[col] = values.tolist()
+    return {'columns': list(dataframe.columns), 'rows': len(dataframe), 'data': data}
+
+
+# converts NumPy arrays for the stdlib encoder, NaN becomes null
+def _default(value):
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind == 'f':
+            return [None if v != v else v for v in value.tolist()]
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError('%r is not JSON serializable' % type(value))
+
+
+# payload to JSON bytes
+def dumps(payload):
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(payload, default=_default, separators=(',', ':')).encode('utf-8')
+
+
+# compresses JSON bytes with the best encoding the client accepts
+# Input: bytes, Accept-Encoding header value
+# Output: (bytes, Content-Encoding or None)
+def compress(body, accept_encoding=''):
+    if len(body) < MIN_COMPRESS:
+        return body, None
+    accept = accept_encoding.lower()
+    if brotli is not None and 'br' in accept:
+        # low quality level, the higher ones cost more time than they save
+        return brotli.compress(body, quality=4), 'br'
+    if 'gzip' in accept:
+        return gzip.compress(body, compresslevel=5), 'gzip'
+    return body, None
+
+
+# JSON encodes and compresses a payload for a response
+# Output: (bytes, Content-Encoding or None)
+def encode(payload, accept_encoding=''):
+    return compress(dumps(payload), accept_encoding)
@@ -8,6 +8,14 @@ import dash_table.FormatTemplate as FormatTemplate
 import pandas as pd
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
+import uuid
+import flask
+# Browser side dropdown validators
+import clientside
+# Server side request tables
+from requeststore import tables
+# Bulk validation of requests sent to the api
+import ingest
 
 # list of ratings for PM to choose from
 ratings = [
@@ -85,7 +93,8 @@ usa = ["AL", "AK", "AZ", "AR", "CA", "CO", "CT", "DE", "DC", "FL", "GA", "HI",
           "AS", "GU", "MP", "PR", "VI", "UM", "FM", "FH", "PW"]
 
 # dictionary comprehension to shorten state abbreviation
-shorthand = {x:y for x,y in zip(states, usa)}
+# the abbreviation is taken from the long name, the usa list isn't in the same order
+shorthand = {x:x.rsplit(' - ', 1)[1] for x in states}
 shorthand[''] = ''
 
 # Dash Web Layout Creator
@@ -94,7 +103,7 @@ app = dash.Dash(__name__)
 app.title="TESTING"
 
 # Start of Dash HTML Loading
-app.layout = html.Div([
+layout = html.Div([
     # Description of template table
     # HTML Table tag
     html.Table(
@@ -577,21 +586,58 @@ app.layout = html.Div([
         data = [],
         # Allows PM to delete row if info input is incorrect or needs update
         row_deletable=True,
-        # Allows PM to export as csv
-        export_format='csv',
+        # rows are kept on the server and sent a page at a time
+        page_action='custom',
+        page_current=0,
+        page_size=25,
+        page_count=1,
     ),
 
+    # option lists the dropdown validators narrow in the browser
+    clientside.option_store({
+        'ratings': clientside.ranked(wells),
+        'years': clientside.plain(years),
+        'coupons': clientside.plain(coupon),
+        'states': clientside.plain(states),
+    }),
+
 ])
 
+# gives every page load its own session id for its request table, the csv
+# export is served from the table kept on the server
+def serve_layout():
+    session = str(uuid.uuid4())
+    return html.Div([
+        dcc.Store(id='session', data=session),
+        layout,
+        html.A('Export', href='/export/%s.csv' % session, download='requests.csv'),
+    ])
+
+app.layout = serve_layout
+
+# id of the component whose change fired the running callback
+def fired():
+    return dash.callback_context.triggered[0]['prop_id'].split('.')[0]
+
 # Call back to update data table with new standard comment
-# Input: button click, data in fields of template
-# Output: new row in data table
+# only the new row is sent to the server, where it is added to the session's
+# table, and the last page of the table is sent back
+# rows the PM deletes are removed from the session's table and paging shows
+# the page asked for
+# Input: button click, page, table before a delete, data in fields of template
+# Output: page of data table
 @app.callback(
     # Id, Property
-    Output('adding-rows-table', 'data'),
-    [Input('editing-rows-button', 'n_clicks')],
+    [Output('adding-rows-table', 'data'),
+    Output('adding-rows-table', 'page_count'),
+    Output('adding-rows-table', 'page_current')],
+    [Input('editing-rows-button', 'n_clicks'),
+    Input('adding-rows-table', 'page_current'),
+    Input('adding-rows-table', 'data_previous')],
     [
+        State('session', 'data'),
         State('adding-rows-table', 'data'),
+        State('adding-rows-table', 'page_size'),
         State('adding-rows-table', 'columns'),
         State('increment', 'value'),
         State('size', 'value'),
@@ -614,15 +660,27 @@ app.layout = html.Div([
     ]
 )
     
-def add_row(n_clicks, data, columns, increment, size, general, stateIncl,
+def add_row(n_clicks, page_current, previous, session, data, page_size, columns,
+            increment, size, general, stateIncl,
             stateExcl, couponMin, couponMax, maturityMin,
             maturityMax, call, ratingMin, ratingMax, settledate, manager
             ):
     values = [increment, size, general, stateIncl, stateExcl, couponMin, 
             couponMax, maturityMin, maturityMax, call, 
             ratingMin, ratingMax, settledate, manager]
-    
-    if (n_clicks > 0 and general != '' and increment != '' and size != ''):
+
+    # rows deleted in the table since the last page was sent
+    # data_previous only changes when the PM deletes a row, it is left stale
+    # when a new page is sent, so it is only compared on a delete and only
+    # when the shown rows are a part of it
+    triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+    if 'adding-rows-table.data_previous' in triggered and previous is not None:
+        kept = {row['id'] for row in data}
+        shown = {row['id'] for row in previous}
+        if kept <= shown:
+            tables.delete(session, shown - kept)
+
+    if (fired() == 'editing-rows-button' and n_clicks > 0 and general != '' and increment != '' and size != ''):
         # converts long state to abbrevation for stateIncl/stateExcl
         # values[3] = shorthand[values[3]]
         # values[4] = shorthand[values[4]]
@@ -640,10 +698,18 @@ def add_row(n_clicks, data, columns, increment, size, general, stateIncl,
         values[12] = datetime.strptime(values[12], '%Y-%m-%dT%H:%M:%S.%f')
         values[12] = datetime.strftime(values[12],'%m/%d/%Y')
         # Dictionary comprehension for adding row to data table
-        data.append({
+        tables.append(session, {
             c['id']:v for c,v in zip(columns, values)
         })
-    return data
+        # shows the page with the new row
+        page_current = max(0, -(-tables.count(session) // page_size) - 1)
+
+    rows, page_count = tables.page(session, page_current or 0, page_size)
+    # a delete can empty the last page
+    if not rows and page_current:
+        page_current = page_count - 1
+        rows, page_count = tables.page(session, page_current, page_size)
+    return rows, page_count, page_current
 
 # Resets/clears template after adding row to data table
 # Input: button click
@@ -681,157 +747,48 @@ def reset(n_clicks, general, increment, size):
         raise PreventUpdate
 
 
-# Data validation for rating min
-# Input: rating max
-# Output: rating min range based on rating max if specified
-@app.callback(
-    Output('ratingMin', 'options'),
-    [Input('ratingMax', 'value')]
-)
-def setRatingMin(rating):
-    if(rating == None or rating == ''):
-        return [
-            {'label':r, 'value':r}
-            for r in wells.keys()
-        ]
-    else:
-        return [
-            {'label':r, 'value':r}
-            for r in wells.keys() if wells[r] >= wells[rating]
-        ]
-
-# Data validation for rating max
-# Input: rating min
-# Output: rating max range based on rating min if specified
-@app.callback(
-    Output('ratingMax', 'options'),
-    [Input('ratingMin', 'value')]
-)
-def setRatingMax(rating):
-    if(rating == None or rating == ''):
-        return [
-            {'label':r, 'value':r}
-            for r in wells.keys()
-        ]
-    else:
-        return [
-            {'label':r, 'value':r}
-            for r in wells.keys() if wells[r] <= wells[rating]
-        ]
-
-# Data validation for maturity min
-# Input: maturity max
-# Output: maturity min range based on maturity max if specified
-@app.callback(
-    Output('maturityMin', 'options'),
-    [Input('maturityMax', 'value')]
-)
-def setMaturityMin(year):
-    if(year == None or year == ''):
-        return [
-            {'label':d, 'value':d}
-            for d in years
-        ]
-    else:
-        return [
-            {'label':d, 'value':d}
-            for d in years if d <= year
-        ]
-
-# Data validation for maturity max
-# Input: maturity min
-# Output: maturity max range based on maturity min if specified
-@app.callback(
-    Output('maturityMax', 'options'),
-    [Input('maturityMin', 'value')]
-)
-def setMaturityMax(year):
-    if(year == None or year == ''):
-        return [
-            {'label':d, 'value':d}
-            for d in years
-        ]
-    else:
-        return [
-            {'label':d, 'value':d}
-            for d in years if d >= year
-        ]
-
-# Data validation for coupon min
-# Input: coupon max
-# Output: coupon min range based on coupon max if specified
-@app.callback(
-    Output('couponMin', 'options'),
-    [Input('couponMax', 'value')]
-)
-def setMaturityMin(cpn):
-    if(cpn == None or cpn == ''):
-        return [
-            {'label':c, 'value':c}
-            for c in coupon
-        ]
-    else:
-        return [
-            {'label':c, 'value':c}
-            for c in coupon if c <= cpn
-        ]
-
-# Data validation for coupon max
-# Input: coupon min
-# Output: coupon max range based on coupon min if specified
-@app.callback(
-    Output('couponMax', 'options'),
-    [Input('couponMin', 'value')]
-)
-def setMaturityMax(cpn):
-    if(cpn == None or cpn == ''):
-        return [
-            {'label':c, 'value':c}
-            for c in coupon
-        ]
-    else:
-        return [
-            {'label':c, 'value':c}
-            for c in coupon if c >= cpn
-        ]
-
-# Data validation for states to include
-# Input: state(s) to exclude
-# Output: state(s) that can be included based on state(s) to exclude if specified
-@app.callback(
-    Output('stateExcl', 'options'),
-    [Input('stateIncl', 'value')]
-)
-def setStateExcl(state):
-    if(state == None or state == ''):
-        return [
-            {'label': s, 'value': s}
-            for s in states
-        ]
-    else:
-        return [
-            {'label':s, 'value':s}
-            for s in states if s not in state
-        ]
-
-# Data validation for states to exclude
-# Input: state(s) to include
-# Output: state(s) that can be excluded based on state(s) to include if specified
-@app.callback(
-    Output('stateIncl', 'options'),
-    [Input('stateExcl', 'value')]
-)
-def setStateExcl(state):
-    if(state == None or state == ''):
-        return [
-            {'label': s, 'value': s}
-            for s in states
-        ]
-    else:
-        return [
-            {'label':s, 'value':s}
-            for s in states if s not in state
-        ]
+# Option narrowing for the min/max dropdowns runs in the browser
+# ratings keep the side of the partner's rank, years/coupons the side of the
+# partner's value, and included/excluded states leave out each other
+clientside.narrow(app, 'ratingMin', 'ratingMax', 'ratings', '>=')
+clientside.narrow(app, 'ratingMax', 'ratingMin', 'ratings', '<=')
+clientside.narrow(app, 'maturityMin', 'maturityMax', 'years', '<=')
+clientside.narrow(app, 'maturityMax', 'maturityMin', 'years', '>=')
+clientside.narrow(app, 'couponMin', 'couponMax', 'coupons', '<=')
+clientside.narrow(app, 'couponMax', 'couponMin', 'coupons', '>=')
+clientside.narrow(app, 'stateExcl', 'stateIncl', 'states', 'not in')
+clientside.narrow(app, 'stateIncl', 'stateExcl', 'states', 'not in')
+
+
+# checks batches sent to the api with the template's rules
+validator = ingest.Validator(wells, years, coupon, shorthand)
+
+# adds a batch of requests to a session's request table
+# Input: json list of requests (or {'requests': [...]}) or csv, keyed by the
+# table headers or the template field ids
+# Output: json with the ids of the added rows and the errors of the rejected ones
+@app.server.route('/requests/<session>', methods=['POST'])
+def add_requests(session):
+    try:
+        frame = ingest.read_batch(flask.request.get_data(), flask.request.content_type or '')
+        rows, errors = validator.validate(frame)
+        ids = tables.extend(session, rows)
+    except ValueError as e:
+        return flask.jsonify({'error': str(e)}), 400
+    return flask.jsonify({'added': len(ids), 'ids': ids,
+                          'rejected': len({e['row'] for e in errors}), 'errors': errors})
+
+
+# every row of a session's request table as csv, with the table's headers
+@app.server.route('/export/<session>.csv')
+def export(session):
+    try:
+        frame = tables.frame(session, col_names + ['Manager Comment'])
+    except ValueError:
+        flask.abort(404)
+    response = flask.Response(frame.to_csv(index=False), mimetype='text/csv')
+    response.headers['Content-Disposition'] = 'attachment; filename=requests.csv'
+    return response
 
 
 if __name__ == '__main__':
@@ -0,0 +1,298 @@
+# Push of result changes to the trader sessions
+# When offerings change (a feed batch or a POST to /offerings) every
+# session's screen result is moved to the new universe version by testing
+# only the changed rows against the session's criteria, and the rows that
+# changed are sent to the session's browser as server-sent events. The
+# browser patches the rows of the page it shows, and asks for the page again
+# when rows joined or left the result.
+import json
+import queue
+import threading
+from datetime import datetime as dt
+
+import dash_core_components as dcc
+import dash_html_components as html
+import numpy as np
+from dash.dependencies import Input, Output, State
+from plotly.utils import PlotlyJSONEncoder
+
+import screen
+import table
+
+# ids of the components the browser side uses
+URL = 'stream-url'
+TICK = 'stream-tick'
+PAGE = 'page-data'
+REFRESH = 'stream-refresh'
+STATUS = 'stream-status'
+
+
+# Open event streams of the sessions
+# every stream has a bounded queue, a stream that falls behind gets one
+# refresh event instead of the changes it missed
+class Subscribers:
+
+    def __init__(self, max_queue=100):
+        self.max_queue = max_queue
+        self.published = 0
+        self.dropped = 0
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, session):
+        q = queue.Queue(self.max_queue)
+        with self._lock:
+            self._queues.setdefault(session, []).append(q)
+        return q
+
+    def unsubscribe(self, session, q):
+        with self._lock:
+            queues = self._queues.get(session, [])
+            if q in queues:
+                queues.remove(q)
+            if not queues:
+                self._queues.pop(session, None)
+
+    # sessions with an open stream
+    def sessions(self):
+        with self._lock:
+            return set(self._queues)
+
+    def publish(self, session, event):
+        with self._lock:
+            queues = list(self._queues.get(session, []))
+        for q in queues:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                self.dropped += 1
+                with q.mutex:
+                    q.queue.clear()
+                q.put_nowait({'version': event['version'], 'refresh': True})
+            self.published += 1
+
+    def stats(self):
+        with self._lock:
+            streams = sum(len(queues) for queues in self._queues.values())
+            return {'sessions': len(self._queues), 'streams': streams,
+                    'published': self.published, 'dropped': self.dropped}
+
+
+# open event streams of the process
+subscribers = Subscribers()
+
+
+# server-sent events of a session, a comment every keepalive seconds keeps
+# idle connections open through proxies
+# Output: iterator of event text for a streamed response
+def stream(session, keepalive=15):
+    q = subscribers.subscribe(session)
+
+    def events():
+        try:
+            yield 'retry: 2000\n\n'
+            while True:
+                try:
+                    event = q.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                # NaN as null, like the callback responses
+                yield 'data: %s\n\n' % json.dumps(event, cls=PlotlyJSONEncoder)
+        finally:
+            subscribers.unsubscribe(session, q)
+    return events()
+
+
+# True for the values found in a sorted array
+def _within(values, sorted_values):
+    if len(sorted_values) == 0:
+        return np.zeros(len(values), dtype=bool)
+    at = np.minimum(np.searchsorted(sorted_values, values), len(sorted_values) - 1)
+    return sorted_values[at] == values
+
+
+# moves a session's screen result to a newer universe version made by
+# NormalizedUniverse.changed, testing only the rows that changed
+# Input: View on the version new was made from, new universe
+# Output: (View on new, row ids still in the result with new values, row
+# ids that joined the result, row ids that left it)
+def advance(view, new, now=None):
+    changed = new.changed_rows
+    if view.criteria is None:
+        match = np.ones(len(changed), dtype=bool) if new.live is None else new.live[changed]
+    else:
+        match = screen.test_rows(view.criteria, new, changed, now)
+    # results in priority order are sorted to look the changed rows up
+    rows = view.rows if view.priority is None else np.sort(view.rows)
+    present = _within(changed, rows)
+    left = changed[present & ~match]
+    joined = changed[~present & match]
+    updated = changed[present & match]
+    if view.priority is not None and new.duplicates:
+        # every offering of the general market union is listed once, by its
+        # first matching row in priority order (see screen._order), and a
+        # changed row can hand that place to another row of its offering
+        tested = np.flatnonzero(np.isin(new.offering, new.offering[changed]))
+        passing = tested[screen.test_rows(view.criteria, new, tested, now)]
+        passing = passing[np.argsort(screen.priority(view.criteria, new, passing), kind='stable')]
+        _, first = np.unique(new.offering[passing], return_index=True)
+        listed = _within(tested, np.sort(passing[first]))
+        present = _within(tested, rows)
+        left = tested[present & ~listed]
+        joined = tested[~present & listed]
+        updated = updated[_within(updated, tested[listed])]
+
+    if len(left) or len(joined):
+        rows = np.sort(np.concatenate([rows[~_within(rows, left)], joined]))
+    priority = None
+    if view.priority is not None:
+        # a changed state can move a row between preferred and general market
+        priority = screen.priority(view.criteria, new, rows)
+        order = np.argsort(priority, kind='stable')
+        rows, priority = rows[order], priority[order]
+    return table.View(new, rows, priority, view.criteria), updated, joined, left
+
+
+# moves every session's result from old to new and sends the sessions with
+# an open stream the rows of their result that changed, or a refresh when
+# new is not made from old or a changed row moves under the table's sort or
+# filter (or between preferred and general market)
+# Input: ViewStore, old and new universe, function formatting rows of a
+# universe (with their priority or None) as table records, most rows to send
+# before asking the browser to fetch its page again instead
+# Output: number of sessions sent an event
+def publish_changes(views, old, new, render, limit=200):
+    streaming = subscribers.sessions()
+    now = dt.now()
+    sent = 0
+    for session, view in views.items():
+        if view.universe is not old:
+            continue
+        if new.base != old.version:
+            # a reloaded sheet, the page callback screens it again
+            if session in streaming:
+                subscribers.publish(session, {'version': new.version, 'refresh': True})
+                sent += 1
+            continue
+        advanced, updated, joined, left = advance(view, new, now)
+        if not views.swap(session, view, advanced) or session not in streaming:
+            continue
+        if not (len(updated) or len(joined) or len(left)):
+            continue
+        event = {'version': new.version, 'rows': len(advanced.rows)}
+        if len(joined) or len(left) or len(updated) > limit:
+            event['refresh'] = True
+        else:
+            before = screen.priority(view.criteria, old, updated)
+            after = screen.priority(view.criteria, new, updated)
+            sort_by, filter_query = views.ordering(session)
+            reorder, shown = table.moved(table.View(old, updated, before), table.View(new, updated, after),
+                                         sort_by, filter_query)
+            if reorder or (before is not None and not np.array_equal(before, after)):
+                event['refresh'] = True
+            elif len(shown):
+                event['update'] = render(new, updated[shown], None if after is None else after[shown])
+            else:
+                # the changed rows are filtered out of the table
+                continue
+        subscribers.publish(session, event)
+        sent += 1
+    return sent
+
+
+# components the browser side needs in the page layout
+# Input: url of the session streams (the session id is added to it), None
+# to leave streaming off
+def components(url):
+    return [
+        dcc.Store(id=URL, data=url),
+        dcc.Store(id=PAGE),
+        dcc.Store(id=REFRESH),
+        dcc.Interval(id=TICK, interval=500, disabled=url is None),
+        html.Div(id=STATUS, style={'display': 'none'}),
+    ]
+
+
+# JavaScript opening the session's event stream, events wait in a buffer
+# until the next tick
+_listen = """
+function(session, url) {
+    var state = window.imgrStream = window.imgrStream || {pending: [], version: 0};
+    if (!url || !session || state.session === session || !window.EventSource) {
+        return window.dash_clientside.no_update;
+    }
+    if (state.source) {
+        state.source.close();
+    }
+    state.session = session;
+    state.pending = [];
+    state.source = new window.EventSource(url + encodeURIComponent(session));
+    state.source.onmessage = function(message) {
+        state.pending.push(JSON.parse(message.data));
+    };
+    return 'streaming';
+}
+"""
+
+# JavaScript showing a page from the server, or patching the rows on the
+# page with the buffered events; an event with rows joining or leaving the
+# result asks the server for the page again
+_apply = """
+function(n, page, data) {
+    var state = window.imgrStream = window.imgrStream || {pending: [], version: 0};
+    var none = window.dash_clientside.no_update;
+    var triggered = window.dash_clientside.callback_context.triggered.map(function(t) {
+        return t.prop_id;
+    });
+    if (triggered.indexOf('%(page)s.data') >= 0) {
+        if (!page) {
+            return [none, none];
+        }
+        state.version = page.version;
+        return [page.rows, none];
+    }
+    var events = state.pending.filter(function(e) { return e.version > state.version; });
+    state.pending = [];
+    if (!events.length || !data) {
+        return [none, none];
+    }
+    if (events.some(function(e) { return e.refresh; })) {
+        return [none, Date.now()];
+    }
+    var updated = {};
+    events.forEach(function(e) {
+        e.update.forEach(function(row) { updated[row.id] = row; });
+        state.version = e.version;
+    });
+    var changed = false;
+    var rows = data.map(function(row) {
+        if (updated.hasOwnProperty(row.id)) {
+            changed = true;
+            return updated[row.id];
+        }
+        return row;
+    });
+    return [changed ? rows : none, none];
+}
+"""
+
+
+# registers the browser side of the streams for a table, the server's page
+# callback fills the PAGE store ({'version', 'rows'}) instead of the table
+# and takes the REFRESH store as an input
+def register(app, table_id):
+    app.clientside_callback(
+        _listen,
+        Output(STATUS, 'children'),
+        [Input('session', 'data')],
+        [State(URL, 'data')]
+    )
+    app.clientside_callback(
+        _apply % {'page': PAGE},
+        [Output(table_id, 'data'),
+        Output(REFRESH, 'data')],
+        [Input(TICK, 'n_intervals'),
+        Input(PAGE, 'data')],
+        [State(table_id, 'data')]
+    )
@@ -0,0 +1,175 @@
+# Replays a recorded quote feed for load testing
+# A recording is a file of json lines in the feed format (see feed.py). The
+# lines are sent at a fixed rate, or at the pace of their "time" field
+# (seconds) scaled by --speed, to a tcp or unix socket the dashboard connects
+# to, or appended to a file the dashboard tails.
+# Usage: python replay.py quotes.jsonl --to tcp::9009 [--rate 1000] [--loop]
+#        python replay.py quotes.jsonl --to tail:quotes.live --speed 10
+#        python replay.py --record quotes.jsonl [--count 10000] [--sheet IMGR1.xlsx]
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+
+import numpy as np
+
+
+# lines of a recording, with the time each is due relative to the first
+# Input: path, lines per second (None to use the recorded times), speed up
+# Output: list of (seconds, line)
+def schedule(path, rate=None, speed=1.0):
+    with open(path, encoding='utf-8') as f:
+        lines = [line.rstrip('\n') for line in f if line.strip()]
+    if rate:
+        return [(i / rate, line) for i, line in enumerate(lines)]
+    times = []
+    for line in lines:
+        try:
+            times.append(float(json.loads(line).get('time', 0)))
+        except (ValueError, AttributeError):
+            times.append(times[-1] if times else 0.0)
+    first = times[0] if times else 0.0
+    return [((t - first) / speed, line) for t, line in zip(times, lines)]
+
+
+# Sink accepting feed connections, every connected client gets every line
+# Input: address family, address to listen on
+class SocketSink:
+
+    def __init__(self, family, address):
+        self.server = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_UNIX and os.path.exists(address):
+            os.remove(address)
+        else:
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(address)
+        self.server.listen()
+        self.clients = []
+        self._lock = threading.Lock()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self.server.accept()
+            except OSError:
+                return
+            with self._lock:
+                self.clients.append(client)
+
+    def send(self, lines):
+        data = ''.join(line + '\n' for line in lines).encode('utf-8')
+        with self._lock:
+            for client in list(self.clients):
+                try:
+                    client.sendall(data)
+                except OSError:
+                    self.clients.remove(client)
+                    client.close()
+
+    def close(self):
+        self.server.close()
+
+
+# Sink appending lines to a file
+class FileSink:
+
+    def __init__(self, path):
+        self.file = open(path, 'a', encoding='utf-8')
+        self.clients = [path]
+
+    def send(self, lines):
+        self.file.write(''.join(line + '\n' for line in lines))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def open_sink(address):
+    kind, _, where = address.partition(':')
+    if kind == 'tail':
+        return FileSink(where)
+    if kind == 'tcp':
+        host, _, port = where.rpartition(':')
+        return SocketSink(socket.AF_INET, (host or '127.0.0.1', int(port)))
+    if kind == 'unix':
+        return SocketSink(socket.AF_UNIX, where)
+    raise ValueError('unknown feed %r, expected tail:, tcp: or unix:' % address)
+
+
+# sends a schedule, lines that are due together go in one write
+# Output: (lines sent, seconds taken)
+def replay(items, sink, loop=False):
+    sent = 0
+    start = time.monotonic()
+    while True:
+        begin = time.monotonic()
+        i = 0
+        while i < len(items):
+            wait = begin + items[i][0] - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            due = time.monotonic() - begin
+            j = i
+            while j < len(items) and items[j][0] <= due:
+                j += 1
+            sink.send([line for _, line in items[i:j]])
+            sent += j - i
+            i = j
+        if not loop:
+            return sent, time.monotonic() - start
+
+
+# records n random price, yield and size changes of the sheet's offerings
+def record(path, count, sheet, seed=0):
+    import loader
+    from delta import KEY
+    from universe import RATING, rating_codes
+
+    df, _ = loader.load_offerings(sheet, loader.SCHEMA)
+    # only rated bonds, the universe drops the rest so their quotes would
+    # match no offering
+    df = df[df[RATING].astype(str).str.upper().isin(rating_codes)]
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(df), count)
+    with open(path, 'w', encoding='utf-8') as f:
+        for i, row in enumerate(rows):
+            change = {col: str(df[col].iat[row]) for col in KEY}
+            change['Ask Price'] = round(float(df['Ask Price'].iat[row]) + rng.normal(0, 0.25), 3)
+            change['Ask Yield To Worst'] = round(float(df['Ask Yield To Worst'].iat[row]) + rng.normal(0, 0.02), 3)
+            change['Ask Size'] = int(rng.integers(5, 200)) * 10000
+            change['time'] = round(i * 0.001, 3)
+            f.write(json.dumps(change) + '\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replays a recorded quote feed')
+    parser.add_argument('recording', nargs='?', help='json lines of changes')
+    parser.add_argument('--to', default='tcp::9009', help='tcp:<host>:<port>, unix:<path> or tail:<file>')
+    parser.add_argument('--rate', type=float, help='lines per second instead of the recorded times')
+    parser.add_argument('--speed', type=float, default=1.0, help='speed up of the recorded times')
+    parser.add_argument('--loop', action='store_true', help='replay until stopped')
+    parser.add_argument('--wait', type=float, default=0, help='seconds to wait for the dashboard to connect')
+    parser.add_argument('--record', metavar='PATH', help='write a synthetic recording instead')
+    parser.add_argument('--count', type=int, default=10000)
+    parser.add_argument('--sheet', default='IMGR1.xlsx')
+    args = parser.parse_args()
+
+    if args.record:
+        record(args.record, args.count, args.sheet)
+        print('%d changes written to %s' % (args.count, args.record))
+    else:
+        if args.recording is None:
+            parser.error('a recording is required')
+        items = schedule(args.recording, args.rate, args.speed)
+        sink = open_sink(args.to)
+        time.sleep(args.wait)
+        try:
+            sent, seconds = replay(items, sink, args.loop)
+        finally:
+            sink.close()
+        print('%d lines sent to %d client(s) in %.2f s (%.0f lines/s)'
+              % (sent, len(sink.clients), seconds, sent / seconds if seconds else 0))
@@ -0,0 +1,113 @@
+# Server side store for the pm.py request tables
+# Rows stay on the server, so Add Row sends only the new row in and one page
+# of the table out, instead of the whole table both ways on every click.
+# Each session's rows are appended to a json lines file, a local stand-in for
+# a shared store, and sessions are read back from it when not in memory.
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+# folder holding one file per session
+STORE_DIR = '.pm_store'
+
+# session ids are used in file names
+_session_id = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+class RequestStore:
+
+    def __init__(self, directory=STORE_DIR, max_sessions=1000):
+        self.directory = directory
+        self.max_sessions = max_sessions
+        # session -> list of rows in the order they were added
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, session):
+        if not isinstance(session, str) or not _session_id.match(session):
+            raise ValueError('invalid session id %r' % (session,))
+        return os.path.join(self.directory, session + '.jsonl')
+
+    # rows of a session, read back from its file when not in memory
+    # lines are rows, or {'deleted': [ids]} for rows removed later
+    # must be called with the lock held
+    def _rows(self, session):
+        rows = self._sessions.get(session)
+        if rows is None:
+            rows = []
+            path = self._path(session)
+            if os.path.exists(path):
+                with open(path, encoding='utf-8') as f:
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        entry = json.loads(line)
+                        if 'deleted' in entry:
+                            gone = set(entry['deleted'])
+                            rows = [r for r in rows if r['id'] not in gone]
+                        else:
+                            rows.append(entry)
+            self._sessions[session] = rows
+        self._sessions.move_to_end(session)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        return rows
+
+    def _write(self, session, entries):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(session), 'a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(e) + '\n' for e in entries))
+
+    # adds rows to the end of a session's table, each row gets an 'id' (the
+    # DataTable row id) that stays the same when other rows are deleted
+    # Input: session id, list of row dictionaries
+    # Output: ids of the new rows
+    def extend(self, session, new_rows):
+        with self._lock:
+            rows = self._rows(session)
+            start = rows[-1]['id'] + 1 if rows else 0
+            added = [dict(row, id=start + i) for i, row in enumerate(new_rows)]
+            self._write(session, added)
+            rows.extend(added)
+            return [row['id'] for row in added]
+
+    def append(self, session, row):
+        return self.extend(session, [row])[0]
+
+    # removes rows by id
+    def delete(self, session, ids):
+        ids = set(ids)
+        if not ids:
+            return
+        with self._lock:
+            rows = self._rows(session)
+            self._write(session, [{'deleted': sorted(ids)}])
+            rows[:] = [r for r in rows if r['id'] not in ids]
+
+    def count(self, session):
+        with self._lock:
+            return len(self._rows(session))
+
+    # one page of a session's table
+    # Output: (rows, page count)
+    def page(self, session, page_current, page_size):
+        with self._lock:
+            rows = self._rows(session)
+            page_count = max(1, -(-len(rows) // page_size))
+            start = page_current * page_size
+            return rows[start:start + page_size], page_count
+
+    # every row of a session's table as a data frame
+    # Input: session id, column names (the row ids are left out)
+    def frame(self, session, columns):
+        with self._lock:
+            rows = list(self._rows(session))
+        return pd.DataFrame(rows, columns=columns)
+
+
+# request tables of the pm.py sessions
+tables = RequestStore()
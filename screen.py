@@ -0,0 +1,533 @@
+# Screening engine for PM comments
+# A comment is parsed once into a Criteria record, compiled against the
+# universe into a plan holding only the clauses that can exclude a bond,
+# and the plan is evaluated over NumPy columns starting from the smallest
+# candidate set given by the universe's sorted indexes
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime as dt
+
+import numpy as np
+from dateutil.relativedelta import relativedelta
+
+import comments
+from universe import bit_test, bit_rows
+
+# Parsed PM comment, fields left as None were not specified and take the
+# template defaults when compiled
+# include/exclude are tuples of state abbreviations, maturity/call are
+# datetimes, rating_min/rating_max are rating codes (rating_min is the worst
+# rating allowed so it is the larger code)
+# issuers/exclude_issuers are tuples of base CUSIPs (CUSIP6), the comment
+# format has no field for them so only other callers set them
+Criteria = namedtuple('Criteria', [
+    'increment', 'size', 'general', 'include', 'exclude', 'coupon_min',
+    'coupon_max', 'maturity_min', 'maturity_max', 'call_min', 'rating_min',
+    'rating_max', 'settle', 'manager', 'issuers', 'exclude_issuers'
+], defaults=((), ()))
+
+
+# parses PM comment into Criteria
+# Input: comment string in the pm.py export format
+# Output: Criteria, or None for a blank comment
+# raises comments.CommentError naming the field and column of a bad value
+def parse_comment(comment):
+    values = comments.parse(comment)
+    return Criteria(**values) if values is not None else None
+
+
+# datetime to int64 nanoseconds, matching the universe date columns
+def _ns(value):
+    return np.datetime64(value, 'ns').astype(np.int64)
+
+
+# fills unspecified fields with the template defaults
+# Input: Criteria
+# Output: Criteria with every range bound set
+def with_defaults(criteria, now=None):
+    now = now or dt.now()
+    # default for coupon is 1 to 10, maturity is current year to 50 years in
+    # the future, call date is current year, rating is investment grade to AAA
+    defaults = {
+        'coupon_min': 1, 'coupon_max': 10,
+        'maturity_min': now, 'maturity_max': now + relativedelta(years = 50),
+        'call_min': now, 'rating_min': 16, 'rating_max': 1,
+    }
+    return criteria._replace(**{
+        k: v for k, v in defaults.items() if getattr(criteria, k) is None
+    })
+
+
+# Compiled criteria
+# clauses are ordered smallest candidate set first
+# include is a packed bitmap of the preferred state bonds, or None
+Plan = namedtuple('Plan', ['criteria', 'clauses', 'include', 'general'])
+
+# One condition of a plan
+# key identifies the condition and its values (used by the mask cache),
+# count is the number of bonds in the universe that pass it, candidates()
+# returns their row ids in row order, test(rows) returns a boolean array for
+# the given row ids and bits() returns a packed bitmap over the universe
+Clause = namedtuple('Clause', ['name', 'key', 'count', 'candidates', 'test', 'bits'])
+
+
+# makes a clause for a range of a universe column using its sorted index
+def _range(name, column, index, low, high):
+    start, stop = index.span(low, high)
+
+    def test(rows):
+        values = column[rows]
+        if low is None:
+            return values <= high
+        if high is None:
+            return values >= low
+        return (values >= low) & (values <= high)
+    # keyed on the span so bounds that select the same bonds (like the
+    # moving current time defaults) share a cache entry
+    return Clause(name, (name, start, stop), stop - start,
+                  lambda: index.rows(start, stop), test,
+                  lambda: index.bits(start, stop))
+
+
+# makes a clause from a packed bitmap
+def _bitmap(name, key, universe, bits, count):
+    def test(rows):
+        return bit_test(bits, rows)
+    return Clause(name, key, count, lambda: bit_rows(bits, universe.size),
+                  test, lambda: bits)
+
+
+# makes a membership clause from include/exclude lists of a BitmapIndex
+# include ORs the bitmaps of the listed values, exclude ANDNOTs them
+def _membership(name, universe, index, include, exclude):
+    if include:
+        bits, count = index.union(include)
+    else:
+        bits, count = index.ones(), index.size
+    if exclude:
+        excluded, _ = index.union(exclude)
+        bits = bits & ~excluded
+        # counts overlap when a value is both included and excluded
+        count = int(np.unpackbits(bits, count=index.size).sum())
+    key = (name, tuple(sorted(set(include))), tuple(sorted(set(exclude))))
+    return _bitmap(name, key, universe, bits, count)
+
+
+# range conditions of criteria with every bound set
+# Output: list of (name, index name, column, low, high)
+def _ranges(c, u):
+    return [
+        ('size', 'size', u.ask_size, c.size, None),
+        ('coupon', 'coupon', u.coupon, c.coupon_min, c.coupon_max),
+        ('maturity', 'maturity', u.maturity, _ns(c.maturity_min), _ns(c.maturity_max)),
+        ('call', 'call', u.call, _ns(c.call_min), None),
+        # rating_max is the best (lowest) code, rating_min the worst
+        ('rating', 'rating', u.rating, c.rating_max, c.rating_min),
+    ]
+
+
+# compiles Criteria into a Plan for a universe
+# range clauses that every bond in the universe passes are left out
+# Input: Criteria, NormalizedUniverse
+# Output: Plan
+def compile_plan(criteria, universe, now=None):
+    c = with_defaults(criteria, now)
+    u = universe
+    clauses = []
+
+    # skips clauses every bond passes (below), like the default coupon range
+    for name, index, column, low, high in _ranges(c, u):
+        clauses.append(_range(name, column, u.index[index], low, high))
+
+    include = None
+    general = c.general == 'Yes'
+    states = c.include
+    if c.include and general:
+        # preferred states only order the results, they don't filter
+        include, _ = u.states.union(c.include)
+        states = ()
+    # if no general allowed, include only preferred state
+    if states or c.exclude:
+        clauses.append(_membership('state', u, u.states, states, c.exclude))
+    if c.issuers or c.exclude_issuers:
+        clauses.append(_membership('issuer', u, u.issuers, c.issuers, c.exclude_issuers))
+
+    # withdrawn offerings keep their rows until the next full load
+    if u.live is not None:
+        clauses.append(_bitmap('live', ('live',), u, u.live_bits, u.offered))
+
+    # skips membership clauses every bond passes
+    clauses = [clause for clause in clauses if clause.count < u.size]
+
+    # smallest candidate set first
+    clauses.sort(key=lambda clause: clause.count)
+    return Plan(c, clauses, include, general)
+
+
+# tests some rows against criteria without compiling a plan, for the few
+# rows a batch of offering changes touched
+# Input: Criteria, NormalizedUniverse, row ids
+# Output: boolean array, True for the rows the criteria select
+def test_rows(criteria, universe, rows, now=None):
+    c = with_defaults(criteria, now)
+    u = universe
+    ok = np.ones(len(rows), dtype=bool)
+    for _, _, column, low, high in _ranges(c, u):
+        values = column[rows]
+        if low is not None:
+            ok &= values >= low
+        if high is not None:
+            ok &= values <= high
+
+    # preferred states only order the results when general market is allowed
+    states = () if c.include and c.general == 'Yes' else c.include
+    for index, include, exclude in ((u.states, states, c.exclude),
+                                    (u.issuers, c.issuers, c.exclude_issuers)):
+        if include:
+            ok &= bit_test(index.union(include)[0], rows)
+        if exclude:
+            ok &= ~bit_test(index.union(exclude)[0], rows)
+    if u.live is not None:
+        ok &= u.live[rows]
+    return ok
+
+
+# LRU cache of clause bitmaps keyed on (universe version, clause key)
+# when a trader edits one field only that clause's bitmap is rebuilt, the
+# rest come from the cache
+# Input: max_bytes, total size of the bitmaps to keep
+class MaskCache:
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._masks = OrderedDict()
+        self._lock = threading.Lock()
+
+    # cached bitmap for key, built with make() on a miss
+    def get(self, key, make):
+        with self._lock:
+            if key in self._masks:
+                self.hits += 1
+                self._masks.move_to_end(key)
+                return self._masks[key]
+            self.misses += 1
+        bits = make()
+        with self._lock:
+            if key not in self._masks:
+                self._masks[key] = bits
+                self.bytes += bits.nbytes
+            # evicts least recently used bitmaps
+            while self.bytes > self.max_bytes and len(self._masks) > 1:
+                _, old = self._masks.popitem(last=False)
+                self.bytes -= old.nbytes
+        return bits
+
+    # hit/miss counts and size, for sizing the cache
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._masks), 'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._masks.clear()
+            self.bytes = 0
+
+    # drops the bitmaps of universes older than version, once a new sheet
+    # is in use they are never asked for again
+    def retire(self, version):
+        with self._lock:
+            for key in [key for key in self._masks if key[0] < version]:
+                self.bytes -= self._masks.pop(key).nbytes
+
+
+# clause bitmaps shared by every screen in the process
+masks = MaskCache()
+
+
+# evaluates a plan
+# selective screens start from the candidates of the most selective clause
+# and check the remaining clauses only against the rows that are left,
+# broad screens AND the cached bitmaps of every clause
+# Input: Plan, NormalizedUniverse, MaskCache (None to skip caching)
+# Output: sorted array of matching row ids
+def evaluate(plan, universe, cache=masks):
+    if not plan.clauses:
+        return universe.live_rows()
+    first = plan.clauses[0]
+    if first.count == 0:
+        return np.arange(0)
+
+    if cache is None or first.count * 64 < universe.size:
+        rows = first.candidates()
+        for clause in plan.clauses[1:]:
+            rows = rows[clause.test(rows)]
+            if len(rows) == 0:
+                break
+        return rows
+
+    bits = None
+    for clause in plan.clauses:
+        mask = cache.get((universe.version,) + clause.key, clause.bits)
+        bits = mask if bits is None else bits & mask
+    return bit_rows(bits, universe.size)
+
+
+# Cache of screen results keyed on the compiled plan
+# entries expire after ttl seconds and the oldest are evicted past max_bytes,
+# a key from a newer universe version drops every older entry, and identical
+# screens arriving together are computed once and shared (single flight)
+class ResultCache:
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=300):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self._results = OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    # cached result for key (a tuple starting with the universe version),
+    # built with compute() on a miss
+    def get(self, key, compute):
+        with self._lock:
+            if key[0] > self.version:
+                self._drop()
+                self.version = key[0]
+            entry = self._results.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                self._results.move_to_end(key)
+                return entry[1]
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                self.misses += 1
+                flight = self._flights[key] = _Flight()
+            else:
+                self.shared += 1
+
+        # waits for the request already computing this screen
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = compute()
+            # results are shared between callers, nobody may change them
+            flight.result.flags.writeable = False
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                if flight.error is None and key[0] == self.version:
+                    self._store(key, flight.result)
+            flight.done.set()
+        return flight.result
+
+    def _store(self, key, rows):
+        if key in self._results:
+            self.bytes -= self._results.pop(key)[1].nbytes
+        self._results[key] = (time.monotonic() + self.ttl, rows)
+        self.bytes += rows.nbytes
+        while self.bytes > self.max_bytes and self._results:
+            _, (_, old) = self._results.popitem(last=False)
+            self.bytes -= old.nbytes
+
+    def _drop(self):
+        self._results.clear()
+        self.bytes = 0
+
+    # hit/miss/shared counts and size
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits, 'misses': self.misses, 'shared': self.shared,
+                'entries': len(self._results), 'bytes': self.bytes,
+                'max_bytes': self.max_bytes, 'ttl': self.ttl,
+                'version': self.version,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._drop()
+
+
+# a screen being computed, waited on by identical requests
+class _Flight:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+# screen results shared by every session in the process
+results = ResultCache()
+
+
+# canonical key of a plan: universe version plus the clause keys, so
+# criteria that only differ in fields that don't filter (increment, manager)
+# or in bounds that select the same bonds share a result
+def plan_key(plan, universe):
+    include = tuple(sorted(set(plan.criteria.include))) if plan.include is not None else None
+    return (universe.version, tuple(sorted(clause.key for clause in plan.clauses)), include)
+
+
+# puts matching rows of a plan in display order
+# with preferred states and general market allowed, the preferred state
+# bonds (priority 1) come before the general market (priority 2), and every
+# offering (see universe.OFFERING) of the union is listed once
+def _order(plan, rows, universe):
+    if plan.include is None:
+        return rows
+    rows = rows[np.argsort(_priority(plan.include, rows), kind='stable')]
+    if universe.duplicates:
+        _, first = np.unique(universe.offering[rows], return_index=True)
+        rows = rows[np.sort(first)]
+    rows.flags.writeable = False
+    return rows
+
+
+# 1 for preferred state bonds, 2 for general market
+def _priority(include, rows):
+    return np.where(bit_test(include, rows), 1, 2).astype(np.int8)
+
+
+# priority of each screened row, None when the screen has no preferred
+# states with general market allowed
+# Input: Criteria, NormalizedUniverse, row ids from run
+# Output: int8 array (1 preferred state, 2 general market) or None
+def priority(criteria, universe, rows):
+    if criteria is None or not criteria.include or criteria.general != 'Yes':
+        return None
+    include, _ = universe.states.union(criteria.include)
+    return _priority(include, rows)
+
+
+# Last screen of a trader session, kept so a tightened screen can refine it
+# rows are every matching row id in row order (before the preferred states
+# are moved to the front and repeated offerings are dropped)
+Session = namedtuple('Session', ['version', 'plan', 'rows'])
+
+
+# LRU of the last screen of each session
+class SessionStore:
+
+    def __init__(self, max_sessions=1000):
+        self.max_sessions = max_sessions
+        self.refined = 0
+        self.full = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def put(self, session_id, session):
+        with self._lock:
+            self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    # refined/full screen counts
+    def stats(self):
+        with self._lock:
+            return {
+                'sessions': len(self._sessions), 'refined': self.refined,
+                'full': self.full,
+            }
+
+
+# last screens of the trader sessions in the process
+sessions = SessionStore()
+
+
+# a lock held by another thread when the process forks stays held in the
+# child, so forked workers get new locks and compute screens that were in
+# flight in the parent themselves
+def _after_fork():
+    for store in (masks, results, sessions):
+        store._lock = threading.Lock()
+    results._flights = {}
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+# checks that every bond passing clause new also passes clause old
+def _within(new, old):
+    if new.key == old.key:
+        return True
+    if new.name in ('state', 'issuer'):
+        return not (new.bits() & ~old.bits()).any()
+    # range clauses: the span of the sorted index must shrink
+    return new.key[1] >= old.key[1] and new.key[2] <= old.key[2]
+
+
+# checks that plan new can only match a subset of what plan old matched
+# (raised coupon min, narrower maturity, extra excluded state, ...)
+def narrows(new, old):
+    clauses = {clause.name: clause for clause in new.clauses}
+    for clause in old.clauses:
+        # dropping a clause widens the screen
+        if clause.name not in clauses or not _within(clauses[clause.name], clause):
+            return False
+    return True
+
+
+# matching rows of a plan, refining the session's last result when the
+# plan only tightens it, otherwise evaluating the whole universe
+def _base_rows(plan, universe, last):
+    if last is not None and last.version == universe.version and narrows(plan, last.plan):
+        sessions.refined += 1
+        done = set(clause.key for clause in last.plan.clauses)
+        rows = last.rows
+        for clause in plan.clauses:
+            if clause.key not in done:
+                rows = rows[clause.test(rows)]
+        return rows
+    sessions.full += 1
+    return evaluate(plan, universe)
+
+
+# screens the universe for a comment
+# the cache and the sessions keep every matching row, the display order is
+# made from them for each call
+# Input: Criteria, NormalizedUniverse, ResultCache (None to skip caching),
+# session id to refine the session's previous screen (None for no session)
+# Output: read only array of row ids in display order
+def run(criteria, universe, cache=results, session=None):
+    plan = compile_plan(criteria, universe)
+    last = sessions.get(session) if session is not None else None
+
+    def compute():
+        return _base_rows(plan, universe, last)
+
+    if cache is None:
+        rows = compute()
+    else:
+        rows = cache.get(plan_key(plan, universe), compute)
+    if session is not None:
+        sessions.put(session, Session(universe.version, plan, rows))
+    return _order(plan, rows, universe)
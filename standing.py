@@ -0,0 +1,321 @@
+# Standing PM requests matched against new offerings
+# Open requests from pm.py are indexed once, each range criterion in an
+# interval tree and the state lists in sets, so a new offering finds the
+# requests it satisfies with a few binary searches and one tree lookup
+# instead of re-screening every request. Matches are kept for the
+# "new matches" panel of webapp.py.
+import os
+import threading
+import time
+from collections import deque, namedtuple
+
+import numpy as np
+
+import comments
+import screen
+from requeststore import RequestStore, STORE_DIR
+from universe import NEVER_CALLED
+
+
+# Centered interval tree over closed intervals [low, high]
+# every node keeps the intervals that contain its center, sorted by low and
+# by high, intervals left or right of the center go to the child nodes
+# an interval with low > high (a coupon min above the max) contains no
+# point and is left out, it would never split into smaller sets
+# Input: arrays of low and high bounds, ids to report for each interval
+class IntervalTree:
+
+    def __init__(self, low, high, ids=None):
+        low = np.asarray(low)
+        high = np.asarray(high)
+        ids = np.arange(len(low)) if ids is None else np.asarray(ids)
+        valid = low <= high
+        low, high, ids = low[valid], high[valid], ids[valid]
+        self.size = len(low)
+        # sorted bounds count the intervals containing a point without
+        # walking the tree
+        self._lows = np.sort(low)
+        self._highs = np.sort(high)
+        self.root = self._build(low, high, ids)
+
+    def _build(self, low, high, ids):
+        if len(ids) == 0:
+            return None
+        # median of the bounds, always one of them so every node holds at
+        # least one interval
+        center = np.sort(np.concatenate([low, high]))[len(low)]
+        left = high < center
+        right = low > center
+        here = ~(left | right)
+        by_low = np.argsort(low[here], kind='stable')
+        by_high = np.argsort(high[here], kind='stable')
+        return (center,
+                low[here][by_low], ids[here][by_low],
+                high[here][by_high], ids[here][by_high],
+                self._build(low[left], high[left], ids[left]),
+                self._build(low[right], high[right], ids[right]))
+
+    # number of intervals containing x
+    def count(self, x):
+        return int(np.searchsorted(self._lows, x, 'right') - np.searchsorted(self._highs, x, 'left'))
+
+    # ids of the intervals containing x
+    # Output: unsorted int array
+    def stab(self, x):
+        found = []
+        node = self.root
+        while node is not None:
+            center, lows, low_ids, highs, high_ids, left, right = node
+            if x < center:
+                # every interval here ends at or after the center
+                found.append(low_ids[:np.searchsorted(lows, x, 'right')])
+                node = left
+            elif x > center:
+                # every interval here starts at or before the center
+                found.append(high_ids[np.searchsorted(highs, x, 'left'):])
+                node = right
+            else:
+                found.append(low_ids)
+                break
+        if not found:
+            return np.arange(0)
+        return np.concatenate(found)
+
+
+# one standing request
+# key names the request (pm.py session and row id), criteria has its
+# defaults resolved when it was added
+Request = namedtuple('Request', ['key', 'comment', 'criteria'])
+
+# an offering matching standing requests
+Match = namedtuple('Match', ['time', 'version', 'row', 'cusip', 'requests'])
+
+# range criteria of a request as (offering attribute, low bound, high
+# bound), the same ranges compile_plan screens
+def _bounds(c):
+    return [
+        ('size', c.size, np.inf),
+        ('coupon', c.coupon_min, c.coupon_max),
+        ('maturity', screen._ns(c.maturity_min), screen._ns(c.maturity_max)),
+        ('call', screen._ns(c.call_min), NEVER_CALLED),
+        # rating_max is the best (lowest) code, rating_min the worst
+        ('rating', c.rating_max, c.rating_min),
+    ]
+
+
+# Index of the open requests
+# requests are added and removed one at a time, the index is rebuilt on the
+# next match after a change
+class StandingRequests:
+
+    def __init__(self):
+        self.requests = []
+        self._ids = {}
+        self._index = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    # adds (or replaces) a request
+    # Input: key, comment string in the pm.py export format
+    # raises comments.CommentError for a bad comment
+    def add(self, key, comment, now=None):
+        criteria = screen.parse_comment(comment)
+        if criteria is None:
+            return
+        request = Request(key, comment, screen.with_defaults(criteria, now))
+        with self._lock:
+            if key in self._ids:
+                self.requests[self._ids[key]] = request
+            else:
+                self._ids[key] = len(self.requests)
+                self.requests.append(request)
+            self._index = None
+
+    def remove(self, key):
+        with self._lock:
+            i = self._ids.pop(key, None)
+            if i is not None:
+                self.requests[i] = None
+                self._index = None
+
+    def keys(self):
+        with self._lock:
+            return list(self._ids)
+
+    # interval trees, bounds and state sets of the open requests
+    # must be called with the lock held
+    def _build(self):
+        if self._index is not None:
+            return self._index
+        # drops the slots of removed requests
+        self.requests = [r for r in self.requests if r is not None]
+        self._ids = {r.key: i for i, r in enumerate(self.requests)}
+        bounds = [_bounds(r.criteria) for r in self.requests]
+
+        # per attribute: interval tree, and low/high bounds by request id to
+        # check the candidates of another attribute's tree
+        ranges = {}
+        for k, (name, _, _) in enumerate(bounds[0] if bounds else []):
+            dtype = np.int64 if name in ('maturity', 'call') else np.float64
+            low = np.array([b[k][1] for b in bounds], dtype=dtype)
+            high = np.array([b[k][2] for b in bounds], dtype=dtype)
+            ranges[name] = (IntervalTree(low, high), low, high)
+
+        # state filters: a preferred state list with general market allowed
+        # only orders results, otherwise the listed states are required
+        filtered = np.zeros(len(self.requests), dtype=bool)
+        includes = {}
+        excludes = {}
+        for i, r in enumerate(self.requests):
+            c = r.criteria
+            if c.include and c.general != 'Yes':
+                filtered[i] = True
+                for state in c.include:
+                    includes.setdefault(state, set()).add(i)
+            for state in c.exclude:
+                excludes.setdefault(state, set()).add(i)
+        self._index = (ranges, filtered, includes, excludes)
+        return self._index
+
+    # keys of the requests a bond satisfies
+    # the tree holding the fewest intervals around the bond's value gives
+    # the candidates, the other ranges and the state sets narrow them down
+    # Input: NormalizedUniverse, row id
+    # Output: list of request keys
+    def match_row(self, universe, row):
+        values = {
+            'size': universe.ask_size[row], 'coupon': universe.coupon[row],
+            'maturity': universe.maturity[row], 'call': universe.call[row],
+            'rating': universe.rating[row],
+        }
+        # bonds missing a value can't pass a range
+        if any(v != v for v in values.values()):
+            return []
+        with self._lock:
+            if not self._ids:
+                return []
+            ranges, filtered, includes, excludes = self._build()
+            counts = {name: tree.count(values[name]) for name, (tree, _, _) in ranges.items()}
+            first = min(counts, key=counts.get)
+            if counts[first] == 0:
+                return []
+            candidates = ranges[first][0].stab(values[first])
+            keep = np.ones(len(candidates), dtype=bool)
+            for name, (_, low, high) in ranges.items():
+                if name != first:
+                    keep &= (low[candidates] <= values[name]) & (values[name] <= high[candidates])
+            state = universe.frame['State'].iat[row]
+            allowed = includes.get(state, ())
+            denied = excludes.get(state, ())
+            return [self.requests[i].key for i in np.sort(candidates[keep])
+                    if (not filtered[i] or i in allowed) and i not in denied]
+
+
+# Open requests of the pm.py request tables
+# the store folder is read again when a session file changes, every row of
+# every session is a standing request keyed "session/row id"
+class OpenRequests(StandingRequests):
+
+    def __init__(self, directory=STORE_DIR):
+        super().__init__()
+        self.directory = directory
+        self._seen = {}
+
+    # picks up changed session files
+    # Output: True when requests were added or removed
+    def refresh(self):
+        try:
+            names = [n for n in os.listdir(self.directory) if n.endswith('.jsonl')]
+        except OSError:
+            names = []
+        stamps = {}
+        for name in names:
+            try:
+                stamps[name[:-len('.jsonl')]] = os.stat(os.path.join(self.directory, name)).st_mtime_ns
+            except OSError:
+                pass
+        changed = [s for s, stamp in stamps.items() if self._seen.get(s) != stamp]
+        gone = [s for s in self._seen if s not in stamps]
+        if not changed and not gone:
+            return False
+
+        store = RequestStore(self.directory)
+        columns = [name for name, _, _, _ in comments.FIELDS]
+        prefixes = tuple(s + '/' for s in changed + gone)
+        for key in self.keys():
+            if key.startswith(prefixes):
+                self.remove(key)
+        for session in changed:
+            # rows go through the export format, like a PM's pasted comment
+            frame = store.frame(session, columns + ['id'])
+            lines = frame[columns].to_csv(index=False, header=False).splitlines()
+            for row_id, line in zip(frame['id'], lines):
+                try:
+                    self.add('%s/%s' % (session, row_id), line)
+                except comments.CommentError:
+                    # requests that don't parse can't match anything
+                    pass
+        self._seen = stamps
+        return True
+
+
+# Recent matches of new offerings, newest first
+# Input: number of matches to keep
+class Alerts:
+
+    def __init__(self, keep=200):
+        self.matches = deque(maxlen=keep)
+        self.checked = 0
+        self.matched = 0
+        self._lock = threading.Lock()
+
+    # matches newly ingested rows against the standing requests
+    # Input: StandingRequests, NormalizedUniverse, new row ids
+    # Output: list of Match for the rows that satisfy a request
+    def notify(self, requests, universe, rows):
+        found = []
+        cusip = universe.frame['CUSIP'].to_numpy()
+        now = time.time()
+        for row in rows:
+            keys = requests.match_row(universe, row)
+            if keys:
+                found.append(Match(now, universe.version, int(row), cusip[row], keys))
+        with self._lock:
+            self.checked += len(rows)
+            self.matched += len(found)
+            self.matches.extendleft(found)
+        return found
+
+    # Output: list of Match, newest first
+    def recent(self, n=50):
+        with self._lock:
+            return list(self.matches)[:n]
+
+    def stats(self):
+        with self._lock:
+            return {'checked': self.checked, 'matched': self.matched,
+                    'kept': len(self.matches)}
+
+
+# open requests and recent matches of the webapp process
+open_requests = OpenRequests()
+alerts = Alerts()
+
+
+# checks new offerings against the open requests of pm.py
+# called by whatever adds rows to the universe
+# Input: NormalizedUniverse, row ids of the new offerings
+# Output: list of Match
+def notify(universe, rows):
+    open_requests.refresh()
+    return alerts.notify(open_requests, universe, rows)
+
+
+# matched counts every new offering that satisfied a request, recent_alerts
+# the matches kept for the New matches table
+def stats():
+    with alerts._lock:
+        return {'requests': len(open_requests), 'checked': alerts.checked,
+                'matched': alerts.matched, 'recent_alerts': len(alerts.matches)}
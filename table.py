@@ -0,0 +1,284 @@
+# Server side paging, sorting and filtering for IMGR_table
+# The screened row ids of each session stay on the server and only the
+# visible page is formatted and sent to the browser
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import pandas as pd
+
+from universe import RATING, moodyNum, rating_codes
+
+# Screen result of a session
+# rows are universe row ids in display order, priority is the matching
+# priority array (1 preferred state, 2 general market) or None, criteria
+# the screen's Criteria (None for every offering)
+View = namedtuple('View', ['universe', 'rows', 'priority', 'criteria'], defaults=(None,))
+
+# operators of the DataTable filter syntax, long form first
+operators = [['ge ', '>='], ['le ', '<='], ['lt ', '<'], ['gt ', '>'],
+             ['ne ', '!='], ['eq ', '='], ['contains '], ['datestartswith ']]
+
+# date columns, compared as datetimes
+dates = ['Maturity', 'Call Date']
+
+
+# splits one filter expression ("{Coupon} >= 5") into column, operator, value
+# Output: (column, operator, value), all None when it can't be read
+def split_filter_part(filter_part):
+    for operator_type in operators:
+        for operator in operator_type:
+            if operator in filter_part:
+                name_part, value_part = filter_part.split(operator, 1)
+                name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+
+                value_part = value_part.strip()
+                v0 = value_part[0] if value_part else ''
+                if v0 and v0 == value_part[-1] and v0 in ("'", '"', '`'):
+                    value = value_part[1: -1].replace('\\' + v0, v0)
+                else:
+                    try:
+                        value = float(value_part)
+                    except ValueError:
+                        value = value_part
+
+                # word operators (eq, ge, ...) are returned as symbols
+                return name, operator_type[-1].strip(), value
+
+    return [None] * 3
+
+
+# formats a filter value as text ("2025" rather than "2025.0")
+def _text(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+# display text of a column for the given rows, used by contains
+def _strings(universe, name, rows):
+    values = universe.frame[name].take(rows)
+    if name in dates:
+        return values.dt.strftime('%m/%d/%Y').fillna('Not Callable')
+    if name == RATING:
+        return values.map(moodyNum).astype(str)
+    return values.astype(str)
+
+
+# boolean array of the rows passing one filter expression
+def _filter_part(view, positions, name, operator, value):
+    u = view.universe
+    rows = view.rows[positions]
+
+    if name == 'Priority':
+        if view.priority is None:
+            return np.zeros(len(rows), dtype=bool)
+        values = view.priority[positions]
+    elif name not in u.frame.columns:
+        # unknown column, filter is ignored
+        return np.ones(len(rows), dtype=bool)
+    elif operator == 'contains':
+        return _strings(u, name, rows).str.contains(_text(value), case=False, regex=False).to_numpy()
+    elif operator == 'datestartswith':
+        values = u.frame[name].take(rows)
+        if name in dates:
+            values = values.dt.strftime('%Y-%m-%d')
+        return values.astype(str).str.startswith(_text(value)).fillna(False).to_numpy()
+    elif name in dates:
+        values = u.frame[name].take(rows).to_numpy()
+        try:
+            value = np.datetime64(pd.Timestamp(_text(value)))
+        except ValueError:
+            return np.zeros(len(rows), dtype=bool)
+    elif name == RATING:
+        values = u.rating[rows]
+        value = rating_codes.get(_text(value).upper(), value)
+    else:
+        values = u.frame[name].take(rows).to_numpy()
+
+    try:
+        if operator == '=':
+            return np.asarray(values == value)
+        if operator == '!=':
+            return np.asarray(values != value)
+        if operator == '<':
+            return np.asarray(values < value)
+        if operator == '<=':
+            return np.asarray(values <= value)
+        if operator == '>':
+            return np.asarray(values > value)
+        if operator == '>=':
+            return np.asarray(values >= value)
+    except TypeError:
+        # comparing text to numbers, nothing matches
+        return np.zeros(len(rows), dtype=bool)
+    return np.ones(len(rows), dtype=bool)
+
+
+# positions into view.rows passing a DataTable filter query
+def filter_positions(view, filter_query):
+    positions = np.arange(len(view.rows))
+    if not filter_query:
+        return positions
+    for filter_part in filter_query.split(' && '):
+        name, operator, value = split_filter_part(filter_part)
+        if name is None:
+            continue
+        positions = positions[_filter_part(view, positions, name, operator, value)]
+    return positions
+
+
+# values a column sorts by for the given positions
+def _sort_values(view, name, positions):
+    u = view.universe
+    rows = view.rows[positions]
+    if name == 'Priority':
+        return view.priority[positions] if view.priority is not None else np.zeros(len(rows))
+    if name == 'Coupon':
+        return u.coupon[rows]
+    if name == 'Ask Size':
+        return u.ask_size[rows]
+    if name == 'Maturity':
+        return u.maturity[rows]
+    if name == 'Call Date':
+        # bonds that can't be called sort after every call date
+        return u.call[rows]
+    if name == RATING:
+        return u.rating[rows]
+    return u.frame[name].to_numpy()[rows]
+
+
+# sort key of a column for the given positions, ascending numbers
+def _sort_key(view, name, positions):
+    values = _sort_values(view, name, positions)
+    if values.dtype.kind in 'fiu':
+        return values
+    # text columns sort by their position in the sorted distinct values
+    return pd.factorize(values, sort=True)[0]
+
+
+# orders positions by a DataTable sort_by list (first entry sorts first)
+def sort_positions(view, positions, sort_by):
+    if not sort_by or len(positions) == 0:
+        return positions
+    keys = []
+    for col in sort_by:
+        key = _sort_key(view, col['column_id'], positions)
+        if col['direction'] == 'desc':
+            key = -key.astype(np.float64)
+        keys.append(key)
+    # lexsort sorts by the last key first
+    return positions[np.lexsort(keys[::-1])]
+
+
+# checks whether the same rows on a newer universe version can show in
+# another place under the table's sort and filter: a sort column's value
+# changed, or a row passes the filter on one version and not the other
+# Input: View before and after (same rows, priority of those rows or None),
+# DataTable sort_by and filter_query
+# Output: (True when the page has to be fetched again, positions of the
+# rows that pass the filter after)
+def moved(before, after, sort_by, filter_query):
+    shown = filter_positions(after, filter_query)
+    if filter_query and not np.array_equal(filter_positions(before, filter_query), shown):
+        return True, shown
+    positions = np.arange(len(after.rows))
+    for col in sort_by or []:
+        old = _sort_values(before, col['column_id'], positions)
+        new = _sort_values(after, col['column_id'], positions)
+        if not (pd.isnull(old) & pd.isnull(new) | (old == new)).all():
+            return True, shown
+    return False, shown
+
+
+# LRU of the screen result of each session, remembering the ordering of the
+# last sort/filter so turning pages doesn't sort again
+class ViewStore:
+
+    def __init__(self, max_sessions=1000):
+        self.max_sessions = max_sessions
+        self._views = OrderedDict()
+        self._lock = threading.Lock()
+
+    # entries are [view, key of the last sort/filter, positions in that
+    # order, (sort_by, filter_query) of the last page]
+    def put(self, session, view):
+        with self._lock:
+            entry = self._views.get(session)
+            self._views[session] = [view, None, None, entry[3] if entry is not None else None]
+            self._views.move_to_end(session)
+            while len(self._views) > self.max_sessions:
+                self._views.popitem(last=False)
+
+    def get(self, session):
+        with self._lock:
+            entry = self._views.get(session)
+            return entry[0] if entry is not None else None
+
+    # (session, view) of every session
+    def items(self):
+        with self._lock:
+            return [(session, entry[0]) for session, entry in self._views.items()]
+
+    # replaces a session's view unless it was replaced since it was read
+    # Output: True when the view was replaced
+    def swap(self, session, old, new):
+        with self._lock:
+            entry = self._views.get(session)
+            if entry is None or entry[0] is not old:
+                return False
+            self._views[session] = [new, None, None, entry[3]]
+            return True
+
+    # sort_by and filter_query of the session's last page, (None, '') before
+    # the first page
+    def ordering(self, session):
+        with self._lock:
+            entry = self._views.get(session)
+            if entry is None or entry[3] is None:
+                return None, ''
+            return entry[3]
+
+    # every row of a session's screen result in the table's current sort and
+    # filter order
+    # Output: (universe screened, row ids, priority or None), None when the
+    # session has no screen result
+    def ordered(self, session):
+        with self._lock:
+            entry = self._views.get(session)
+            if entry is None:
+                return None
+            view, _, positions, _ = entry
+        if positions is None:
+            return view.universe, view.rows, view.priority
+        priority = view.priority[positions] if view.priority is not None else None
+        return view.universe, view.rows[positions], priority
+
+    # one page of a session's screen result
+    # Input: session id, DataTable page_current, page_size, sort_by, filter_query
+    # Output: (universe screened, row ids, priority or None, page count), None
+    # when the session has no screen result
+    def page(self, session, page_current, page_size, sort_by, filter_query):
+        key = (repr(sort_by), filter_query)
+        with self._lock:
+            entry = self._views.get(session)
+            if entry is None:
+                return None
+            view, last_key, positions, _ = entry
+            entry[3] = (sort_by, filter_query)
+
+        if last_key != key:
+            positions = filter_positions(view, filter_query)
+            positions = sort_positions(view, positions, sort_by)
+            with self._lock:
+                entry[1], entry[2] = key, positions
+
+        page_count = max(1, -(-len(positions) // page_size))
+        start = (page_current or 0) * page_size
+        positions = positions[start:start + page_size]
+        priority = view.priority[positions] if view.priority is not None else None
+        return view.universe, view.rows[positions], priority, page_count
+
+
+# screen results of the trader sessions in the process
+views = ViewStore()
@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+# the apps read IMGR1.xlsx and their caches relative to the repository
+@pytest.fixture(autouse=True, scope='session')
+def repository():
+    os.chdir(ROOT)
+
+
+# calls a dash callback through the app's http endpoint, as the browser does
+# Input: flask test client, callback dependencies, part of the output id,
+# input values, state values, prop ids that fired the callback
+# Output: response json
+def call(client, dependencies, output, inputs, state=(), changed=()):
+    dep = [d for d in dependencies if output in d['output']][0]
+
+    def fill(specs, values):
+        return [dict(id=s['id'], property=s['property'], value=v)
+                for s, v in zip(specs, values)]
+    outputs = [dict(zip(('id', 'property'), o.rsplit('.', 1)))
+               for o in dep['output'].strip('.').split('...')]
+    body = {'output': dep['output'],
+            'outputs': outputs if dep['output'].startswith('..') else outputs[0],
+            'inputs': fill(dep['inputs'], inputs),
+            'state': fill(dep['state'], state),
+            'changedPropIds': list(changed)}
+    response = client.post('/_dash-update-component', json=body)
+    assert response.status_code in (200, 204), response.data[:300]
+    return response.json if response.status_code == 200 else None
+
+
+@pytest.fixture
+def dash_call():
+    return call
@@ -0,0 +1,17 @@
+import batch
+import loader
+from universe import NormalizedUniverse
+
+REQUEST = '5,100,No,[CA NY],,,,,,,,,%s,%s'
+
+
+def test_requests_with_the_same_plan_are_screened_once():
+    df, _ = loader.load_offerings('IMGR1.xlsx', loader.SCHEMA)
+    universe = NormalizedUniverse.from_offerings(df).freeze()
+    lines = [REQUEST % ('01/01/2020', 'first'), REQUEST % ('02/01/2020', 'second'),
+             REQUEST % ('01/01/2020', 'first'), '5,100,Yes,[CA],,,,,,,,,01/01/2020,']
+    results, summary = batch.screen_batch(lines, universe, processes=1)
+    assert summary['distinct'] == 2
+    assert summary['processes'] == 1
+    assert results[0]['cusips'] == results[1]['cusips'] == results[2]['cusips']
+    assert results[0]['count'] > 0
@@ -0,0 +1,36 @@
+import time
+
+import pytest
+
+import comments
+
+REQUEST = '5,100,No,[CA NY],,,,,,,,,01/01/2020,'
+
+
+def test_manager_comment_is_the_rest_of_the_line():
+    values = comments.parse(REQUEST + 'call me, maybe [today] "asap"')
+    assert values['manager'] == 'call me, maybe [today] "asap"'
+    assert values['include'] == ('CA', 'NY')
+    assert values['settle'] == '01/01/2020'
+
+
+def test_quoted_manager_comment_is_unquoted():
+    assert comments.parse(REQUEST + '"call me, maybe"')['manager'] == 'call me, maybe'
+
+
+def test_batch_parses_manager_comments_like_parse():
+    lines = [REQUEST + 'call me, maybe', REQUEST + 'see [CA] list', REQUEST + 'plain']
+    frame, errors = comments.parse_batch(lines)
+    assert errors == []
+    assert frame['manager'].tolist() == ['call me, maybe', 'see [CA] list', 'plain']
+    assert frame['size'].tolist() == [100.0] * 3
+
+
+def test_malformed_comment_with_long_spaces_fails_fast():
+    comment = '5,100,No,' + ' ' * 20000 + 'x['
+    start = time.perf_counter()
+    with pytest.raises(comments.CommentError):
+        comments.parse(comment)
+    frame, errors = comments.parse_batch([comment])
+    assert time.perf_counter() - start < 1
+    assert [e['row'] for e in errors] == [0]
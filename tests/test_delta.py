@@ -0,0 +1,141 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import bench
+import delta
+import loader
+import screen
+from universe import RATING, BitmapIndex, NormalizedUniverse, SortedIndex, rating_codes
+
+
+# a worker's view of the journal: the batches it applied and its sheet
+class Worker:
+
+    def __init__(self, path, sheet):
+        self.sheet = sheet
+        self.applied = []
+        self.journal = delta.Journal(path, self.apply, lambda: self.sheet)
+
+    def apply(self, frame):
+        self.applied.append((self.sheet, frame['Ask Price'].tolist()))
+        return {'changes': len(frame)}
+
+
+def batch(price):
+    return pd.DataFrame({'CUSIP': ['C1'], 'Ask Dealer': ['D'], 'Ask Source': ['S'], 'Ask Price': [price]})
+
+
+def test_journal_keeps_the_batches_of_each_sheet_apart(tmp_path):
+    path = str(tmp_path / 'journal')
+    first, second = Worker(path, 'sheet-1'), Worker(path, 'sheet-1')
+    first.journal.reset()
+
+    position = first.journal.append(batch(100))
+    first.journal.catch_up()
+    assert first.journal.summary(position) == {'changes': 1}
+    second.journal.catch_up()
+    assert second.applied == [('sheet-1', [100])]
+
+    # the first worker reloads and drops the old sheet's journal
+    first.sheet = 'sheet-2'
+    first.journal.catch_up()
+    assert not os.path.exists(first.journal.file('sheet-1'))
+    first.journal.append(batch(101))
+    first.journal.catch_up()
+    assert first.applied == [('sheet-1', [100]), ('sheet-2', [101])]
+
+    # a worker still on the old sheet doesn't apply the new sheet's batches
+    second.journal.catch_up()
+    assert second.applied == [('sheet-1', [100])]
+    second.sheet = 'sheet-2'
+    second.journal.catch_up()
+    assert second.applied == [('sheet-1', [100]), ('sheet-2', [101])]
+
+    # a worker forked on the old sheet finds nothing to replay for it
+    late = Worker(path, 'sheet-1')
+    late.journal.catch_up()
+    assert late.applied == []
+    late.sheet = 'sheet-2'
+    late.journal.catch_up()
+    assert late.applied == [('sheet-2', [101])]
+
+
+# row ids of a value's map in a BitmapIndex
+def map_rows(index, value):
+    bits = index.maps[index.key[value]]
+    if bits.dtype == np.uint8:
+        return np.flatnonzero(np.unpackbits(bits, count=index.size))
+    return np.sort(bits)
+
+
+# a column with some rows changed and some added
+def changed_column(column, rng, values):
+    changed = rng.choice(len(column), len(column) // 10, replace=False)
+    new = np.concatenate([column, rng.choice(values, 50)])
+    new[changed] = rng.choice(values, len(changed))
+    added = np.concatenate([changed, np.arange(len(column), len(new))])
+    return new, changed, added
+
+
+def test_sorted_index_update_matches_a_rebuild():
+    rng = np.random.default_rng(5)
+    values = np.concatenate([np.arange(20, dtype=np.float64), [np.nan]])
+    column = rng.choice(values, 1000)
+    new, changed, added = changed_column(column, rng, values)
+    index = SortedIndex(column).updated(len(new), changed, added, new[added])
+    rebuilt = SortedIndex(new)
+    assert np.array_equal(index.values, rebuilt.values, equal_nan=True)
+    assert index.valid == rebuilt.valid
+    assert np.array_equal(new[index.order], index.values, equal_nan=True)
+    for low, high in [(None, None), (3, 7), (None, 0), (19, None), (7.5, 7.6)]:
+        start, stop = index.span(low, high)
+        assert (start, stop) == rebuilt.span(low, high)
+        assert np.array_equal(index.rows(start, stop), rebuilt.rows(start, stop))
+
+
+def test_bitmap_index_update_matches_a_rebuild():
+    rng = np.random.default_rng(6)
+    # a common value keeps a bitmap, rare ones keep row ids
+    values = np.array(['CA'] * 20 + ['NY', 'TX', 'ZZ', None], dtype=object)
+    column = rng.choice(values[:-2], 1000)
+    new, changed, added = changed_column(column, rng, values)
+    index = BitmapIndex(column).updated(len(new), added, new[added])
+    rebuilt = BitmapIndex(new)
+    assert index.size == rebuilt.size
+    for value in rebuilt.key:
+        assert np.array_equal(map_rows(index, value), map_rows(rebuilt, value)), value
+        assert index.count[index.key[value]] == rebuilt.count[rebuilt.key[value]]
+    assert np.array_equal(index.codes < 0, rebuilt.codes < 0)
+
+
+def test_changes_match_a_universe_built_from_the_changed_sheet():
+    df, _ = loader.load_offerings('IMGR1.xlsx', loader.SCHEMA)
+    universe = NormalizedUniverse.from_offerings(df).freeze()
+    frame = universe.frame
+    rng = np.random.default_rng(1)
+    pick = rng.choice(universe.size, 100, replace=False)
+    updates = pd.DataFrame({
+        'CUSIP': frame['CUSIP'].take(pick).values,
+        'Ask Dealer': frame['Ask Dealer'].take(pick).astype(str).values,
+        'Ask Source': frame['Ask Source'].take(pick).astype(str).values,
+        'Ask Price': rng.uniform(90, 110, 100).round(3),
+        'Ask Size': rng.integers(1, 300, 100) * 10000,
+        'Coupon': rng.integers(1, 8, 100),
+        'State': rng.choice(['CA', 'NY', 'ZZ'], 100),
+    })
+    rated = df[df[RATING].astype(str).str.upper().isin(rating_codes)]
+    inserts = rated.iloc[:20].astype(str).assign(CUSIP=['N%08d' % i for i in range(20)])
+    changes = pd.concat([updates.astype(str), inserts[delta.KEY + delta.VALUES]], ignore_index=True)
+
+    new, rows, summary = delta.DeltaIngest().apply(universe, changes)
+    assert summary['errors'] == []
+    assert (summary['updated'], summary['inserted']) == (100, 20)
+    assert np.array_equal(rows, np.arange(universe.size, universe.size + 20))
+    rebuilt = NormalizedUniverse(new.frame.reset_index(drop=True))
+    for name, index in new.index.items():
+        assert np.array_equal(index.values, rebuilt.index[name].values, equal_nan=True), name
+    for line in bench.synthetic_comments(100, seed=3):
+        criteria = screen.parse_comment(line)
+        assert np.array_equal(screen.run(criteria, new, cache=None), screen.run(criteria, rebuilt, cache=None)), line
@@ -0,0 +1,43 @@
+import json
+import time
+
+import feed
+
+
+# waits up to a few seconds for a condition
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+
+def test_one_feed_reads_the_source_until_it_stops(tmp_path):
+    quotes = tmp_path / 'quotes.jsonl'
+    quotes.write_text('')
+    lock = str(tmp_path / 'feed.lock')
+    handled = {'a': [], 'b': []}
+    feeds = {name: feed.QuoteFeed(feed.FileTail(str(quotes)), handled[name].append, interval=0.05, lock=lock)
+             for name in handled}
+    for f in feeds.values():
+        f.start()
+    # the tail starts at the end of the file once its feed leads
+    wait_for(lambda: any(f.source._file is not None for f in feeds.values()))
+    leader = 'a' if feeds['a'].leading else 'b'
+    other = 'b' if leader == 'a' else 'a'
+    assert not feeds[other].leading
+
+    with open(quotes, 'a') as f:
+        f.write(json.dumps({'CUSIP': 'C1', 'Ask Price': 100}) + '\n')
+    wait_for(lambda: handled[leader])
+    assert handled[other] == []
+
+    # the other feed takes over once the leader stops
+    feeds[leader].stop()
+    wait_for(lambda: feeds[other].source._file is not None)
+    assert feeds[other].leading
+    with open(quotes, 'a') as f:
+        f.write(json.dumps({'CUSIP': 'C1', 'Ask Price': 101}) + '\n')
+    wait_for(lambda: handled[other])
+    feeds[other].stop()
+    assert [frame['Ask Price'].tolist() for frame in handled[other]] == [[101]]
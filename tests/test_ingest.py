@@ -0,0 +1,54 @@
+import json
+from datetime import datetime
+
+import pytest
+
+import ingest
+
+NOW = datetime(2026, 1, 1)
+
+
+@pytest.fixture
+def validator():
+    return ingest.Validator({'AAA': 1, 'AA': 3, 'A': 6, 'BBB': 9}, range(2026, 2077), range(1, 11),
+                            {'California': 'CA', 'New York': 'NY', 'Texas': 'TX'})
+
+
+def request(**fields):
+    values = {'increment': 5, 'size': 100000, 'general': 'No'}
+    values.update(fields)
+    return values
+
+
+def test_validator_reports_the_rows_that_break_the_template(validator):
+    batch = [
+        request(general='y', stateIncl='CA, new york', couponMin=3, couponMax=5, maturityMin=2030,
+                ratingMin='A', ratingMax='aaa', settledate='2026-01-05', manager='call me'),
+        request(increment=0),
+        request(size=5000, general='maybe'),
+        request(couponMin=6, couponMax=4),
+        request(ratingMin='AAA', ratingMax='BBB'),
+        request(stateIncl='CA', stateExcl='CA TX'),
+        request(stateIncl='ZZ'),
+        request(settledate='2020-01-01'),
+        request(call=1999),
+    ]
+    rows, errors = validator.validate(ingest.read_batch(json.dumps(batch)), now=NOW)
+
+    assert [(e['row'], e['field']) for e in errors] == [
+        (1, 'Increment'),
+        (2, 'Size ($)'), (2, 'General Market (Y/N)'),
+        (3, 'Coupon Min (%)'),
+        (4, 'Rating Min'),
+        (5, 'State (exclude)'),
+        (6, 'State (include)'),
+        (7, 'Settle Date After'),
+        (8, 'Call'),
+    ]
+    assert rows == [{
+        'Increment': 5, 'Size ($)': 100000, 'General Market (Y/N)': 'Yes',
+        'State (include)': 'CA NY', 'State (exclude)': [],
+        'Coupon Min (%)': 3, 'Coupon Max (%)': 5, 'Maturity Min': 2030, 'Maturity Max': '',
+        'Call': '', 'Rating Min': 'A', 'Rating Max': 'AAA',
+        'Settle Date After': '01/05/2026', 'Manager Comment': 'call me',
+    }]
@@ -0,0 +1,58 @@
+import pytest
+
+import pm
+from requeststore import RequestStore
+
+SESSION = 'test-session'
+PAGE_SIZE = 25
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setattr(pm, 'tables', RequestStore(str(tmp_path)))
+    client = pm.app.server.test_client()
+    dependencies = client.get('/_dash-dependencies').json
+    return client, dependencies
+
+
+# the add_row callback as the table fires it
+# Output: (rows, page count, page) sent back
+def table_callback(dash_call, app, page, previous, data, changed):
+    client, dependencies = app
+    columns = [{'id': c, 'name': c} for c in pm.col_names + ['Manager Comment']]
+    state = [SESSION, data, PAGE_SIZE, columns] + [None] * 14
+    response = dash_call(client, dependencies, 'adding-rows-table.data',
+                         [0, page, previous], state, changed)
+    outputs = response['response']
+    return (outputs['adding-rows-table']['data'],
+            outputs['adding-rows-table']['page_count'],
+            outputs['adding-rows-table']['page_current'])
+
+
+def test_page_turns_after_a_delete_keep_the_rows(dash_call, app):
+    pm.tables.extend(SESSION, [{'Manager Comment': str(i)} for i in range(30)])
+    first, _ = pm.tables.page(SESSION, 0, PAGE_SIZE)
+
+    # the PM deletes one row of the first page
+    edited = [row for row in first if row['id'] != 3]
+    shown, page_count, _ = table_callback(
+        dash_call, app, 0, first, edited, ['adding-rows-table.data_previous'])
+    assert pm.tables.count(SESSION) == 29
+    assert page_count == 2
+
+    # data_previous stays as it was before the delete while paging
+    second, _, page = table_callback(
+        dash_call, app, 1, first, shown, ['adding-rows-table.page_current'])
+    assert page == 1 and len(second) == 4
+    back, _, page = table_callback(
+        dash_call, app, 0, first, second, ['adding-rows-table.page_current'])
+    assert page == 0 and len(back) == 25
+    assert pm.tables.count(SESSION) == 29
+    assert 3 not in [row['id'] for row in back]
+
+
+def test_requests_rejects_requests_that_are_not_objects(app):
+    client, dependencies = app
+    response = client.post('/requests/' + SESSION, json=[5])
+    assert response.status_code == 400
+    assert 'error' in response.json
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import bench
+import delta
+import loader
+import push
+import screen
+import table
+from universe import NormalizedUniverse
+
+UNIONS = ['5,25,Yes,[CA NY],,,,,,,,,,', '5,25,Yes,[TX],,3,,,,,,,,']
+
+
+# the sheet as loaded, and with every offering listed again at a higher coupon
+@pytest.fixture(scope='module', params=['sheet', 'doubled'])
+def universe(request):
+    df, _ = loader.load_offerings('IMGR1.xlsx', loader.SCHEMA)
+    if request.param == 'doubled':
+        again = df.copy()
+        again['Coupon'] = again['Coupon'] + 1
+        df = pd.concat([df, again], ignore_index=True)
+    return NormalizedUniverse.from_offerings(df).freeze()
+
+
+# a batch of updates to size, coupon and state, and some withdrawals
+@pytest.fixture(scope='module')
+def changed(universe):
+    frame = universe.frame
+    rng = np.random.default_rng(2)
+    pick = rng.choice(universe.size, 200, replace=False)
+    changes = pd.DataFrame({
+        'CUSIP': frame['CUSIP'].take(pick).values,
+        'Ask Dealer': frame['Ask Dealer'].take(pick).astype(str).values,
+        'Ask Source': frame['Ask Source'].take(pick).astype(str).values,
+        'Ask Size': rng.integers(1, 300, 200) * 10000,
+        'Coupon': rng.integers(1, 8, 200),
+        'State': rng.choice(['CA', 'NY', 'TX'], 200),
+    }).astype(str)
+    changes['action'] = ''
+    changes.loc[:19, 'action'] = 'withdraw'
+    new, _, summary = delta.DeltaIngest().apply(universe, changes)
+    assert summary['errors'] == [] and summary['withdrawn'] > 0
+    return new
+
+
+def view(criteria, universe):
+    if criteria is None:
+        return table.View(universe, universe.live_rows(), None)
+    rows = screen.run(criteria, universe, cache=None)
+    return table.View(universe, rows, screen.priority(criteria, universe, rows), criteria)
+
+
+@pytest.mark.parametrize('comment', [''] + UNIONS + bench.synthetic_comments(40, seed=9))
+def test_advance_matches_a_fresh_screen(universe, changed, comment):
+    criteria = screen.parse_comment(comment)
+    old = view(criteria, universe)
+    advanced, updated, joined, left = push.advance(old, changed)
+    fresh = view(criteria, changed)
+    assert np.array_equal(advanced.rows, fresh.rows)
+    if fresh.priority is None:
+        assert advanced.priority is None
+    else:
+        assert np.array_equal(advanced.priority, fresh.priority)
+    assert set(joined) == set(fresh.rows) - set(old.rows)
+    assert set(left) == set(old.rows) - set(fresh.rows)
+    assert set(updated) == set(changed.changed_rows) & set(old.rows) & set(fresh.rows)
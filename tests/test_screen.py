@@ -0,0 +1,113 @@
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import loader
+import screen
+from universe import NormalizedUniverse
+
+WIDE = '5,25,No,,,,,,,,,,,'
+NARROW = '5,25,No,,,5,,,,,,,,'
+UNION = '5,25,Yes,[CA NY],,,,,,,,,,'
+NARROW_UNION = '5,25,Yes,[CA NY],,5,,,,,,,,'
+
+
+# a sheet where every offering is listed twice, the second time with a
+# higher coupon
+@pytest.fixture(scope='module')
+def doubled():
+    df, _ = loader.load_offerings('IMGR1.xlsx', loader.SCHEMA)
+    again = df.copy()
+    again['Coupon'] = again['Coupon'] + 1
+    return NormalizedUniverse.from_offerings(pd.concat([df, again], ignore_index=True)).freeze()
+
+
+def run(comment, universe, session=None):
+    return screen.run(screen.parse_comment(comment), universe, cache=None, session=session)
+
+
+def test_repeated_offerings_are_kept_outside_the_union(doubled):
+    assert doubled.duplicates
+    rows = run(WIDE, doubled)
+    assert len(rows) == 2 * len(np.unique(doubled.offering[rows]))
+
+
+def test_union_lists_every_offering_once(doubled):
+    rows = run(UNION, doubled)
+    assert len(rows) == len(np.unique(doubled.offering[rows]))
+
+
+@pytest.mark.parametrize('wide, narrow', [(WIDE, NARROW), (UNION, NARROW_UNION)])
+def test_tightened_screen_matches_a_full_screen(doubled, wide, narrow):
+    run(wide, doubled, session='tighten')
+    refined = screen.sessions.refined
+    rows = run(narrow, doubled, session='tighten')
+    assert screen.sessions.refined == refined + 1
+    assert np.array_equal(rows, run(narrow, doubled))
+
+
+def test_cached_screen_does_not_depend_on_the_session(doubled):
+    run(UNION, doubled, session='shared')
+    criteria = screen.parse_comment(NARROW_UNION)
+    cache = screen.ResultCache()
+    refined = screen.run(criteria, doubled, cache=cache, session='shared')
+    assert np.array_equal(screen.run(criteria, doubled, cache=cache), run(NARROW_UNION, doubled))
+    assert np.array_equal(refined, run(NARROW_UNION, doubled))
+
+
+def test_cache_computes_a_screen_once_for_concurrent_callers():
+    cache = screen.ResultCache()
+    started, release = threading.Event(), threading.Event()
+    computed = []
+
+    def compute():
+        computed.append(1)
+        started.set()
+        release.wait(5)
+        return np.arange(10)
+    results = []
+    callers = [threading.Thread(target=lambda: results.append(cache.get((1, 'plan'), compute)))
+               for _ in range(4)]
+    callers[0].start()
+    started.wait(5)
+    for caller in callers[1:]:
+        caller.start()
+    # the others wait on the first caller's screen
+    for _ in range(500):
+        if cache.stats()['shared'] == 3:
+            break
+        time.sleep(0.01)
+    release.set()
+    for caller in callers:
+        caller.join(5)
+    assert len(computed) == 1
+    assert len(results) == 4 and all(r is results[0] for r in results)
+    assert not results[0].flags.writeable
+    assert cache.stats()['misses'] == 1
+
+
+def test_cache_entries_expire_after_their_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(screen.time, 'monotonic', lambda: now[0])
+    cache = screen.ResultCache(ttl=10)
+    cache.get((1, 'plan'), lambda: np.arange(3))
+    now[0] += 5
+    cache.get((1, 'plan'), lambda: np.arange(3))
+    assert cache.stats()['hits'] == 1
+    now[0] += 6
+    cache.get((1, 'plan'), lambda: np.arange(3))
+    assert cache.stats()['misses'] == 2
+
+
+def test_a_new_universe_version_drops_the_older_results():
+    cache = screen.ResultCache()
+    cache.get((1, 'plan'), lambda: np.arange(3))
+    cache.get((2, 'plan'), lambda: np.arange(4))
+    assert cache.stats()['entries'] == 1 and cache.stats()['version'] == 2
+    # a request still on the old version is screened but not kept
+    rows = cache.get((1, 'plan'), lambda: np.arange(3))
+    assert len(rows) == 3
+    assert cache.stats()['entries'] == 1 and cache.stats()['bytes'] == np.arange(4).nbytes
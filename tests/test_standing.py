@@ -0,0 +1,46 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+import bench
+import loader
+import screen
+import standing
+from universe import NormalizedUniverse
+
+NOW = datetime(2024, 1, 1)
+# coupon min above the max, a valid comment that matches nothing
+INVERTED = '5,25000,No,,,5,4,,,,,,,'
+
+
+@pytest.fixture(scope='module')
+def universe():
+    df, _ = loader.load_offerings('IMGR1.xlsx', loader.SCHEMA)
+    return NormalizedUniverse.from_offerings(df).freeze()
+
+
+def test_stab_matches_brute_force():
+    rng = np.random.default_rng(0)
+    low = rng.integers(0, 100, 500).astype(float)
+    high = low + rng.integers(-20, 40, 500)
+    tree = standing.IntervalTree(low, high)
+    for x in rng.integers(-5, 150, 200):
+        want = np.flatnonzero((low <= x) & (x <= high))
+        assert np.array_equal(np.sort(tree.stab(x)), want)
+        assert tree.count(x) == len(want)
+
+
+def test_match_row_agrees_with_the_screen(universe):
+    requests = standing.StandingRequests()
+    lines = bench.synthetic_comments(300, seed=1) + [INVERTED]
+    for i, line in enumerate(lines):
+        requests.add('r%d' % i, line, NOW)
+    truth = {}
+    for request in requests.requests:
+        plan = screen.compile_plan(request.criteria, universe, NOW)
+        for row in screen.evaluate(plan, universe, cache=None):
+            truth.setdefault(int(row), set()).add(request.key)
+    assert not any('r%d' % (len(lines) - 1) in keys for keys in truth.values())
+    for row in range(universe.size):
+        assert set(requests.match_row(universe, row)) == truth.get(row, set())
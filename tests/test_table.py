@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import loader
+import table
+from universe import NormalizedUniverse, RATING
+
+
+# a screen result: a shuffled half of the sheet's rows
+@pytest.fixture(scope='module')
+def view():
+    df, _ = loader.load_offerings('IMGR1.xlsx', loader.SCHEMA)
+    universe = NormalizedUniverse.from_offerings(df).freeze()
+    rows = np.random.default_rng(7).permutation(universe.size)[:universe.size // 2]
+    return table.View(universe, rows, None)
+
+
+# the rows of the view as the table shows them, one position per row
+def shown(view):
+    frame = view.universe.frame.take(view.rows).reset_index(drop=True)
+    return frame.assign(State=frame['State'].astype(str))
+
+
+@pytest.mark.parametrize('filter_query, expected', [
+    ('{Coupon} >= 5', lambda f: f['Coupon'] >= 5),
+    ('{State} = CA', lambda f: f['State'] == 'CA'),
+    ('{Ask Size} < 500000 && {Coupon} ne 5', lambda f: (f['Ask Size'] < 500000) & (f['Coupon'] != 5)),
+    ('{Maturity} > 2030-01-01', lambda f: f['Maturity'] > pd.Timestamp('2030-01-01')),
+    ('{Issue Type} contains revenue', lambda f: f['Issue Type'].astype(str).str.contains('REVENUE')),
+])
+def test_filter_positions_match_pandas(view, filter_query, expected):
+    positions = table.filter_positions(view, filter_query)
+    assert len(positions) > 0
+    assert np.array_equal(positions, np.flatnonzero(expected(shown(view)).to_numpy()))
+
+
+@pytest.mark.parametrize('sort_by', [
+    [{'column_id': 'Coupon', 'direction': 'desc'}],
+    [{'column_id': 'State', 'direction': 'asc'}, {'column_id': 'Coupon', 'direction': 'desc'}],
+    [{'column_id': 'Maturity', 'direction': 'desc'}, {'column_id': 'Ask Size', 'direction': 'asc'}],
+    [{'column_id': RATING, 'direction': 'asc'}, {'column_id': 'CUSIP', 'direction': 'desc'}],
+])
+def test_sort_positions_match_pandas(view, sort_by):
+    positions = table.sort_positions(view, np.arange(len(view.rows)), sort_by)
+    expected = shown(view).sort_values([s['column_id'] for s in sort_by],
+                                       ascending=[s['direction'] == 'asc' for s in sort_by],
+                                       kind='mergesort')
+    assert np.array_equal(positions, expected.index.to_numpy())
@@ -0,0 +1,20 @@
+import loader
+import watcher
+
+
+def test_a_failing_listener_does_not_stop_the_next():
+    offerings = watcher.OfferingWatcher('IMGR1.xlsx', loader.SCHEMA, 0)
+    seen = []
+
+    def broken(old, new, rows):
+        raise ValueError('broken listener')
+    offerings.listeners.extend([broken, lambda old, new, rows: seen.append(new.version)])
+
+    old = offerings.universe
+    new = old.changed(withdrawn=[0]).freeze()
+    offerings.update(lambda universe: (new, []))
+    assert offerings.universe is new
+    assert seen == [new.version]
+    stats = offerings.stats()
+    assert stats['listener_failures'] == 1
+    assert 'broken listener' in stats['listener_error']
@@ -0,0 +1,43 @@
+import pytest
+
+import webapp
+
+
+@pytest.fixture(scope='module')
+def app():
+    client = webapp.app.server.test_client()
+    client.get('/')
+    return client, client.get('/_dash-dependencies').json
+
+
+# rows the Refilter callback matched for a request
+def refilter(dash_call, app, manager):
+    client, dependencies = app
+    fields = [1, 5, 100, 'No', [], [], None, None, None, None, None, None, None,
+              '2020-01-01', manager]
+    response = dash_call(client, dependencies, 'screen.data', [fields], ['test-session'],
+                         ['fields.data'])
+    assert response is not None
+    return response['response']['screen']['data']['rows']
+
+
+def test_manager_comment_with_a_comma_screens(dash_call, app):
+    rows = refilter(dash_call, app, '')
+    assert rows > 0
+    assert refilter(dash_call, app, 'call me, maybe [today] "asap"') == rows
+
+
+def test_offerings_rejects_changes_that_are_not_objects(app):
+    client, dependencies = app
+    response = client.post('/offerings', json=[1, 2])
+    assert response.status_code == 400
+    assert 'error' in response.json
+
+
+def test_stats_count_settled_fields_and_screens(dash_call, app):
+    client, dependencies = app
+    before = client.get('/stats').json['inputs']
+    refilter(dash_call, app, '')
+    after = client.get('/stats').json['inputs']
+    assert after['received'] == before['received'] + 1
+    assert after['executed'] == before['executed'] + 1
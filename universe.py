@@ -0,0 +1,461 @@
+# Normalized offering universe
+# The offering sheet is cleaned up once when it is loaded (typed dates,
+# numeric ratings, callable flag) so that screens only pay for filtering
+import itertools
+
+import numpy as np
+import pandas as pd
+
+# Dictionary to convert rating to number for comparison
+rating = {'AAA':1, 'AA1':2, 'AA2':3, 'AA3':4, 'A1':5, 'A2':6, 'A3':7, 'BAA1':8,
+        'BAA2':9, 'BAA3':10, 'BA1':11, 'BA2':12, 'BA3':13, 'B1':14, 'B2':15,
+        'B3':16, 'AA+':2, 'AA':3, 'AA-':4, 'A+':5, 'A':6, 'A-':7, 'BBB+':8,
+        'BBB':9, 'BBB-':10, 'BB+':11, 'BB':12, 'BB-':13, 'B+':14, 'B':15,
+        'B-':16
+        }
+
+# reverse dictionary to reconvert to rating
+moodyNum = {1:'AAA',2:'AA1',3:'AA2',4:'AA3',5:'A1',6:'A2',7:'A3',8:'BAA1',9:'BAA2',
+            10:'BAA3',11:'BA1',12:'BA2',13:'BA3',14:'B1',15:'B2',16:'B3',17:'CAA1',
+            18:'CAA2',19:'CAA3',20:'CA',21:'C'
+            }
+
+# list of columns to display to trader
+col_names = [
+        'CUSIP', 'CUSIP6', 'State', 'Coupon', 'Maturity', 'Ask Price', 'Ask Yield To Worst',
+        'Ask Size', 'Underlying Moody\'s Rating', 'Call Date', 'Issue Type',
+        'Ask Dealer', 'Ask Source'
+        ]
+
+# columns naming an offering, a CUSIP quoted by a dealer through a source
+OFFERING = ['CUSIP', 'Ask Dealer', 'Ask Source']
+
+# value the sheet uses for bonds without a call date
+NOT_CALLABLE = '#N/A Field Not Applicable'
+
+# rating column name, used all over the place
+RATING = 'Underlying Moody\'s Rating'
+
+# call key given to bonds that can't be called so every call clause passes
+NEVER_CALLED = np.iinfo(np.int64).max
+
+# version numbers handed out to universes, caches key on them so results
+# from an older sheet are never reused
+_versions = itertools.count(1)
+
+# every Moody's rating the sheet can carry, including the ones below B3 that
+# are only in the reverse dictionary
+rating_codes = dict(rating)
+rating_codes.update({v: k for k, v in moodyNum.items() if v not in rating_codes})
+
+# rating names indexed by rating code, converts a whole column of codes back
+# to ratings with one array lookup
+rating_names = np.array([moodyNum.get(i) for i in range(max(moodyNum) + 1)], dtype=object)
+
+
+# Sorted permutation of a column
+# a range of values resolves to a slice of order with two binary searches
+# instead of a scan over the whole column
+class SortedIndex:
+
+    def __init__(self, column):
+        self.order = np.argsort(column, kind='stable')
+        self.values = column[self.order]
+        # NaN sorts last and never passes a comparison
+        if self.values.dtype.kind == 'f':
+            self.valid = len(self.values) - int(np.isnan(self.values).sum())
+        else:
+            self.valid = len(self.values)
+
+    # positions in order holding values between low and high (inclusive)
+    # Input: bounds, None for an open end
+    # Output: (start, stop) into order
+    def span(self, low=None, high=None):
+        start = 0 if low is None else int(np.searchsorted(self.values[:self.valid], low, 'left'))
+        stop = self.valid if high is None else int(np.searchsorted(self.values[:self.valid], high, 'right'))
+        return start, max(start, stop)
+
+    # index after some rows changed value or were added, this one is left as
+    # it is; the changed rows are taken out and every new value goes in at
+    # its binary search position, which moves memory once instead of sorting
+    # the column again
+    # Input: number of rows, row ids whose value changed, row ids to put in
+    # (the changed and the added rows) and their values
+    # Output: new SortedIndex
+    def updated(self, size, removed, added, values):
+        gone = np.zeros(size, dtype=bool)
+        gone[removed] = True
+        keep = ~gone[self.order]
+        order = self.order[keep]
+        current = self.values[keep]
+        sort = np.argsort(values, kind='stable')
+        values = np.asarray(values, dtype=current.dtype)[sort]
+        at = np.searchsorted(current, values, 'right')
+        index = SortedIndex.__new__(SortedIndex)
+        index.order = np.insert(order, at, added[sort])
+        index.values = np.insert(current, at, values)
+        # NaN sorts last, searchsorted puts it after every number
+        if index.values.dtype.kind == 'f':
+            index.valid = int(np.searchsorted(index.values, np.nan, 'left'))
+        else:
+            index.valid = len(index.values)
+        return index
+
+    # row ids for a span, in row order
+    def rows(self, start, stop):
+        return np.sort(self.order[start:stop])
+
+    # packed bitmap (one bit per row) for a span
+    def bits(self, start, stop):
+        mask = np.zeros(len(self.order), dtype=bool)
+        mask[self.order[start:stop]] = True
+        return np.packbits(mask)
+
+
+# Bitmap per value of a low cardinality column (State, CUSIP6)
+# values held by few bonds keep their row ids, the rest keep a packed bitmap
+# (one bit per row), so lists of values become bitwise OR/ANDNOT operations
+class BitmapIndex:
+
+    def __init__(self, column):
+        codes, names = pd.factorize(column)
+        self.size = len(codes)
+        self.codes = codes
+        self.key = {name: i for i, name in enumerate(names)}
+        self.count = np.bincount(codes[codes >= 0], minlength=len(names))
+
+        # row ids grouped by code, -1 (missing) sorts first
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(names) + 1))
+        self.maps = []
+        for i in range(len(names)):
+            rows = order[bounds[i]:bounds[i + 1]]
+            # row ids (4 bytes each) are smaller than the bitmap below n/32
+            if len(rows) * 32 < self.size:
+                self.maps.append(rows.astype(np.int32))
+            else:
+                self.maps.append(self.pack(rows))
+
+    # index after some rows changed value or were added, this one is left as
+    # it is; only the maps of the values the rows leave or join are copied
+    # Input: number of rows, row ids that changed or were added, their values
+    # Output: new BitmapIndex
+    def updated(self, size, rows, values):
+        index = BitmapIndex.__new__(BitmapIndex)
+        index.size = size
+        index.key = dict(self.key)
+        # missing values have no map, like pd.factorize gives them -1
+        new = np.array([index.key.setdefault(v, len(index.key)) if v is not None and v == v else -1
+                        for v in values], dtype=self.codes.dtype)
+        codes = np.full(size, -1, dtype=self.codes.dtype)
+        codes[:self.size] = self.codes
+        old = codes[rows]
+        codes[rows] = new
+        index.codes = codes
+        index.count = np.zeros(len(index.key), dtype=self.count.dtype)
+        index.count[:len(self.count)] = self.count
+        np.subtract.at(index.count, old[old >= 0], 1)
+        np.add.at(index.count, new[new >= 0], 1)
+
+        maps = list(self.maps) + [np.arange(0, dtype=np.int32)] * (len(index.key) - len(self.maps))
+        # added rows lengthen every packed bitmap
+        grow = (size + 7) // 8 - (self.size + 7) // 8
+        if grow:
+            maps = [np.concatenate([m, np.zeros(grow, dtype=np.uint8)]) if m.dtype == np.uint8 else m
+                    for m in maps]
+        for i in set(old[old >= 0].tolist()) | set(new[new >= 0].tolist()):
+            leaving = rows[(old == i) & (new != i)]
+            joining = rows[(new == i) & (old != i)]
+            bits = maps[i]
+            if bits.dtype == np.uint8:
+                bits = bits if grow else bits.copy()
+                np.bitwise_and.at(bits, leaving >> 3, ~(0x80 >> (leaving & 7)).astype(np.uint8))
+                np.bitwise_or.at(bits, joining >> 3, (0x80 >> (joining & 7)).astype(np.uint8))
+            else:
+                bits = np.concatenate([bits[~np.isin(bits, leaving)], joining.astype(np.int32)])
+                if len(bits) * 32 >= size:
+                    bits = index.pack(bits)
+            maps[i] = bits
+        index.maps = maps
+        return index
+
+    # packed bitmap with the given row ids set
+    def pack(self, rows):
+        mask = np.zeros(self.size, dtype=bool)
+        mask[rows] = True
+        return np.packbits(mask)
+
+    # packed bitmap with every row set
+    def ones(self):
+        return np.packbits(np.ones(self.size, dtype=bool))
+
+    # bitwise OR of the bitmaps of the given values, unknown values are ignored
+    # Input: list of values
+    # Output: (packed bitmap, number of rows set)
+    def union(self, values):
+        bits = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        sparse = []
+        count = 0
+        for value in set(values):
+            i = self.key.get(value)
+            if i is None:
+                continue
+            count += int(self.count[i])
+            if self.maps[i].dtype == np.uint8:
+                bits |= self.maps[i]
+            else:
+                sparse.append(self.maps[i])
+        if sparse:
+            bits |= self.pack(np.concatenate(sparse))
+        return bits, count
+
+
+# True for the given row ids whose bit is set in a packed bitmap
+def bit_test(bits, rows):
+    return ((bits[rows >> 3] >> (7 - (rows & 7))) & 1).astype(bool)
+
+
+# row ids (in row order) of the set bits of a packed bitmap
+def bit_rows(bits, size):
+    return np.flatnonzero(np.unpackbits(bits, count=size))
+
+
+# text key of the offering of every row, see OFFERING
+# Input: data frame with the OFFERING columns
+# Output: series of 'CUSIP|dealer|source' strings
+def offering_keys(frame):
+    keys = frame[OFFERING[0]].astype(str)
+    for col in OFFERING[1:]:
+        keys = keys.str.cat(frame[col].astype(str), sep='|')
+    return keys
+
+
+# NumPy columns the screening engine compares against
+# Input: universe frame (or some of its rows)
+# Output: dictionary of universe attribute to array
+def engine_columns(frame):
+    # dates as int64 nanoseconds, not callable bonds sort after any date
+    call = frame['Call Date'].to_numpy('datetime64[ns]').view(np.int64)
+    return {
+        'coupon': frame['Coupon'].to_numpy(np.float64),
+        'ask_size': frame['Ask Size'].to_numpy(np.float64),
+        'rating': frame[RATING].to_numpy(),
+        'maturity': frame['Maturity'].to_numpy('datetime64[ns]').view(np.int64),
+        'call': np.where(frame['callable'].to_numpy(), call, NEVER_CALLED),
+    }
+
+
+# engine arrays: the frame columns they come from and their sorted index
+engine_sources = {
+    'coupon': (['Coupon'], 'coupon'),
+    'ask_size': (['Ask Size'], 'size'),
+    'rating': ([RATING], 'rating'),
+    'maturity': (['Maturity'], 'maturity'),
+    'call': (['Call Date', 'callable'], 'call'),
+}
+
+
+# column with new values at some rows, the column itself is not changed
+# the type is widened when a value doesn't fit (a price that float32 can't
+# hold, a state that isn't a category yet)
+def _replaced(column, rows, values):
+    values = pd.Series(values, dtype=object if column.dtype.kind == 'O' else None)
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        extra = pd.Index(values.dropna().unique()).difference(column.cat.categories)
+        column = column.cat.add_categories(extra) if len(extra) else column.copy()
+        column.iloc[rows] = values.to_numpy()
+        return column
+    array = column.to_numpy(copy=True)
+    fits = values.to_numpy().astype(array.dtype) if array.dtype.kind != 'O' else values.to_numpy()
+    if array.dtype.kind in 'iuf' and not np.array_equal(fits, values.to_numpy(), equal_nan=True):
+        array = array.astype(np.float64) if values.dtype.kind in 'iuf' else array.astype(object)
+        fits = values.to_numpy().astype(array.dtype)
+    array[rows] = fits
+    return pd.Series(array, index=column.index, name=column.name)
+
+
+# rows added at the end of a frame, categories are merged so categorical
+# columns stay categorical
+def _appended(frame, rows):
+    rows = rows[frame.columns].copy()
+    for col in frame.columns:
+        if isinstance(frame[col].dtype, pd.CategoricalDtype):
+            extra = pd.Index(rows[col].dropna().unique()).difference(frame[col].cat.categories)
+            if len(extra):
+                frame = frame.copy(deep=False)
+                frame[col] = frame[col].cat.add_categories(extra)
+            rows[col] = rows[col].astype(frame[col].dtype)
+    return pd.concat([frame, rows], ignore_index=True)
+
+
+# Offering data cleaned up for screening
+# frame holds the display columns with Maturity/Call Date as datetime64,
+# the rating as an integer code (1 = AAA) and a boolean callable column
+# index holds a SortedIndex for each range column, states and issuers are
+# BitmapIndexes
+class NormalizedUniverse:
+
+    def __init__(self, frame):
+        self.frame = frame
+        self.size = len(frame)
+        self.version = next(_versions)
+        # withdrawn offerings keep their rows until the next full load, live
+        # is None while every row is offered
+        self.live = None
+        self.live_bits = None
+        self.offered = self.size
+        # for a universe made by changed(), the version it was made from and
+        # the row ids that differ from it
+        self.base = None
+        self.changed_rows = None
+
+        # NumPy columns the screening engine compares against
+        for name, values in engine_columns(frame).items():
+            setattr(self, name, values)
+        # one code per offering (see OFFERING), used to list each offering
+        # once in the general market union
+        self.offering = pd.factorize(offering_keys(frame))[0]
+        self.duplicates = len(np.unique(self.offering)) < self.size
+
+        # bitmaps for state and issuer (base CUSIP) membership
+        self.states = BitmapIndex(frame['State'])
+        self.issuers = BitmapIndex(frame['CUSIP6'])
+
+        # sorted indexes for the range clauses
+        self.index = {
+            'size': SortedIndex(self.ask_size),
+            'coupon': SortedIndex(self.coupon),
+            'maturity': SortedIndex(self.maturity),
+            'call': SortedIndex(self.call),
+            'rating': SortedIndex(self.rating),
+        }
+
+    # engine arrays and indexes
+    def _arrays(self):
+        arrays = [self.coupon, self.ask_size, self.rating, self.maturity,
+                  self.call, self.offering, self.states.codes, self.issuers.codes]
+        for index in self.index.values():
+            arrays += [index.order, index.values]
+        for bitmaps in (self.states, self.issuers):
+            arrays += bitmaps.maps
+        if self.live is not None:
+            arrays += [self.live, self.live_bits]
+        return arrays
+
+    # row ids of the offered rows, in row order
+    def live_rows(self):
+        if self.live is None:
+            return np.arange(self.size)
+        return np.flatnonzero(self.live)
+
+    # a new version of the universe with offerings changed, added or
+    # withdrawn, this one is left as it is for the screens still using it
+    # only the changed columns are copied, and the indexes are updated for
+    # the changed rows instead of being built again
+    # Input: dictionary of frame column to (row ids, new values) in universe
+    # types (see normalize), normalized frame of added offerings and their
+    # offering codes, row ids withdrawn and row ids offered again
+    # Output: NormalizedUniverse
+    def changed(self, updates=None, inserts=None, offering=None, withdrawn=(), revived=()):
+        updates = updates or {}
+        new = NormalizedUniverse.__new__(NormalizedUniverse)
+        new.__dict__.update(self.__dict__)
+        new.version = next(_versions)
+        new.base = self.version
+
+        frame = self.frame
+        if updates:
+            frame = frame.copy(deep=False)
+            for col, (rows, values) in updates.items():
+                frame[col] = _replaced(frame[col], rows, values)
+        if inserts is not None and len(inserts):
+            frame = _appended(frame, inserts)
+            new.offering = np.concatenate([self.offering, offering])
+            # a code below the first new one is an offering already listed
+            new.duplicates = self.duplicates or bool(
+                (offering <= self.offering.max(initial=-1)).any() or len(np.unique(offering)) < len(offering))
+        new.frame = frame
+        new.size = len(frame)
+        added = np.arange(self.size, new.size)
+
+        # engine arrays and sorted indexes of the changed columns
+        changed = {col: np.asarray(rows) for col, (rows, _) in updates.items()}
+        touched = np.unique(np.concatenate([np.arange(0)] + list(changed.values()) + [added]))
+        new.changed_rows = np.union1d(touched, np.concatenate([
+            np.asarray(withdrawn, dtype=np.int64), np.asarray(revived, dtype=np.int64)]))
+        values = engine_columns(frame.iloc[touched])
+        new.index = dict(self.index)
+        for name, (sources, index) in engine_sources.items():
+            rows = np.unique(np.concatenate([np.arange(0)] + [changed[c] for c in sources if c in changed]))
+            if len(rows) == 0 and len(added) == 0:
+                continue
+            put = np.concatenate([rows, added])
+            put_values = values[name][np.searchsorted(touched, put)]
+            array = np.empty(new.size, dtype=getattr(self, name).dtype)
+            array[:self.size] = getattr(self, name)
+            array[put] = put_values
+            setattr(new, name, array)
+            new.index[index] = self.index[index].updated(new.size, rows, put, put_values)
+
+        # state and issuer bitmaps
+        for attr, col in (('states', 'State'), ('issuers', 'CUSIP6')):
+            rows = np.concatenate([changed.get(col, np.arange(0)), added]).astype(np.int64)
+            if len(rows):
+                setattr(new, attr, getattr(self, attr).updated(
+                    new.size, rows, frame[col].take(rows).tolist()))
+
+        if len(added) or len(withdrawn) or len(revived):
+            live = np.ones(new.size, dtype=bool)
+            if self.live is not None:
+                live[:self.size] = self.live
+            live[np.asarray(withdrawn, dtype=np.int64)] = False
+            live[np.asarray(revived, dtype=np.int64)] = True
+            new.offered = int(live.sum())
+            if new.offered == new.size:
+                new.live, new.live_bits = None, None
+            else:
+                new.live, new.live_bits = live, np.packbits(live)
+        return new
+
+    # memory used by the universe in bytes, per frame column and for the
+    # engine arrays and indexes
+    def memory(self):
+        report = {col: int(size) for col, size in
+                  self.frame.memory_usage(index=False, deep=True).items()}
+        report['(engine)'] = int(sum(a.nbytes for a in self._arrays()))
+        report['(total)'] = int(sum(report.values()))
+        return report
+
+    # marks the engine arrays read-only, for a universe shared between
+    # forked workers nothing may write into the shared pages
+    def freeze(self):
+        for a in self._arrays():
+            a.flags.writeable = False
+        return self
+
+    # builds the universe from the raw offering sheet
+    # Input: data frame as read from the IMGR sheet
+    # Output: NormalizedUniverse
+    @classmethod
+    def from_offerings(cls, df):
+        return cls(normalize(df).reset_index(drop=True))
+
+
+# cleans up offering rows from the sheet for screening
+# Input: data frame with the sheet's columns (col_names)
+# Output: data frame of the rows traders look at, in universe types
+def normalize(df):
+    frame = df[[col for col in col_names]].copy()
+
+    # converts rating to upper case number, dropping WR (wasn't rated) and
+    # unrated bonds since traders don't look at those
+    codes = frame[RATING].str.upper().map(rating_codes)
+    frame = frame.loc[codes.notnull()].copy()
+    frame[RATING] = codes[codes.notnull()].astype(np.int8)
+
+    # converts maturity to datetime object for date comparision
+    frame['Maturity'] = pd.to_datetime(frame['Maturity'])
+    # bonds without call date are flagged instead of using a far future date
+    frame['callable'] = (frame['Call Date'] != NOT_CALLABLE).to_numpy()
+    frame['Call Date'] = pd.to_datetime(frame['Call Date'].where(frame['callable']))
+    return frame
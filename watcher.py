@@ -0,0 +1,175 @@
+# Hot reload of the offering sheet
+# A background thread checks the sheet and, once a changed file has stopped
+# changing, loads and normalizes it next to the running universe and swaps
+# the new version in with a single assignment. A universe is never changed
+# after it is built (its arrays are read-only), so a request that picked up
+# the old version finishes on it, and the screen caches key on the version
+# so nothing built from the old sheet is served after the swap.
+import os
+import threading
+import time
+
+import numpy as np
+
+import loader
+from universe import NormalizedUniverse, offering_keys
+
+
+# rows of a new universe whose offering was not in the old one
+# Input: old and new NormalizedUniverse
+# Output: row ids of the new universe
+def new_rows(old, new):
+    return np.flatnonzero(~offering_keys(new.frame).isin(offering_keys(old.frame)).to_numpy())
+
+
+# name of a version of the file (see OfferingWatcher._stat), the same in
+# every process
+def _sheet(stamp):
+    return 'none' if stamp is None else '-'.join(str(v) for v in stamp)
+
+
+class OfferingWatcher:
+
+    # loads the sheet, checks it again every interval seconds once started
+    # Input: path to the excel sheet, schema for loader.load_offerings,
+    # seconds between checks (0 to never reload)
+    def __init__(self, path, schema=None, interval=5.0):
+        self.path = path
+        self.schema = schema
+        self.interval = interval
+        # called with (old universe, new universe, row ids of the offerings
+        # new in it) after every swap
+        self.listeners = []
+        self.reloads = 0
+        self.updates = 0
+        self.failures = 0
+        self.last_error = None
+        self.listener_failures = 0
+        self.listener_error = None
+        self.seconds = None
+        self._stamp = self._stat()
+        self._pending = self._stamp
+        # names the version of the file the universe was loaded from, the
+        # offering journal keeps the batches of each sheet apart
+        self.sheet = _sheet(self._stamp)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.universe = self._load()
+        self.loaded = time.time()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    # identifies a version of the file, a replaced file has a new inode
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def _load(self):
+        df, _ = loader.load_offerings(self.path, self.schema)
+        return NormalizedUniverse.from_offerings(df).freeze()
+
+    # loads the sheet and swaps it in if it has changed
+    # a file is loaded once it looks the same on two checks in a row, so a
+    # sheet still being copied in is not read half written
+    # Output: True when a new universe was swapped in
+    def check(self):
+        stamp = self._stat()
+        if stamp is None or stamp == self._stamp:
+            return False
+        if stamp != self._pending:
+            self._pending = stamp
+            return False
+        # a sheet that fails to load is tried again when it changes again
+        self._stamp = stamp
+        self.reload()
+        return True
+
+    # loads the sheet and swaps the new universe in
+    # Output: the new NormalizedUniverse
+    def reload(self):
+        start = time.perf_counter()
+        stamp = self._stat()
+        try:
+            new = self._load()
+        except Exception as e:
+            self.failures += 1
+            self.last_error = '%s: %s' % (type(e).__name__, e)
+            raise
+        with self._lock:
+            old = self.universe
+            self.reloads += 1
+            self.loaded = time.time()
+            self.seconds = time.perf_counter() - start
+            self.sheet = _sheet(stamp)
+            self._swap(old, new, new_rows(old, new))
+        return new
+
+    # swaps in a universe made from the current one, like a batch of
+    # offering changes; changes are made one at a time so none is lost
+    # Input: function of the current universe returning (new universe, row
+    # ids of the offerings new in it) and anything else to pass back
+    # Output: what the function returned
+    def update(self, change):
+        with self._lock:
+            old = self.universe
+            result = change(old)
+            new, rows = result[0], result[1]
+            if new is not old:
+                self.updates += 1
+                self._swap(old, new, rows)
+        return result
+
+    # must be called with the lock held
+    def _swap(self, old, new, rows):
+        self.universe = new
+        # the new version is in use already, a failing listener is counted
+        # and the next ones still run
+        for listener in self.listeners:
+            try:
+                listener(old, new, rows)
+            except Exception as e:
+                self.listener_failures += 1
+                self.listener_error = '%s: %s' % (type(e).__name__, e)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                # counted in failures, the old universe stays in use
+                pass
+
+    # starts the checks in a daemon thread
+    def start(self):
+        if self.interval <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='offering-watcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    # threads don't survive a fork, a forked child that serves requests
+    # calls start() itself (see gunicorn.conf.py), other children (batch pool
+    # workers) don't check the sheet
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def stats(self):
+        return {
+            'path': self.path, 'sheet': self.sheet, 'version': self.universe.version,
+            'size': self.universe.size, 'reloads': self.reloads,
+            'updates': self.updates,
+            'failures': self.failures, 'last_error': self.last_error,
+            'listener_failures': self.listener_failures,
+            'listener_error': self.listener_error,
+            'seconds': self.seconds, 'loaded': self.loaded,
+            'interval': self.interval,
+        }
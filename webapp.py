@@ -9,19 +9,42 @@ from dash.exceptions import PreventUpdate
 import pandas as pd
 from datetime import datetime as dt
 from dateutil.relativedelta import relativedelta
-import time
-import random
 import numpy as np
+import base64
+import io
+import os
 import time
+import uuid
+import flask
+# Columnar cache of the IMGR sheet
+import loader
+# Reloads the IMGR sheet when it changes
+import watcher
+# Intraday offering changes
+import delta
+# rating names and display columns live with the normalized universe
+from universe import rating_names, col_names
+# Comment parsing, criteria and filtering
+import comments
+import screen
+# Server side paging of the results table
+import table
+# Columnar json and compression for result payloads
+import payload
+# Screening of whole request lists
+import batch
+# Browser side dropdown validators
+import clientside
+# Coalescing of rapid changes to the explanatory table
+import debounce
+# Open pm.py requests matched against new offerings
+import standing
+# Dealer quote feed and pushing changed rows to the browser
+import feed
+import push
 
 ###### Setup ######
 
-# Reads IMGR data from excel file
-df = pd.read_excel('IMGR1.xlsx')
-
-# Adds base CUSIP to data frame
-df['CUSIP6'] = df['CUSIP'].str[0:6]
-
 # list of ratings for PM to choose from
 ratings = [
     'AAA', 'AA+', 'AA', 'AA-', 'A+', 'A', 'A-', 'BBB+', 'BBB', 'BBB-', 'BB+',
@@ -79,27 +102,6 @@ usa = ["AL", "AK", "AZ", "AR", "CA", "CO", "CT", "DE", "DC", "FL", "GA", "HI",
           "WV", "WI", "WY",
           "AS", "GU", "MP", "PR", "VI", "UM", "FM", "FH", "PW"]
 
-# Dictionary to convert rating to number for comparison
-rating = {'AAA':1, 'AA1':2, 'AA2':3, 'AA3':4, 'A1':5, 'A2':6, 'A3':7, 'BAA1':8,
-        'BAA2':9, 'BAA3':10, 'BA1':11, 'BA2':12, 'BA3':13, 'B1':14, 'B2':15,
-        'B3':16, 'AA+':2, 'AA':3, 'AA-':4, 'A+':5, 'A':6, 'A-':7, 'BBB+':8,
-        'BBB':9, 'BBB-':10, 'BB+':11, 'BB':12, 'BB-':13, 'B+':14, 'B':15,
-        'B-':16
-        }
-
-# reverse dictionary to reconvert to rating
-moodyNum = {1:'AAA',2:'AA1',3:'AA2',4:'AA3',5:'A1',6:'A2',7:'A3',8:'BAA1',9:'BAA2',
-            10:'BAA3',11:'BA1',12:'BA2',13:'BA3',14:'B1',15:'B2',16:'B3',17:'CAA1',
-            18:'CAA2',19:'CAA3',20:'CA',21:'C'
-            }
-
-# list of columns to display to trader
-col_names = [
-        'CUSIP', 'CUSIP6', 'State', 'Coupon', 'Maturity', 'Ask Price', 'Ask Yield To Worst',
-        'Ask Size', 'Underlying Moody\'s Rating', 'Call Date', 'Issue Type',
-        'Ask Dealer', 'Ask Source'
-        ]
-
 # list of columns to display comment in nice format
 comment_names = [
     'Increment', 'Size ($)', 'General Market (Y/N)', 'State (include)', 'State (exclude)',
@@ -110,205 +112,123 @@ comment_names = [
 # External formatting to make site look nice
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
 
-app = dash.Dash(__name__, external_stylesheets = external_stylesheets)
-
-# main function that allows the dataframe to update based on comment
-def update_data(comment, dataframe):
-    # creates copy of dataframe to prevent filter from deleting original data
-    dataframe = dataframe[
-        [col for col in col_names]].copy()
-    # converts maturity to datetime object for date comparision
-    dataframe['Maturity'] = pd.to_datetime(dataframe['Maturity']).copy()
-    # if call date not specified, returns future call date of 150 years in the future
-    dataframe['Call Date'] = dataframe['Call Date'].apply(lambda x: x if x != '#N/A Field Not Applicable' else dt.today() + relativedelta(years = 150)).copy()
-    # converts call date to datetime object for date comparision
-    dataframe['Call Date'] = pd.to_datetime(dataframe['Call Date']).copy()
-
-    # replace WR (wasn't rated) to NA value for Moody rating
-    dataframe['Underlying Moody\'s Rating'].replace('WR', np.nan, inplace = True)
-    # removes all rows that don't have Moody's rating since traders don't look at those
-    dataframe = dataframe.loc[dataframe['Underlying Moody\'s Rating'].notnull()]
-    # converts rating to all upper case to match dictionary
-    dataframe['Underlying Moody\'s Rating'] = dataframe['Underlying Moody\'s Rating'].str.upper()
-    # converts rating to number
-    dataframe['Underlying Moody\'s Rating'].replace(rating, inplace = True)
-    # converts number rating to integer type for comparision
-    dataframe['Underlying Moody\'s Rating'] = dataframe['Underlying Moody\'s Rating'].astype(int)
+# compress gzips callback responses
+app = dash.Dash(__name__, external_stylesheets = external_stylesheets, compress=True)
+
+# seconds the browser waits for the explanatory table to settle before
+# screening, IMGR_DEBOUNCE=0 screens on every change (see debounce.py)
+DEBOUNCE = float(os.environ.get('IMGR_DEBOUNCE', '0.3'))
+# settled fields received and screens run by this process
+inputs = debounce.Inputs(DEBOUNCE)
+
+# Reads IMGR data (with base CUSIP) from the columnar cache of the excel file,
+# parsing the excel file only when the cache is missing or out of date, and
+# cleans it up (dates, ratings, callable flag) for screening
+# only the columns the dashboard uses are kept, in compact types
+# the sheet is checked every IMGR_RELOAD seconds (0 to turn off) and a
+# changed sheet is loaded in the background and swapped in as a new universe
+# version, callbacks take offerings.universe once and use it throughout
+RELOAD = float(os.environ.get('IMGR_RELOAD', '5'))
+offerings = watcher.OfferingWatcher('IMGR1.xlsx', loader.SCHEMA, RELOAD)
+
+
+# after a swap (a new sheet or a batch of changes) the bitmaps of the old
+# version are dropped, the new offerings are checked against the open pm.py
+# requests, and the sessions' results are moved to the new version with
+# their changed rows pushed to the browser; each is its own listener so a
+# failing one doesn't stop the others
+offerings.listeners.extend([
+    lambda old, new, rows: screen.masks.retire(new.version),
+    lambda old, new, rows: standing.notify(new, rows),
+    lambda old, new, rows: push.publish_changes(table.views, old, new, display_rows),
+])
+# dealer changes to offerings between sheets
+changes = delta.DeltaIngest()
+
+# applies a batch of changes to the current universe
+# Output: summary of the batch, see DeltaIngest.apply
+def apply_changes(frame):
+    return offerings.update(lambda universe: changes.apply(universe, frame))[2]
+
+# batches POSTed to /offerings go through a journal file per sheet shared by
+# the workers (named IMGR_JOURNAL-<sheet>.jsonl), so every worker applies
+# every batch of its sheet in the same order, see delta.Journal
+JOURNAL = os.environ.get('IMGR_JOURNAL', '.offerings_journal')
+journal = delta.Journal(JOURNAL, apply_changes, lambda: offerings.sheet)
+
+# journals a batch of quotes like a POSTed batch and applies it here
+def journal_quotes(frame):
+    journal.append(frame)
+    journal.catch_up()
+
+# quotes from the dealer feed (tail:<file>, tcp:<host>:<port> or
+# unix:<path>, see feed.py) go through the journal too; one worker at a time
+# reads the feed, the others apply its batches from the journal; streaming
+# is off when IMGR_FEED is not set
+FEED = os.environ.get('IMGR_FEED', '')
+quotes = None
+if FEED:
+    quotes = feed.QuoteFeed(feed.open_source(FEED), journal_quotes, lock=JOURNAL + '-feed.lock')
+
+# starts the sheet checks and the feed in the process serving the dashboard,
+# from the gunicorn post_fork hook or when run directly, so they don't run in
+# the preloaded master or in forked batch pool workers
+def start_background():
+    offerings.start()
+    journal.start()
+    if quotes is not None:
+        quotes.start()
+
+# converts filtered rows into nice format for trader to view
+# only called on the rows sent to the browser, each column is converted in
+# one vectorized step
+# priority ranks preferred state bonds ahead of general market ones
+def format_rows(dataframe, priority=None):
+    dataframe = dataframe[col_names].copy()
+    if priority is not None:
+        dataframe['Priority'] = priority
+    # converts call date into nice date format or not callable
+    dataframe['Call Date'] = dataframe['Call Date'].dt.strftime('%m/%d/%Y').fillna("Not Callable")
+    # converts maturity to nice date format that is more easily readable
+    dataframe['Maturity'] = dataframe['Maturity'].dt.strftime('%m/%d/%Y')
+    # converts number back to rating for trader to view
+    dataframe['Underlying Moody\'s Rating'] = rating_names[dataframe['Underlying Moody\'s Rating'].to_numpy()]
+    return dataframe
+
+# formatted rows as records for the data table
+def display(dataframe, priority=None):
+    return format_rows(dataframe, priority).to_dict('records')
+
+# records of universe rows, with the row id as the record id so pushed
+# changes can find their row on the page
+def display_rows(universe, rows, priority=None):
+    records = display(universe.frame.take(rows), priority)
+    for record, row in zip(records, rows.tolist()):
+        record['id'] = row
+    return records
+
+# screens the universe for a comment, keeping every matching row id
+# session lets a tightened screen refine the session's previous results
+def screen_view(comment, universe, session=None):
+    # parses comment into criteria, None for blank comment
+    criteria = screen.parse_comment(comment)
 
     # returns data if blank comment input
-    if comment == None or comment == '':
-        # converts future no call dates back into not callable format or nice date format for ease of understanding for trader
-        dataframe['Call Date'] = dataframe['Call Date'].apply(lambda x: dt.strftime(x, '%m/%d/%Y') if x.year != dt.today().year + 150 else "Not Callable")
-        # converts maturity to nice date format that is more easily readable
-        dataframe['Maturity'] = dataframe['Maturity'].apply(lambda x: dt.strftime(x, '%m/%d/%Y'))
-        # converts number back to rating for trader to view
-        dataframe['Underlying Moody\'s Rating'].replace(moodyNum, inplace=True)
-        # returns data to data table
-        return dataframe.to_dict('records')
-    else:
-        # split comment from template based on comma delimiter
-        lst = comment.split(',')
-
-        # muli state handling
-
-        # get indices of start and end of each list
-        start = [i for i, char in enumerate(lst) if '[' in char]
-        end = [i+1 for i, char in enumerate(lst) if ']' in char]
-        # if only mulit in either include or exlude state
-        if len(start) == 1:
-            lst[start[0]:end[0]] = [''.join(lst[start[0]:end[0]])]
-        # if both include and exclude have multi state
-        elif len(start) == 2:
-            lst[start[0]:end[0]] = [''.join(lst[start[0]:end[0]])]
-            start = [i for i, char in enumerate(lst) if '[' in char]
-            end = [i+1 for i, char in enumerate(lst) if ']' in char]
-            lst[start[1]:end[1]] = [''.join(lst[start[1]:end[1]])]
-        print(lst)
-        # convert string to list
-        lst[3] = lst[3].replace("'", '')
-        lst[4] = lst[4].replace("'", '')
-        lst[3] = lst[3].strip('][').split(' ')
-        lst[4] = lst[4].strip('][').split(' ')
-
-        print(lst)
-        #Set defaults for empty string/no input from template
-
-        # default for coupon min is 1
-        if lst[5] == '':
-            lst[5] = 1
-        else:
-            lst[5] = float(lst[5])
-
-        # default for coupon max is 10
-        if lst[6] == '':
-            lst[6] = 10
-        else:
-            lst[6] = float(lst[6])
-
-        # default for maturity min is current year
-        if lst[7] == '':
-            lst[7] = dt.now()
-        else:
-            lst[7] = dt.strptime(lst[7], '%Y')
-
-        # default for maturity max is 50 years in the future
-        if lst[8] == '':
-            lst[8] = dt.now() + relativedelta(years = 50)
-        else:
-            lst[8] = dt.strptime(lst[8] + ' 12 31', '%Y %m %d')
-        
-        # default for call date is current year
-        if lst[9] == '':
-            lst[9] = dt.now()
-        else:
-            lst[9] = dt.strptime(lst[9], '%Y')
-        
-        # default for rating min is investment grade
-        if lst[10] == '':
-            lst[10] = 16
-        else:
-            lst[10] = rating[lst[10].upper()]
-        
-        # default for rating max is AAA
-        if lst[11] == '':
-            lst[11] = 1
-        else:
-            lst[11] = rating[lst[11].upper()]
-
-        # if state preferred is not specified, return general market minus
-        # state to exclude
-        if lst[3][0] == '':
-            dataframe = dataframe[(dataframe['Ask Size'] >= float(lst[1])) &
-                                  (~dataframe['State'].isin(lst[4])) &
-                                  (dataframe['Coupon'] >= lst[5]) &
-                                  (dataframe['Coupon'] <= lst[6]) &
-                                  (dataframe['Maturity'] >= lst[7]) &
-                                  (dataframe['Maturity'] <= lst[8]) &
-                                  (dataframe['Call Date'] >= lst[9]) &
-                                  (dataframe['Underlying Moody\'s Rating'] <= lst[10]) &
-                                  (dataframe['Underlying Moody\'s Rating'] >= lst[11])]
-            # converts call date back into not callable from 150 years in the future or nice date format
-            dataframe['Call Date'] = dataframe['Call Date'].apply(lambda x: dt.strftime(x, '%m/%d/%Y') if x.year != dt.today().year + 150 else "Not Callable")
-            # converts maturity to nice date format
-            dataframe['Maturity'] = dataframe['Maturity'].apply(lambda x: dt.strftime(x, '%m/%d/%Y'))
-            # converts number back into rating
-            dataframe['Underlying Moody\'s Rating'].replace(moodyNum, inplace=True)
-            return dataframe.to_dict('records')
-        
-        # if preferred state and general market is yes, return matching results
-        elif lst[2] == 'Yes':
-            dataframe1 = dataframe[(dataframe['Ask Size'] >= float(lst[1])) &
-                                  (dataframe['State'].isin(lst[3])) &
-                                  (~dataframe['State'].isin(lst[4])) &
-                                  (dataframe['Coupon'] >= lst[5]) &
-                                  (dataframe['Coupon'] <= lst[6]) &
-                                  (dataframe['Maturity'] >= lst[7]) &
-                                  (dataframe['Maturity'] <= lst[8]) &
-                                  (dataframe['Call Date'] >= lst[9]) &
-                                  (dataframe['Underlying Moody\'s Rating'] <= lst[10]) &
-                                  (dataframe['Underlying Moody\'s Rating'] >= lst[11])]
-            dataframe2 = dataframe[(dataframe['Ask Size'] >= float(lst[1])) &
-                                #   (dataframe['State'].isin(lst[3])) &
-                                  (~dataframe['State'].isin(lst[4])) &
-                                  (dataframe['Coupon'] >= lst[5]) &
-                                  (dataframe['Coupon'] <= lst[6]) &
-                                  (dataframe['Maturity'] >= lst[7]) &
-                                  (dataframe['Maturity'] <= lst[8]) &
-                                  (dataframe['Call Date'] >= lst[9]) &
-                                  (dataframe['Underlying Moody\'s Rating'] <= lst[10]) &
-                                  (dataframe['Underlying Moody\'s Rating'] >= lst[11])]
-
-            dataframe1 = dataframe1.append(dataframe2, ignore_index=True)
-
-            dataframe1['Call Date'] = dataframe1['Call Date'].apply(lambda x: dt.strftime(x, '%m/%d/%Y') if x.year != dt.today().year + 150 else "Not Callable")
-            dataframe1['Maturity'] = dataframe1['Maturity'].apply(lambda x: dt.strftime(x, '%m/%d/%Y'))
-            dataframe1['Underlying Moody\'s Rating'].replace(moodyNum, inplace=True)
-            return dataframe1.to_dict('records')
-        # if no general allowed, include only preferred state
-        else:
-            dataframe = dataframe[(dataframe['State'].isin(lst[3])) &
-                                  (dataframe['Ask Size'] >= float(lst[1])) &
-                                  (~dataframe['State'].isin(lst[4])) &
-                                  (dataframe['Coupon'] >= lst[5]) &
-                                  (dataframe['Coupon'] <= lst[6]) &
-                                  (dataframe['Maturity'] >= lst[7]) &
-                                  (dataframe['Maturity'] <= lst[8]) &
-                                  (dataframe['Call Date'] >= lst[9]) &
-                                  (dataframe['Underlying Moody\'s Rating'] <= lst[10]) &
-                                  (dataframe['Underlying Moody\'s Rating'] >= lst[11])]
-
-            dataframe['Call Date'] = dataframe['Call Date'].apply(lambda x: dt.strftime(x, '%m/%d/%Y') if x.year != dt.today().year + 150 else "Not Callable")
-            dataframe['Maturity'] = dataframe['Maturity'].apply(lambda x: dt.strftime(x, '%m/%d/%Y'))
-            dataframe['Underlying Moody\'s Rating'].replace(moodyNum, inplace=True)
-            return dataframe.to_dict('records')
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+    if criteria is None:
+        return table.View(universe, universe.live_rows(), None)
+    rows = screen.run(criteria, universe, session=session)
+    return table.View(universe, rows, screen.priority(criteria, universe, rows), criteria)
 
+# main function that allows the dataframe to update based on comment
+# returns every matching row in nice format
+def update_data(comment, universe, session=None):
+    view = screen_view(comment, universe, session)
+    return display(universe.frame.take(view.rows), view.priority)
 
 
 # Beginning of web interface that is displayed by web browser
 
-app.layout = html.Div(children=[
+layout = html.Div(children=[
     # title of page
     html.H4('IMGR Dashboard'),
 
@@ -362,6 +282,8 @@ app.layout = html.Div(children=[
                             min=1,
                             max=50,
                             step=1,
+                            # sends the value on enter or leaving the box, not every keystroke
+                            debounce=DEBOUNCE > 0,
                             style={'width':60}
                         )
                     ),
@@ -374,6 +296,8 @@ app.layout = html.Div(children=[
                             min=10000,
                             max=1000000000,
                             step=1,
+                            # sends the value on enter or leaving the box, not every keystroke
+                            debounce=DEBOUNCE > 0,
                             style={'width':80}
                         )
                     ),
@@ -548,41 +472,96 @@ app.layout = html.Div(children=[
             id='IMGR_table',
             columns=[
                     {'name': c, 'id': c}
-                    for c in col_names
+                    for c in col_names + ['Priority']
                     ],
-            # Allows filtering/sorting of data table
-            filter_action='native',
-            sort_action='native',
+            # Allows filtering/sorting of data table, done on the server
+            filter_action='custom',
+            filter_query='',
+            sort_action='custom',
             sort_mode='multi',
-            # Restricts showing 25 results per page
-            page_action='native',
+            sort_by=[],
+            # Restricts showing 25 results per page, only the page is sent
+            page_action='custom',
+            page_current=0,
             page_size=25
             ),
+            # changes whenever a new screen is stored for the session
+            dcc.Store(id='screen'),
+            # the explanatory table once it settled, see debounce.py
+            *debounce.components('fields'),
+            # the page sent by the server and the session's stream of
+            # changed rows, both go into the table in the browser
+            *push.components('/stream/' if FEED else None),
+            # option lists the dropdown validators narrow in the browser
+            clientside.option_store({
+                'ratings': clientside.ranked(wells),
+                'years': clientside.plain(years),
+                'coupons': clientside.plain(coupon),
+                'states': clientside.plain(usa),
+            }),
 
     ],
         style={'display':'grid', 'grid-template-columns': '1fr 1fr',
                 'column-gap':'10px', 'margin-top':'-25px'}
         ),
 
+    # Batch screening of a whole pm.py export
+    html.Br(),
+    html.H5('Batch'),
+    dcc.Upload(
+        id='batch-upload',
+        children=html.Button('Upload pm.py export'),
+        multiple=False
+    ),
+    html.Div(id='batch-summary'),
+    html.A('Download results', id='batch-download', href='', download='batch.csv'),
+    dash_table.DataTable(
+        id='batch-table',
+        columns=[
+            {'name': c, 'id': c}
+            for c in ['Request', 'Comment', 'Matches', 'CUSIPs', 'Error']
+        ],
+        style_cell={'whiteSpace': 'normal', 'textAlign': 'left'},
+        page_size=25
+    ),
+
+    # New offerings matching open pm.py requests, newest first
+    html.Br(),
+    html.H5('New matches'),
+    html.Div(id='matches-summary'),
+    dash_table.DataTable(
+        id='matches-table',
+        columns=[
+            {'name': c, 'id': c}
+            for c in ['Time', 'CUSIP', 'Requests', 'Matched']
+        ],
+        style_cell={'whiteSpace': 'normal', 'textAlign': 'left'},
+        page_size=10
+    ),
+    dcc.Interval(id='matches-poll', interval=5000),
+
 ])
 
+# gives every page load its own session id so screens can be refined
+def serve_layout():
+    return html.Div([dcc.Store(id='session', data=str(uuid.uuid4())), layout])
+
+app.layout = serve_layout
+
 
 ###### Callbacks ######
 
 
-# call back that resets button click count when button is clicked
-# prevents constant dynamic updating that slows down app
-@app.callback(
-    [Output('submit', 'n_clicks'),
-    Output('filter', 'n_clicks')],
-    [Input('filter', 'n_clicks_timestamp'),
-    Input('submit', 'n_clicks_timestamp')]
-)
-def resetClicks(value, stamp):
-    time.sleep(1)
-    return 0, 0
+# id of the component whose change fired the running callback,
+# None on the initial call when the page loads
+def fired():
+    triggered = dash.callback_context.triggered
+    if not triggered or triggered[0]['prop_id'] == '.':
+        return None
+    return triggered[0]['prop_id'].split('.')[0]
 
 # takes comment and displays into explantory table
+# only runs when Submit is clicked, typing a comment sends nothing
 @app.callback(
     [Output('increment', 'value'),
     Output('size', 'value'),
@@ -603,17 +582,25 @@ def resetClicks(value, stamp):
     # Output('sector', 'value'),
     Output('manager', 'value')
     ],
-    [Input('submit', 'n_clicks'),
-    Input('ScreenName_Input', 'value')]
+    [Input('submit', 'n_clicks')],
+    [State('ScreenName_Input', 'value')]
 )
 def help(n_clicks, comment):
+    # nothing to do until Submit is clicked
+    if fired() != 'submit':
+        raise PreventUpdate
     # if comment is empty, return all data
     if (n_clicks > 0 and comment != None and comment != ''):
-        l = comment.split(',')
-        if len(l[3]) > 2:
-            l[3] = l[3].split(' ')
-        if len(l[4]) > 2:
-            l[4] = l[4].split(' ')
+        # same parser as the screen, a bad comment is shown in the manager
+        # comment box with the field and column at fault
+        try:
+            criteria = screen.parse_comment(comment)
+            l = [text for text, _ in comments.fields(comment)]
+        except comments.CommentError as e:
+            return [dash.no_update] * 13 + ['Error: %s' % e]
+        # state lists fill the multi select dropdowns
+        l[3] = list(criteria.include)
+        l[4] = list(criteria.exclude)
         return l[0], l[1], l[2], l[3], l[4], l[5], l[6], l[7], l[8], l[9], l[10], l[11], l[12], l[13]
     # if comment is pasted, display comment in explanatory table
     elif(n_clicks > 0 and (comment == None or comment == '')):
@@ -624,33 +611,50 @@ def help(n_clicks, comment):
         raise PreventUpdate
 
 
+# the browser hands the fields of the explanatory table to the screen once
+# they stopped changing, or at once when Refilter is clicked
+debounce.register(app, 'fields', 'filter', [
+    ('increment', 'value'),
+    ('size', 'value'),
+    ('general', 'value'),
+    ('stateIncl', 'value'),
+    ('stateExcl', 'value'),
+    ('couponMin', 'value'),
+    ('couponMax', 'value'),
+    # ('price', 'value'),
+    # ('yield', 'value'),
+    ('maturityMin', 'value'),
+    ('maturityMax', 'value'),
+    ('call', 'value'),
+    ('ratingMin', 'value'),
+    ('ratingMax', 'value'),
+    # ('accrued', 'value'),
+    ('settledate', 'date'),
+    # ('sector', 'value'),
+    ('manager', 'value'),
+], DEBOUNCE)
+
+
 # takes fields from explanatory table and filters based on fields
+# screens when Refilter is clicked, and on every field change once the
+# trader has filtered at least once
+# the matching rows stay on the server, the table is sent back to page 1
+# Input: [Refilter clicks, field values...] from debounce.register
 @app.callback(
-    Output('IMGR_table', 'data'),
-    # Output('IMGR_table', 'data'),
-    [   Input('filter', 'n_clicks'),
-        Input('increment', 'value'),
-        Input('size', 'value'),
-        Input('general', 'value'),
-        Input('stateIncl', 'value'),
-        Input('stateExcl', 'value'),
-        Input('couponMin', 'value'),
-        Input('couponMax', 'value'),
-        # Input('price', 'value'),
-        # Input('yield', 'value'),
-        Input('maturityMin', 'value'),
-        Input('maturityMax', 'value'),
-        Input('call', 'value'),
-        Input('ratingMin', 'value'),
-        Input('ratingMax', 'value'),
-        # Input('accrued', 'value'),
-        Input('settledate', 'date'),
-        # Input('sector', 'value'),
-        Input('manager', 'value')
-    ]
+    [Output('screen', 'data'),
+    Output('IMGR_table', 'page_current')],
+    [Input('fields', 'data')],
+    [State('session', 'data')]
 )
-def dynamic(n_clicks, increment, size, general, stateIncl, stateExcl, couponMin, couponMax,
-            maturityMin, maturityMax, call, ratingMin, ratingMax, settledate, manager):
+def dynamic(fields, session):
+    if fields is None:
+        raise PreventUpdate
+    inputs.receive()
+    (n_clicks, increment, size, general, stateIncl, stateExcl, couponMin, couponMax,
+     maturityMin, maturityMax, call, ratingMin, ratingMax, settledate, manager) = fields
+    # update prevention until the trader asks for a screen
+    if not n_clicks:
+        raise PreventUpdate
     # catch empty fields and converts to empty string
     if(increment == None):
         increment = ''
@@ -688,173 +692,175 @@ def dynamic(n_clicks, increment, size, general, stateIncl, stateExcl, couponMin,
             str(settledate) + ',' + str(manager)
                 )
     # checks validity of comment
-    if(n_clicks > 0 and str(increment) != '' and str(size) != '' and str(general) != ''):
-        return update_data(comment, df)
+    valid = n_clicks > 0 and str(increment) != '' and str(size) != '' and str(general) != ''
     # if blank comment, return all results
-    elif(n_clicks > 0 and str(increment) == '' and str(size) == '' and str(general) == ''):
-        return update_data('', df)
+    if(n_clicks > 0 and str(increment) == '' and str(size) == '' and str(general) == ''):
+        comment = ''
     # update prevention to speed up app
-    else:
+    elif not valid:
         raise PreventUpdate
-
-
-# Callback to restrict ratingMin range from ratingMax value
-@app.callback(
-    Output('ratingMin', 'options'),
-    [Input('ratingMax', 'value')]
-)
-def setRatingMin(rating):
-    if(rating == None or rating == ''):
-        return [
-            {'label':r, 'value':r}
-            for r in wells.keys()
-        ]
-    else:
-        return [
-            {'label':r, 'value':r}
-            for r in wells.keys() if wells[r] >= wells[rating]
-        ]
-
-# callback to restrict ratingMax range from ratingMin value
-@app.callback(
-    Output('ratingMax', 'options'),
-    [Input('ratingMin', 'value')]
-)
-def setRatingMax(rating):
-    if(rating == None or rating == ''):
-        return [
-            {'label':r, 'value':r}
-            for r in wells.keys()
-        ]
-    else:
-        return [
-            {'label':r, 'value':r}
-            for r in wells.keys() if wells[r] <= wells[rating]
-        ]
-
-# callback to restrict maturityMin range from maturityMax value
-@app.callback(
-    Output('maturityMin', 'options'),
-    [Input('maturityMax', 'value')]
-)
-def setMaturityMin(year):
     try:
-        year = int(year)
-    except:
-        year = year
-    if(year == None or year == ''):
-        return [
-            {'label':d, 'value':d}
-            for d in years
-        ]
-    else:
-        return [
-            {'label':d, 'value':d}
-            for d in years if d <= year
-        ]
-
-# callback to restrict maturityMax range from maturityMin value
-@app.callback(
-    Output('maturityMax', 'options'),
-    [Input('maturityMin', 'value')]
-)
-def setMaturityMax(year):
-    try:
-        year = int(year)
-    except:
-        year = year
-    if(year == None or year == ''):
-        return [
-            {'label':d, 'value':d}
-            for d in years
-        ]
-    else:
-        return [
-            {'label':d, 'value':d}
-            for d in years if d >= year
-        ]
+        view = screen_view(comment, offerings.universe, session)
+    except comments.CommentError:
+        raise PreventUpdate
+    table.views.put(session, view)
+    inputs.execute()
+    # the comment lets another worker rebuild the screen for the page callback
+    return {'rows': len(view.rows), 'time': time.time(), 'comment': comment}, 0
 
-# callback to restrict couponMin range from couponMax value
-@app.callback(
-    Output('couponMin', 'options'),
-    [Input('couponMax', 'value')]
-)
-def setMaturityMin(cpn):
-    try:
-        cpn = int(cpn)
-    except:
-        cpn = cpn
-    if(cpn == None or cpn == ''):
-        return [
-            {'label':c, 'value':c}
-            for c in coupon
-        ]
-    else:
-        return [
-            {'label':c, 'value':c}
-            for c in coupon if c <= cpn
-        ]
 
-# callback to restrict couponMax range from couponMin value
+# screens every request of an uploaded pm.py export
+# the table lists the first CUSIPs of each request, the download link has
+# them all
 @app.callback(
-    Output('couponMax', 'options'),
-    [Input('couponMin', 'value')]
+    [Output('batch-table', 'data'),
+    Output('batch-summary', 'children'),
+    Output('batch-download', 'href')],
+    [Input('batch-upload', 'contents')]
 )
-def setMaturityMax(cpn):
-    try:
-        cpn = int(cpn)
-    except:
-        cpn = cpn
-    if(cpn == None or cpn == ''):
-        return [
-            {'label':c, 'value':c}
-            for c in coupon
-        ]
-    else:
-        return [
-            {'label':c, 'value':c}
-            for c in coupon if c >= cpn
-        ]
-
-# callback to restrict stateExcl range from stateIncl value
+def screen_upload(contents):
+    if contents is None:
+        raise PreventUpdate
+    body = base64.b64decode(contents.split(',', 1)[1])
+    # a threaded worker doesn't fork a pool, large batches go through batch.py
+    results, summary = batch.screen_batch(comments.read_export(io.BytesIO(body)), offerings.universe,
+                                          processes=1)
+    frame = batch.as_frame(results)
+    href = 'data:text/csv;base64,' + base64.b64encode(frame.to_csv(index=False).encode('utf-8')).decode('ascii')
+    frame['CUSIPs'] = [' '.join(r['cusips'][:20]) + (' ...' if len(r['cusips']) > 20 else '')
+                       for r in results]
+    text = ('%(requests)d requests (%(distinct)d distinct, %(errors)d errors) screened in '
+            '%(seconds).3f s' % summary)
+    return frame.to_dict('records'), text, href
+
+
+# lists the latest new offerings that match open pm.py requests
+# polled, the open requests are read again when pm.py changed them
 @app.callback(
-    Output('stateExcl', 'options'),
-    [Input('stateIncl', 'value')]
+    [Output('matches-table', 'data'),
+    Output('matches-summary', 'children')],
+    [Input('matches-poll', 'n_intervals')]
 )
-def setStateExcl(state):
-    if(state == None or state == ''):
-        return [
-            {'label': s, 'value': s}
-            for s in usa
-        ]
-    else:
-        return [
-            {'label':s, 'value':s}
-            for s in usa if s not in state
-        ]
-
-# callback to restrict stateIncl range from stateExcl value
+def new_matches(n_intervals):
+    standing.open_requests.refresh()
+    rows = [{'Time': dt.fromtimestamp(m.time).strftime('%H:%M:%S'),
+             'CUSIP': m.cusip,
+             'Requests': len(m.requests),
+             'Matched': ' '.join(m.requests[:10]) + (' ...' if len(m.requests) > 10 else '')}
+            for m in standing.alerts.recent()]
+    text = ('%(requests)d open requests, %(checked)d new offerings checked, '
+            '%(matched)d matched' % standing.stats())
+    return rows, text
+
+
+# sends the page of the session's results the trader is looking at,
+# sorted and filtered on the server
+# the page goes into the table through the browser side of the stream,
+# which asks for it again when rows joined or left the results
 @app.callback(
-    Output('stateIncl', 'options'),
-    [Input('stateExcl', 'value')]
+    [Output(push.PAGE, 'data'),
+    Output('IMGR_table', 'page_count')],
+    [Input('screen', 'data'),
+    Input('IMGR_table', 'page_current'),
+    Input('IMGR_table', 'page_size'),
+    Input('IMGR_table', 'sort_by'),
+    Input('IMGR_table', 'filter_query'),
+    Input(push.REFRESH, 'data')],
+    [State('session', 'data')]
 )
-def setStateExcl(state):
-    if(state == None or state == ''):
-        return [
-            {'label': s, 'value': s}
-            for s in usa
-        ]
-    else:
-        return [
-            {'label':s, 'value':s}
-            for s in usa if s not in state
-        ]
-
-
+def page(screened, page_current, page_size, sort_by, filter_query, refresh, session):
+    # no screen yet for this session
+    if screened is None:
+        raise PreventUpdate
+    universe = offerings.universe
+    result = table.views.page(session, page_current, page_size, sort_by, filter_query)
+    # screened by another worker process or against an older sheet, screen
+    # it again here
+    if (result is None or result[0] is not universe) and 'comment' in screened:
+        table.views.put(session, screen_view(screened['comment'], universe, session))
+        result = table.views.page(session, page_current, page_size, sort_by, filter_query)
+    if result is None:
+        raise PreventUpdate
+    universe, rows, priority, page_count = result
+    return {'version': universe.version, 'rows': display_rows(universe, rows, priority)}, page_count
+
+push.register(app, 'IMGR_table')
+
+
+# Option narrowing for the min/max dropdowns runs in the browser
+# ratings keep the side of the partner's rank, years/coupons the side of the
+# partner's value, and included/excluded states leave out each other
+clientside.narrow(app, 'ratingMin', 'ratingMax', 'ratings', '>=')
+clientside.narrow(app, 'ratingMax', 'ratingMin', 'ratings', '<=')
+clientside.narrow(app, 'maturityMin', 'maturityMax', 'years', '<=')
+clientside.narrow(app, 'maturityMax', 'maturityMin', 'years', '>=')
+clientside.narrow(app, 'couponMin', 'couponMax', 'coupons', '<=')
+clientside.narrow(app, 'couponMax', 'couponMin', 'coupons', '>=')
+clientside.narrow(app, 'stateExcl', 'stateIncl', 'states', 'not in')
+clientside.narrow(app, 'stateIncl', 'stateExcl', 'states', 'not in')
+
+
+# cache counters for sizing, served as json
+@app.server.route('/stats')
+def stats():
+    return flask.jsonify({'masks': screen.masks.stats(),
+                          'results': screen.results.stats(),
+                          'sessions': screen.sessions.stats(),
+                          'inputs': inputs.stats(),
+                          'offerings': offerings.stats(),
+                          'changes': changes.stats(),
+                          'journal': journal.stats(),
+                          'standing': standing.stats(),
+                          'feed': quotes.stats() if quotes is not None else None,
+                          'streams': push.subscribers.stats(),
+                          'worker': os.getpid(),
+                          'memory': offerings.universe.memory()})
+
+# every row of the session's results in the table's sort/filter order, as
+# compressed columnar json for downloads and other programs
+@app.server.route('/results/<session>')
+def results(session):
+    result = table.views.ordered(session)
+    if result is None:
+        flask.abort(404)
+    universe, rows, priority = result
+    body, encoding = payload.encode(
+        payload.columnar(format_rows(universe.frame.take(rows), priority)),
+        flask.request.headers.get('Accept-Encoding', ''))
+    response = flask.Response(body, mimetype='application/json')
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+# applies a batch of offering changes (json list or csv with the sheet's
+# headers and an optional action column: insert, update or withdraw)
+# the batch is appended to the journal and this worker applies the journal
+# up to it, the other workers apply it when they next read the journal
+@app.server.route('/offerings', methods=['POST'])
+def change_offerings():
+    try:
+        frame = delta.read_delta(flask.request.get_data(), flask.request.content_type or '')
+    except ValueError as e:
+        return flask.jsonify({'error': str(e)}), 400
+    position = journal.append(frame)
+    journal.catch_up()
+    return flask.jsonify(journal.summary(position))
 
 
+# server-sent events with the changed rows of a session's results
+# every open stream holds a server thread, see the README for workers
+@app.server.route('/stream/<session>')
+def stream(session):
+    response = flask.Response(push.stream(session), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 
 if __name__ == '__main__':
+    journal.reset()
+    start_background()
     app.run_server(debug=False, port = 8051)
 #    webbrowser.open_new('http://127.0.0.1:8050/')
@@ -0,0 +1,16 @@
+# Production entry point for the trader dashboard
+# Run under a pre-fork WSGI server, e.g. gunicorn -c gunicorn.conf.py
+# With the app preloaded the master imports this module once, so the sheet is
+# read and the universe normalized a single time, and every forked worker
+# shares those pages copy-on-write instead of holding its own copy
+import gc
+
+import webapp
+
+# nothing writes into the shared arrays (the watcher loads universes
+# read-only), and the collector leaves the objects loaded so far alone, so
+# their pages are not copied into each worker
+# a sheet reloaded after the fork is loaded by every worker on its own
+gc.freeze()
+
+server = webapp.app.server